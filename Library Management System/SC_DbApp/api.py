@@ -0,0 +1,235 @@
+"""
+Versioned JSON API for the kiosk and mobile clients
+
+Clients sign in through POST /login like the web pages and send the session
+cookie with every call. Everything lives under /api/v1:
+
+  GET  /api/v1/books               ?category= or ?q=, &after=, &limit=, &fields=
+  GET  /api/v1/books/<book_id>     ?fields=
+  GET  /api/v1/borrows             ?after=, &limit=, &fields=   (your open borrows)
+  POST /api/v1/borrows             {"book_ids": [...], "due_date": "YYYY-MM-DD"}
+  POST /api/v1/borrows/return      {"borrow_ids": [...]}
+
+Lists answer {"data": [...], "next": cursor or null}; pass `next` back as
+`after` for the following page. Pages are keyset seeks, so every page costs
+the same however deep the client goes. `fields` is a comma-separated sparse
+fieldset; the id field is always included. The batch endpoints borrow or
+return every listed copy in one transaction, or nothing at all. Errors are
+{"error": message} with a 4xx status.
+"""
+import os
+from datetime import datetime, timedelta
+from functools import wraps
+
+from flask import current_app, jsonify, request, session
+from sqlalchemy import select
+
+import catalog
+import metrics
+from catalog_cache import catalog_cache
+from search import search_books
+from db_routing import read_only
+from http_caching import conditional
+from borrowing import borrow_books, return_borrows, BookUnavailable, BorrowNotFound
+from models import Book
+
+API_PREFIX = '/api/v1'
+API_MAX_PAGE_SIZE = int(os.getenv('API_MAX_PAGE_SIZE', '100'))
+API_MAX_BATCH_SIZE = int(os.getenv('API_MAX_BATCH_SIZE', '20'))
+MAX_BORROW_DAYS = 14
+
+BOOK_FIELDS = tuple(column.key for column in catalog.LISTING_COLUMNS)
+BORROW_FIELDS = ('borrow_id', 'borrow_date', 'due_date', 'return_date', 'book_id', 'title')
+
+
+class ApiError(Exception):
+    """Answered as {"error": message} with `status`, plus any `details`"""
+
+    def __init__(self, message, status=400, **details):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+        self.details = details
+
+
+def _json_value(value):
+    return value.isoformat() if isinstance(value, datetime) else value
+
+
+def _serialize(row, fields):
+    return {field: _json_value(getattr(row, field)) for field in fields}
+
+
+def _fieldset(allowed):
+    """The requested sparse fieldset, in `allowed` order; allowed[0] (the id) always"""
+    requested = request.args.get('fields')
+    if not requested:
+        return allowed
+    names = {name.strip() for name in requested.split(',') if name.strip()}
+    unknown = names - set(allowed)
+    if unknown:
+        raise ApiError(
+            f"Unknown fields: {', '.join(sorted(unknown))}. Available: {', '.join(allowed)}."
+        )
+    return tuple(field for field in allowed if field == allowed[0] or field in names)
+
+
+def _page_size():
+    try:
+        limit = int(request.args.get('limit', catalog.CATALOG_PAGE_SIZE))
+    except ValueError:
+        raise ApiError('limit must be an integer.')
+    if not 1 <= limit <= API_MAX_PAGE_SIZE:
+        raise ApiError(f'limit must be between 1 and {API_MAX_PAGE_SIZE}.')
+    return limit
+
+
+def _cursor(*types):
+    """The `after` cursor, checked against the position `types` of this listing"""
+    after = request.args.get('after')
+    if after and catalog.decode_cursor(after, *types) is None:
+        raise ApiError('Invalid cursor.')
+    return after
+
+
+def _id_list(payload, key):
+    ids = payload.get(key)
+    if (not isinstance(ids, list) or not ids
+            or not all(isinstance(i, int) and not isinstance(i, bool) for i in ids)):
+        raise ApiError(f'{key} must be a non-empty list of integer ids.')
+    if len(ids) > API_MAX_BATCH_SIZE:
+        raise ApiError(f'At most {API_MAX_BATCH_SIZE} {key} per request.')
+    return ids
+
+
+def _json_body():
+    payload = request.get_json(silent=True)
+    if not isinstance(payload, dict):
+        raise ApiError('Expected a JSON object body.')
+    return payload
+
+
+def login_required(role=None):
+    """Require a signed-in session (with `role`, if given), answering 401/403 in JSON"""
+    def decorator(view):
+        @wraps(view)
+        def decorated_function(*args, **kwargs):
+            if 'user_id' not in session:
+                raise ApiError('Please log in.', 401)
+            if role is not None and session.get('role') != role:
+                raise ApiError(f'Only {role} accounts can do this.', 403)
+            return view(*args, **kwargs)
+        return decorated_function
+    return decorator
+
+
+def register_api(app, db):
+    @app.errorhandler(ApiError)
+    def api_error(error):
+        return jsonify({'error': error.message, **error.details}), error.status
+
+    # ---------- BOOKS ----------
+    @app.route(f'{API_PREFIX}/books')
+    @read_only
+    @login_required()
+    @conditional()
+    def api_books():
+        fields = _fieldset(BOOK_FIELDS)
+        limit = _page_size()
+        query = request.args.get('q', '').strip()
+        category = request.args.get('category', '').strip()
+        if query and category:
+            raise ApiError('Use either q or category, not both.')
+
+        if query:
+            rows, next_cursor = search_books(query, _cursor(float, int), limit)
+        elif category:
+            rows, next_cursor = catalog.category_page(category, _cursor(str, int), limit)
+        else:
+            rows, next_cursor = catalog.book_page(_cursor(int), limit)
+        return jsonify({'data': [_serialize(row, fields) for row in rows], 'next': next_cursor})
+
+    @app.route(f'{API_PREFIX}/books/<int:book_id>')
+    @read_only
+    @login_required()
+    @conditional()
+    def api_book(book_id):
+        fields = _fieldset(BOOK_FIELDS)
+        row = db.session.execute(
+            select(*catalog.LISTING_COLUMNS).where(Book.book_id == book_id)
+        ).first()
+        if row is None:
+            raise ApiError('No such book.', 404)
+        return jsonify({'data': _serialize(row, fields)})
+
+    # ---------- BORROWS ----------
+    @app.route(f'{API_PREFIX}/borrows')
+    @read_only
+    @login_required('user')
+    @conditional()
+    def api_borrows():
+        fields = _fieldset(BORROW_FIELDS)
+        rows, next_cursor = catalog.borrow_history(
+            session['user_id'], _cursor(datetime.fromisoformat, int), _page_size()
+        )
+        return jsonify({'data': [_serialize(row, fields) for row in rows], 'next': next_cursor})
+
+    @app.route(f'{API_PREFIX}/borrows', methods=['POST'])
+    @login_required('user')
+    def api_borrow():
+        payload = _json_body()
+        book_ids = _id_list(payload, 'book_ids')
+        try:
+            due_date = datetime.strptime(str(payload.get('due_date')), "%Y-%m-%d")
+        except ValueError:
+            raise ApiError('due_date must be a YYYY-MM-DD date.')
+        if due_date > datetime.utcnow() + timedelta(days=MAX_BORROW_DAYS):
+            raise ApiError('Due date cannot exceed 2 weeks from today.')
+
+        borrow_date = datetime.now()
+        try:
+            # One copy per listed book, all in this transaction or none
+            borrows = borrow_books(session['user_id'], book_ids, due_date, borrow_date)
+            db.session.commit()
+        except BookUnavailable as e:
+            db.session.rollback()
+            raise ApiError('Some books are currently unavailable; nothing was borrowed.', 409,
+                           unavailable=sorted(set(e.args)))
+        except Exception:
+            db.session.rollback()
+            current_app.logger.exception('Batch borrow failed')
+            raise ApiError('Error processing borrow request.', 500)
+
+        metrics.record_borrow(len(borrows))
+        catalog_cache.availability_changed(*set(book_ids))
+        return jsonify({'data': [
+            {
+                'borrow_id': borrow.borrow_id,
+                'borrow_date': borrow_date.isoformat(),
+                'due_date': due_date.isoformat(),
+                'return_date': None,
+                'book_id': book_id,
+                'title': borrow.title,
+            }
+            for book_id, borrow in zip(book_ids, borrows)
+        ]}), 201
+
+    @app.route(f'{API_PREFIX}/borrows/return', methods=['POST'])
+    @login_required('user')
+    def api_return():
+        borrow_ids = list(dict.fromkeys(_id_list(_json_body(), 'borrow_ids')))
+        try:
+            returns = return_borrows(session['user_id'], borrow_ids)
+            db.session.commit()
+        except BorrowNotFound as e:
+            db.session.rollback()
+            raise ApiError('Some borrows are not yours or already returned; nothing was returned.',
+                           404, not_found=list(e.args))
+        except Exception:
+            db.session.rollback()
+            current_app.logger.exception('Batch return failed')
+            raise ApiError('Failed to return books.', 500)
+
+        metrics.record_return(len(returns))
+        catalog_cache.availability_changed(*{returned.book_id for returned in returns})
+        return jsonify({'data': [returned._asdict() for returned in returns]})
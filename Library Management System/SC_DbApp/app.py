@@ -3,15 +3,45 @@ from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
 from flask_migrate import Migrate
 
-from secrets_loader import get_db_credentials
+from secrets_loader import get_db_credentials, install_connect_hook, credential_provider
+from db_routing import RoutingSession, replica_bind_keys, init_read_replicas
 
-db = SQLAlchemy()
+db = SQLAlchemy(session_options={"class_": RoutingSession})
 migrate = Migrate()
 
+
+def _env_flag(name, default='false'):
+    return os.getenv(name, default).strip().lower() in ('1', 'true', 'yes', 'on')
+
+
+def engine_options_from_env():
+    """SQLAlchemy engine/pool options, tunable per deployment via the configmap
+
+    Every gunicorn worker in every replica opens its own pool, so
+    DB_POOL_SIZE + DB_MAX_OVERFLOW times workers times replicas must stay
+    under the RDS max_connections.
+    """
+    options = {
+        "pool_size": int(os.getenv("DB_POOL_SIZE", "5")),
+        "max_overflow": int(os.getenv("DB_MAX_OVERFLOW", "5")),
+        "pool_timeout": float(os.getenv("DB_POOL_TIMEOUT", "10")),
+        # Recycle before RDS/NAT idle timeouts and after failovers
+        "pool_recycle": int(os.getenv("DB_POOL_RECYCLE", "1800")),
+        # Test connections on checkout so stale ones are replaced transparently
+        "pool_pre_ping": _env_flag("DB_POOL_PRE_PING", "true"),
+        "connect_args": {"connect_timeout": int(os.getenv("DB_CONNECT_TIMEOUT", "5"))},
+    }
+    if _env_flag("DB_PGBOUNCER"):
+        # Behind PgBouncer (transaction pooling) keep no per-connection
+        # server state: skip the hstore OID lookup done on every new connection
+        options["use_native_hstore"] = False
+    return options
+
+
 def create_app():
     app = Flask(__name__, template_folder='templates')
 
-    # Load credentials from AWS Secrets Manager
+    # Load credentials from AWS Secrets Manager (cached; see secrets_loader)
     creds = get_db_credentials()
 
     DB_USER = creds["username"]
@@ -22,23 +52,93 @@ def create_app():
     DB_NAME = os.getenv("DB_NAME", "appdb")
     DB_PORT = os.getenv("DB_PORT", "5432")
 
-    # Build PostgreSQL URI
-    db_uri = (
-        f"postgresql+psycopg2://"
-        f"{DB_USER}:{DB_PASS}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
-    )
+    # Optional read replicas: comma-separated host or host:port list
+    DB_READ_HOSTS = [h.strip() for h in os.getenv("DB_READ_HOSTS", "").split(",") if h.strip()]
+
+    # Build PostgreSQL URIs
+    def build_uri(host, port=DB_PORT):
+        return (
+            f"postgresql+psycopg2://"
+            f"{DB_USER}:{DB_PASS}@{host}:{port}/{DB_NAME}"
+        )
+
+    db_uri = build_uri(DB_HOST)
+    replica_keys = replica_bind_keys(len(DB_READ_HOSTS))
 
     app.config["SQLALCHEMY_DATABASE_URI"] = db_uri
+    app.config["SQLALCHEMY_BINDS"] = {
+        key: build_uri(*host.split(":", 1))
+        for key, host in zip(replica_keys, DB_READ_HOSTS)
+    }
     app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = engine_options_from_env()
+
+    # Server-side (named) cursors hold state on one server connection for the
+    # whole read; PgBouncer mode turns them off in favour of keyset batches
+    app.config["DB_SERVER_SIDE_CURSORS"] = not _env_flag("DB_PGBOUNCER")
 
     app.config["SECRET_KEY"] = os.getenv("SECRET_KEY", "dev-secret-key")
 
     # Init extensions
     db.init_app(app)
     migrate.init_app(app, db)
+    if replica_keys:
+        init_read_replicas(app, replica_keys)
+
+    # New pool connections always use the current (possibly rotated) password
+    with app.app_context():
+        for engine in db.engines.values():
+            install_connect_hook(engine)
 
     # Register routes
     from routes import register_routes
     register_routes(app, db)
 
+    # JSON API for the kiosk and mobile clients
+    from api import register_api
+    register_api(app, db)
+
+    # Fingerprinted static assets and compressed responses
+    from assets import init_assets
+    from compression import init_response_compression
+    init_assets(app)
+    init_response_compression(app)
+
+    # Register CLI commands
+    from commands import register_commands
+    register_commands(app, db)
+
+    # Request and SQL instrumentation, /metrics, and gauges reconciled off the request path
+    from metrics import (
+        init_request_metrics, init_query_metrics, init_pool_metrics, start_metrics_reconciler
+    )
+    init_request_metrics(app)
+    init_query_metrics(app)
+    init_pool_metrics()
+
+    # With gunicorn --preload this runs once in the master; threads and
+    # connections must not cross the fork, so they start in post_fork instead
+    if not _env_flag("APP_PRELOAD"):
+        start_background_tasks(app)
+
     return app
+
+
+def start_background_tasks(app):
+    """Start the per-process daemon threads (credential refresh, gauge reconciler)"""
+    from metrics import start_metrics_reconciler
+    credential_provider.start_background_refresh()
+    start_metrics_reconciler(app, db)
+
+
+def after_fork(app):
+    """Make a preloaded app safe to use in a freshly forked worker
+
+    Pooled connections opened by the master are dropped without closing
+    them (close=False), since the master still owns those sockets, and the
+    background threads, which do not survive fork(), are started again.
+    """
+    with app.app_context():
+        for engine in db.engines.values():
+            engine.dispose(close=False)
+    start_background_tasks(app)
@@ -0,0 +1,158 @@
+"""
+Fingerprinted, precompressed static assets
+
+`python assets.py`, run when the image is built (see the Dockerfile),
+copies static/ to static_dist/ with a content hash in every file name,
+points the url(...) references inside stylesheets at the hashed names,
+stores .br/.gz variants of the compressible files next to them and writes
+manifest.json. Templates link assets with asset_url('css/style.css'), which
+names the hashed file under /assets/. Those responses never change, so they
+are sent with a year-long, immutable Cache-Control and in the best
+precompressed variant the client accepts. Without a build (local
+development) asset_url falls back to the plain /static/ URL.
+"""
+import hashlib
+import json
+import mimetypes
+import os
+import posixpath
+import re
+import shutil
+import sys
+
+from flask import abort, send_from_directory, url_for
+
+from compression import COMPRESSIBLE_TYPES, ENCODINGS, ENCODING_SUFFIXES, choose_encoding, compress
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+ASSETS_SOURCE_DIR = os.path.join(APP_DIR, 'static')
+ASSETS_DIR = os.getenv('ASSETS_DIR', os.path.join(APP_DIR, 'static_dist'))
+ASSETS_URL_PATH = '/assets'
+ASSET_MAX_AGE = 365 * 24 * 3600
+MANIFEST_NAME = 'manifest.json'
+FINGERPRINT_LENGTH = 12
+
+_CSS_URL = re.compile(r"""url\(\s*(['"]?)([^'")]+)\1\s*\)""")
+_FINGERPRINT = re.compile(r'^(.*)\.[0-9a-f]{%d}(\.[^./]+)$' % FINGERPRINT_LENGTH)
+
+
+def _mimetype(name):
+    return mimetypes.guess_type(name)[0] or 'application/octet-stream'
+
+
+def _rewrite_css_urls(name, css, manifest):
+    """Point url(...) references to already built files at their hashed names"""
+    def replace(match):
+        target = match.group(2).strip()
+        if target.startswith('/static/'):
+            target = target[len('/static/'):]
+        elif target.startswith(('/', 'data:', 'http:', 'https:')):
+            return match.group(0)
+        else:
+            target = posixpath.normpath(posixpath.join(posixpath.dirname(name), target))
+        entry = manifest.get(target)
+        if entry is None:
+            return match.group(0)
+        return f"url('{ASSETS_URL_PATH}/{entry['path']}')"
+    return _CSS_URL.sub(replace, css)
+
+
+def build_assets(source_dir=ASSETS_SOURCE_DIR, out_dir=ASSETS_DIR):
+    """Write the fingerprinted and precompressed copy of source_dir to out_dir; return the manifest"""
+    if os.path.isdir(out_dir):
+        if os.listdir(out_dir) and not os.path.exists(os.path.join(out_dir, MANIFEST_NAME)):
+            raise RuntimeError(f'{out_dir} is not empty and holds no asset build; not replacing it')
+        shutil.rmtree(out_dir)
+
+    names = sorted(
+        os.path.relpath(os.path.join(root, filename), source_dir).replace(os.sep, '/')
+        for root, _, filenames in os.walk(source_dir) for filename in filenames
+    )
+    # Stylesheets last, so the files they reference already have their final names
+    names.sort(key=lambda name: name.endswith('.css'))
+
+    manifest = {}
+    for name in names:
+        with open(os.path.join(source_dir, name), 'rb') as f:
+            data = f.read()
+        if name.endswith('.css'):
+            data = _rewrite_css_urls(name, data.decode('utf-8'), manifest).encode('utf-8')
+
+        stem, extension = posixpath.splitext(name)
+        path = f'{stem}.{hashlib.sha256(data).hexdigest()[:FINGERPRINT_LENGTH]}{extension}'
+        variants = {path: data}
+        encodings = []
+        if _mimetype(name) in COMPRESSIBLE_TYPES:
+            for encoding in ENCODINGS:
+                compressed = compress(data, encoding, best=True)
+                if len(compressed) < len(data):
+                    variants[path + ENCODING_SUFFIXES[encoding]] = compressed
+                    encodings.append(encoding)
+
+        for variant, content in variants.items():
+            target = os.path.join(out_dir, *variant.split('/'))
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            with open(target, 'wb') as f:
+                f.write(content)
+        manifest[name] = {'path': path, 'encodings': encodings}
+
+    with open(os.path.join(out_dir, MANIFEST_NAME), 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    return manifest
+
+
+def load_manifest(out_dir=ASSETS_DIR):
+    """Return {logical name: {'path': hashed name, 'encodings': [...]}}, empty without a build"""
+    try:
+        with open(os.path.join(out_dir, MANIFEST_NAME)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def init_assets(app, out_dir=ASSETS_DIR):
+    """Give templates asset_url() and serve the built assets under /assets"""
+    manifest = load_manifest(out_dir)
+    names_by_path = {entry['path']: name for name, entry in manifest.items()}
+
+    def asset_url(name):
+        entry = manifest.get(name)
+        if entry is None:
+            return url_for('static', filename=name)
+        return f"{ASSETS_URL_PATH}/{entry['path']}"
+
+    def asset(filename):
+        name = names_by_path.get(filename)
+        current = name is not None
+        if not current:
+            # Another build's hash, e.g. from a page an older pod rendered
+            # during a rollout: serve this build's file, but not as immutable
+            match = _FINGERPRINT.match(filename)
+            name = match.group(1) + match.group(2) if match else None
+            if name not in manifest:
+                abort(404)
+
+        entry = manifest[name]
+        encoding = choose_encoding(entry['encodings'])
+        path = entry['path'] + (ENCODING_SUFFIXES[encoding] if encoding else '')
+        response = send_from_directory(out_dir, path, mimetype=_mimetype(name), conditional=True)
+        response.vary.add('Accept-Encoding')
+        if encoding:
+            response.content_encoding = encoding
+        if current:
+            response.cache_control.no_cache = None
+            response.cache_control.public = True
+            response.cache_control.max_age = ASSET_MAX_AGE
+            response.cache_control.immutable = True
+        else:
+            response.cache_control.no_cache = True
+        return response
+
+    app.add_template_global(asset_url)
+    app.add_url_rule(f'{ASSETS_URL_PATH}/<path:filename>', 'asset', asset)
+    return manifest
+
+
+if __name__ == '__main__':
+    built = build_assets(*sys.argv[1:3])
+    print(f'Built {len(built)} assets into {sys.argv[2] if len(sys.argv) > 2 else ASSETS_DIR}')
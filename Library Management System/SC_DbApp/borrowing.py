@@ -0,0 +1,161 @@
+"""
+Borrow operations that stay correct under concurrent requests
+
+A copy is claimed with a locking read that skips rows other transactions
+already hold, and the transaction row is inserted in the same database
+transaction. On PostgreSQL both steps are a single statement. The book's
+available_copies counter follows the copy's status change by itself (see the
+availability triggers in models.py).
+
+The batch operations (borrow_books, return_borrows) touch the books in
+ascending book_id order, so two batches over overlapping books queue on
+each other instead of deadlocking.
+"""
+from collections import namedtuple
+
+from sqlalchemy import select, update, insert, delete, text
+
+from app import db
+from models import Book, BookCopy, BorrowTransaction
+
+Borrow = namedtuple('Borrow', ['borrow_id', 'copy_id', 'title'])
+Return = namedtuple('Return', ['borrow_id', 'book_id', 'title'])
+
+
+class BookUnavailable(Exception):
+    """Raised when no copy of the requested book can be claimed"""
+
+
+class BorrowNotFound(Exception):
+    """Raised when a borrow to return does not exist or belongs to another user"""
+
+
+# Claim and record in one round trip. SKIP LOCKED lets concurrent
+# borrowers of the same title each take a different copy instead of queueing
+# on (or double-claiming) the first one.
+_PG_BORROW = text("""
+    WITH claimed AS (
+        UPDATE book_copy SET status = 'borrowed'
+        WHERE status = 'available' AND copy_id = (
+            SELECT copy_id FROM book_copy
+            WHERE book_id = :book_id AND status = 'available'
+            ORDER BY copy_id
+            LIMIT 1
+            FOR UPDATE SKIP LOCKED
+        )
+        RETURNING copy_id, book_id
+    )
+    INSERT INTO borrow_transaction (user_id, copy_id, borrow_date, due_date)
+    SELECT :user_id, claimed.copy_id, :borrow_date, :due_date FROM claimed
+    RETURNING borrow_id, copy_id, (SELECT title FROM book WHERE book_id = :book_id) AS title
+""")
+
+
+def borrow_book(user_id, book_id, due_date, borrow_date):
+    """Claim an available copy of `book_id` for `user_id` and record the borrow
+
+    Runs inside the caller's transaction; the caller commits or rolls back.
+    Raises BookUnavailable when every copy is borrowed or being claimed.
+    """
+    params = {
+        'user_id': user_id,
+        'book_id': book_id,
+        'borrow_date': borrow_date,
+        'due_date': due_date,
+    }
+    if db.session.get_bind().dialect.name == 'postgresql':
+        row = db.session.execute(_PG_BORROW, params).first()
+        if row is None:
+            raise BookUnavailable(book_id)
+        return Borrow(row.borrow_id, row.copy_id, row.title)
+    return _borrow_portable(**params)
+
+
+def _borrow_portable(user_id, book_id, due_date, borrow_date):
+    # Same steps as _PG_BORROW, one statement each, for other dialects
+    copy_id = db.session.execute(
+        select(BookCopy.copy_id)
+        .where(BookCopy.book_id == book_id, BookCopy.status == 'available')
+        .order_by(BookCopy.copy_id)
+        .limit(1)
+        .with_for_update(skip_locked=True)
+    ).scalar()
+    if copy_id is None:
+        raise BookUnavailable(book_id)
+
+    # Conditional update: only one transaction can flip a given copy
+    claimed = db.session.execute(
+        update(BookCopy)
+        .where(BookCopy.copy_id == copy_id, BookCopy.status == 'available')
+        .values(status='borrowed')
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    if not claimed:
+        raise BookUnavailable(book_id)
+
+    borrow_id = db.session.execute(
+        insert(BorrowTransaction)
+        .values(user_id=user_id, copy_id=copy_id, borrow_date=borrow_date, due_date=due_date)
+        .returning(BorrowTransaction.borrow_id)
+    ).scalar_one()
+    title = db.session.execute(select(Book.title).where(Book.book_id == book_id)).scalar()
+    return Borrow(borrow_id, copy_id, title)
+
+
+def borrow_books(user_id, book_ids, due_date, borrow_date):
+    """Borrow one copy per entry of `book_ids` (repeat an id for several copies)
+
+    Runs inside the caller's transaction and returns the Borrows in request
+    order. Raises BookUnavailable with every book that could not be claimed,
+    after which the caller must roll back.
+    """
+    order = sorted(range(len(book_ids)), key=lambda i: book_ids[i])
+    borrows, unavailable = [None] * len(book_ids), []
+    for i in order:
+        try:
+            borrows[i] = borrow_book(user_id, book_ids[i], due_date, borrow_date)
+        except BookUnavailable:
+            unavailable.append(book_ids[i])
+    if unavailable:
+        raise BookUnavailable(*unavailable)
+    return borrows
+
+
+def return_borrows(user_id, borrow_ids):
+    """Return the given borrows of `user_id`: free their copies and drop the records
+
+    Runs inside the caller's transaction and returns one Return per borrow.
+    Raises BorrowNotFound with the ids that are not open borrows of this user.
+    """
+    rows = db.session.execute(
+        select(BorrowTransaction.borrow_id, BorrowTransaction.copy_id, Book.book_id, Book.title)
+        .join(BookCopy, BookCopy.copy_id == BorrowTransaction.copy_id)
+        .join(Book, Book.book_id == BookCopy.book_id)
+        .where(BorrowTransaction.user_id == user_id, BorrowTransaction.borrow_id.in_(borrow_ids))
+        .order_by(Book.book_id, BorrowTransaction.borrow_id)
+        .with_for_update(of=BorrowTransaction)
+    ).all()
+    missing = set(borrow_ids) - {row.borrow_id for row in rows}
+    if missing:
+        raise BorrowNotFound(*sorted(missing))
+
+    # The availability trigger updates every affected book in one statement,
+    # in no particular order; take those row locks in book_id order first
+    db.session.execute(
+        select(Book.book_id)
+        .where(Book.book_id.in_({row.book_id for row in rows}))
+        .order_by(Book.book_id)
+        .with_for_update(key_share=True)
+    ).all()
+    db.session.execute(
+        update(BookCopy)
+        .where(BookCopy.copy_id.in_([row.copy_id for row in rows]))
+        .values(status='available')
+        .execution_options(synchronize_session=False)
+    )
+    db.session.execute(
+        delete(BorrowTransaction)
+        .where(BorrowTransaction.borrow_id.in_(borrow_ids))
+        .execution_options(synchronize_session=False)
+    )
+    return [Return(row.borrow_id, row.book_id, row.title) for row in rows]
@@ -0,0 +1,246 @@
+"""
+Catalog query helpers shared by the dashboards, metrics and APIs
+
+Every helper here answers its question with a constant number of queries and
+a bounded number of rows, no matter how large the catalog grows.
+"""
+import base64
+import binascii
+import json
+import os
+from datetime import datetime
+
+from sqlalchemy import func, select, and_, tuple_, union_all
+
+from app import db
+from models import User, Book, BookCopy, BorrowTransaction
+
+UNCATEGORIZED = 'Uncategorized'
+
+CATALOG_PAGE_SIZE = int(os.getenv('CATALOG_PAGE_SIZE', '25'))
+HISTORY_PAGE_SIZE = int(os.getenv('HISTORY_PAGE_SIZE', '50'))
+
+# Columns the catalog listings render; pages are loaded as plain rows with
+# just these columns instead of hydrating full Book instances.
+LISTING_COLUMNS = (
+    Book.book_id,
+    Book.title,
+    Book.author,
+    Book.isbn,
+    Book.category,
+    Book.available_copies,
+)
+
+
+def book_availability(book_ids=None):
+    """Return {book_id: available copies} for the given books (or all books)"""
+    query = db.session.query(Book.book_id, Book.available_copies)
+    if book_ids is not None:
+        book_ids = list(book_ids)
+        if not book_ids:
+            return {}
+        query = query.filter(Book.book_id.in_(book_ids))
+    return {book_id: count for book_id, count in query.all()}
+
+
+def category_availability():
+    """Return {category: {'books': n, 'available': m}} in one grouped query"""
+    rows = (
+        db.session.query(
+            Book.category,
+            func.count(Book.book_id),
+            func.coalesce(func.sum(Book.available_copies), 0),
+        )
+        .group_by(Book.category)
+        .all()
+    )
+
+    stats = {}
+    for category, books, available in rows:
+        key = category or UNCATEGORIZED
+        entry = stats.setdefault(key, {'books': 0, 'available': 0})
+        entry['books'] += books
+        entry['available'] += available
+    return stats
+
+
+def copy_status_counts(book_id):
+    """Return {status: (copies, open_borrows)} for one book's copies"""
+    rows = (
+        db.session.query(
+            BookCopy.status,
+            func.count(func.distinct(BookCopy.copy_id)),
+            func.count(BorrowTransaction.borrow_id),
+        )
+        .outerjoin(
+            BorrowTransaction,
+            and_(
+                BorrowTransaction.copy_id == BookCopy.copy_id,
+                BorrowTransaction.return_date.is_(None),
+            ),
+        )
+        .filter(BookCopy.book_id == book_id)
+        .group_by(BookCopy.status)
+        .all()
+    )
+    return {status: (copies, borrows) for status, copies, borrows in rows}
+
+
+def library_totals():
+    """Return the headline library counts in a single round trip"""
+    def count(model, *criteria):
+        return select(func.count()).select_from(model).where(*criteria).scalar_subquery()
+
+    available = select(func.coalesce(func.sum(Book.available_copies), 0)).scalar_subquery()
+
+    row = db.session.execute(
+        select(
+            count(Book).label('books'),
+            available.label('available_copies'),
+            count(BookCopy, BookCopy.status == 'borrowed').label('borrowed_copies'),
+            count(User).label('users'),
+            count(BorrowTransaction, BorrowTransaction.return_date.is_(None)).label('active_borrows'),
+            count(BorrowTransaction, BorrowTransaction.return_date.is_(None),
+                  BorrowTransaction.due_date < datetime.utcnow()).label('overdue_borrows'),
+        )
+    ).one()
+    return dict(row._mapping)
+
+
+# ---------- KEYSET PAGINATION ----------
+# Books are browsed in (category, title, book_id) order. Each category has its
+# own opaque cursor holding the (title, book_id) of the last book shown, so a
+# page is always an index seek plus LIMIT, however deep the reader goes.
+
+def encode_cursor(*values):
+    payload = json.dumps(values, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(payload).decode('ascii').rstrip('=')
+
+
+def decode_cursor(token, *types):
+    """Return the cursor values coerced to `types`, or None if missing or malformed"""
+    if not token:
+        return None
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+        if len(values) != len(types):
+            return None
+        return tuple(cast(value) for cast, value in zip(types, values))
+    except (binascii.Error, ValueError, TypeError, UnicodeError):
+        return None
+
+
+def _category_clause(category):
+    if category == UNCATEGORIZED:
+        return Book.category.is_(None)
+    return Book.category == category
+
+
+def _sort_categories(names):
+    # Named categories alphabetically, the catch-all bucket last
+    return sorted(names, key=lambda name: (name == UNCATEGORIZED, name))
+
+
+def category_names():
+    """Return every category that currently holds at least one book"""
+    names = {row[0] or UNCATEGORIZED for row in db.session.query(Book.category).distinct()}
+    return _sort_categories(names)
+
+
+def _page_statement(category, after, limit):
+    stmt = select(*LISTING_COLUMNS).where(_category_clause(category))
+    if after is not None:
+        stmt = stmt.where(tuple_(Book.title, Book.book_id) > tuple_(*after))
+    # Fetch one extra row to know whether another page exists
+    return stmt.order_by(Book.title, Book.book_id).limit(limit + 1)
+
+
+def _split_page(books, limit):
+    if len(books) > limit:
+        last = books[limit - 1]
+        return books[:limit], encode_cursor(last.title, last.book_id)
+    return books, None
+
+
+def category_page(category, after=None, limit=CATALOG_PAGE_SIZE):
+    """Return (rows, next_cursor) for one category, seeking past the `after` cursor"""
+    stmt = _page_statement(category, decode_cursor(after, str, int), limit)
+    books = db.session.execute(stmt).all()
+    return _split_page(books, limit)
+
+
+def book_page(after=None, limit=CATALOG_PAGE_SIZE):
+    """Return (rows, next_cursor) over the whole catalog in book_id order"""
+    stmt = select(*LISTING_COLUMNS)
+    position = decode_cursor(after, int)
+    if position is not None:
+        stmt = stmt.where(Book.book_id > position[0])
+    books = db.session.execute(stmt.order_by(Book.book_id).limit(limit + 1)).all()
+    if len(books) > limit:
+        return books[:limit], encode_cursor(books[limit - 1].book_id)
+    return books, None
+
+
+def first_pages(categories=None, limit=CATALOG_PAGE_SIZE):
+    """Return {category: (rows, next_cursor)} with the first page of each category
+
+    All categories are fetched with one UNION ALL of per-category LIMIT queries,
+    so the result is bounded by len(categories) * limit rows.
+    """
+    if categories is None:
+        categories = category_names()
+    if not categories:
+        return {}
+
+    parts = [
+        select(_page_statement(category, None, limit).subquery())
+        for category in categories
+    ]
+    grouped = {category: [] for category in categories}
+    for book in db.session.execute(union_all(*parts)):
+        grouped.setdefault(book.category or UNCATEGORIZED, []).append(book)
+
+    pages = {}
+    for category in _sort_categories(grouped):
+        books = sorted(grouped[category], key=lambda b: (b.title, b.book_id))
+        if books:
+            pages[category] = _split_page(books, limit)
+    return pages
+
+
+# ---------- BORROW HISTORY ----------
+
+def borrow_history(user_id, after=None, limit=HISTORY_PAGE_SIZE):
+    """Return (rows, next_cursor) of a user's borrows, newest first
+
+    Each row carries the borrow columns plus the book title, joined in the
+    same statement so rendering never lazy-loads book_copy or book.
+    """
+    stmt = (
+        select(
+            BorrowTransaction.borrow_id,
+            BorrowTransaction.borrow_date,
+            BorrowTransaction.due_date,
+            BorrowTransaction.return_date,
+            Book.book_id,
+            Book.title,
+        )
+        .join(BookCopy, BookCopy.copy_id == BorrowTransaction.copy_id)
+        .join(Book, Book.book_id == BookCopy.book_id)
+        .where(BorrowTransaction.user_id == user_id)
+    )
+    position = decode_cursor(after, datetime.fromisoformat, int)
+    if position is not None:
+        stmt = stmt.where(
+            tuple_(BorrowTransaction.borrow_date, BorrowTransaction.borrow_id) < tuple_(*position)
+        )
+    stmt = stmt.order_by(
+        BorrowTransaction.borrow_date.desc(), BorrowTransaction.borrow_id.desc()
+    ).limit(limit + 1)
+
+    rows = db.session.execute(stmt).all()
+    if len(rows) > limit:
+        last = rows[limit - 1]
+        return rows[:limit], encode_cursor(last.borrow_date.isoformat(), last.borrow_id)
+    return rows, None
@@ -0,0 +1,343 @@
+"""
+Cache of the catalog pages the user dashboard renders
+
+Holds each category's listing pages (without availability), every book's
+available copy count, and the category list, in the backend chosen by
+CATALOG_CACHE_BACKEND:
+
+  * lru:   in-process, bounded by CATALOG_CACHE_MAX_ENTRIES. Each worker
+           process has its own, so a change made through one worker reaches
+           the others within CATALOG_CACHE_TTL seconds.
+  * redis: shared by every worker and pod (CATALOG_CACHE_REDIS_URL), so
+           invalidation is immediate everywhere.
+  * none:  caching disabled.
+
+Invalidation is precise. A borrow or return drops that book's availability
+entry. Adding, editing or deleting a book gives its category (both
+categories, for a move) a new generation token, which orphans that
+category's cached pages, and drops the category list. A bulk import replaces
+the global token. Tokens are random, so a token lost to eviction can never
+revive stale entries. Any backend error falls through to the database.
+Misses are loaded from the primary, never a lagging replica, so no entry is
+older than CATALOG_CACHE_TTL.
+"""
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict, namedtuple
+
+import catalog
+import metrics
+from db_routing import use_primary
+
+logger = logging.getLogger(__name__)
+
+CATALOG_CACHE_BACKEND = os.getenv('CATALOG_CACHE_BACKEND', 'lru')
+CATALOG_CACHE_TTL = float(os.getenv('CATALOG_CACHE_TTL', '30'))
+CATALOG_CACHE_MAX_ENTRIES = int(os.getenv('CATALOG_CACHE_MAX_ENTRIES', '10000'))
+CATALOG_CACHE_REDIS_URL = os.getenv('CATALOG_CACHE_REDIS_URL', 'redis://localhost:6379/0')
+
+# A slow cache must not be slower than the query it saves
+CATALOG_CACHE_REDIS_TIMEOUT = float(os.getenv('CATALOG_CACHE_REDIS_TIMEOUT', '0.1'))
+
+# Same fields, in the same order, as catalog.LISTING_COLUMNS
+CatalogRow = namedtuple('CatalogRow', [column.key for column in catalog.LISTING_COLUMNS])
+_LISTING_FIELDS = CatalogRow._fields[:-1]  # pages are cached without availability
+
+
+class LRUBackend:
+    """In-process least-recently-used store with per-entry expiry"""
+
+    def __init__(self, max_entries=CATALOG_CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # key -> (value, expires_at or None)
+        self._lock = threading.Lock()
+
+    def get_many(self, keys):
+        found = {}
+        now = time.monotonic()
+        with self._lock:
+            for key in keys:
+                entry = self._entries.get(key)
+                if entry is None:
+                    continue
+                value, expires_at = entry
+                if expires_at is not None and expires_at <= now:
+                    del self._entries[key]
+                    metrics.catalog_cache_evictions_total.labels(reason='expired').inc()
+                    continue
+                self._entries.move_to_end(key)
+                found[key] = value
+        return found
+
+    def set_many(self, mapping, ttl=None):
+        expires_at = time.monotonic() + ttl if ttl else None
+        with self._lock:
+            for key, value in mapping.items():
+                self._entries[key] = (value, expires_at)
+                self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                metrics.catalog_cache_evictions_total.labels(reason='capacity').inc()
+
+    def add(self, key, value):
+        """Store value unless key exists; return the stored value"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] is None:
+                return entry[0]
+        self.set_many({key: value})
+        return value
+
+    def delete(self, keys):
+        with self._lock:
+            for key in keys:
+                self._entries.pop(key, None)
+
+
+class RedisBackend:
+    """Store shared through Redis (or anything speaking its protocol)"""
+
+    def __init__(self, url=CATALOG_CACHE_REDIS_URL, timeout=CATALOG_CACHE_REDIS_TIMEOUT):
+        import redis  # only needed when this backend is configured
+
+        self.client = redis.Redis.from_url(
+            url, socket_timeout=timeout, socket_connect_timeout=timeout
+        )
+
+    def get_many(self, keys):
+        values = self.client.mget(keys)
+        return {key: json.loads(value) for key, value in zip(keys, values) if value is not None}
+
+    def set_many(self, mapping, ttl=None):
+        pipe = self.client.pipeline(transaction=False)
+        for key, value in mapping.items():
+            pipe.set(key, json.dumps(value), ex=int(ttl) if ttl else None)
+        pipe.execute()
+
+    def add(self, key, value):
+        pipe = self.client.pipeline(transaction=False)
+        pipe.set(key, json.dumps(value), nx=True)
+        pipe.get(key)
+        return json.loads(pipe.execute()[1])
+
+    def delete(self, keys):
+        if keys:
+            self.client.delete(*keys)
+
+
+class CatalogCache:
+    """Catalog pages and availability served from a backend, loaded from catalog on a miss"""
+
+    def __init__(self, backend, ttl=CATALOG_CACHE_TTL, prefix='catalog:'):
+        self.backend = backend
+        self.ttl = ttl
+        self.prefix = prefix
+
+    @property
+    def max_staleness(self):
+        """Seconds a cached read may lag the database"""
+        return self.ttl
+
+    # ----- backend access; errors are logged and treated as misses -----
+
+    def _get(self, kind, keys):
+        if not keys:
+            return {}
+        try:
+            found = self.backend.get_many(keys)
+        except Exception as e:
+            metrics.catalog_cache_errors_total.inc()
+            logger.warning("Catalog cache read failed: %s", e)
+            return {}
+        metrics.catalog_cache_hits_total.labels(kind=kind).inc(len(found))
+        metrics.catalog_cache_misses_total.labels(kind=kind).inc(len(keys) - len(found))
+        return found
+
+    def _call(self, method, *args):
+        try:
+            return getattr(self.backend, method)(*args)
+        except Exception as e:
+            metrics.catalog_cache_errors_total.inc()
+            logger.warning("Catalog cache %s failed: %s", method, e)
+            return None
+
+    def _tokens(self, names):
+        """Return {name: generation token}, creating tokens that do not exist yet"""
+        keys = [f'{self.prefix}gen:{name}' for name in names]
+        try:
+            found = self.backend.get_many(keys)
+            return {
+                name: found[key] if key in found else self.backend.add(key, uuid.uuid4().hex)
+                for name, key in zip(names, keys)
+            }
+        except Exception as e:
+            metrics.catalog_cache_errors_total.inc()
+            logger.warning("Catalog cache read failed: %s", e)
+            return None
+
+    def _availability_key(self, token, book_id):
+        return f'{self.prefix}avail:{token}:{book_id}'
+
+    # ----- reads -----
+
+    def category_names(self):
+        tokens = self._tokens(['all'])
+        if tokens is None:
+            return catalog.category_names()
+        key = f"{self.prefix}categories:{tokens['all']}"
+        names = self._get('categories', [key]).get(key)
+        if names is None:
+            with use_primary():
+                names = catalog.category_names()
+            self._call('set_many', {key: names}, self.ttl)
+        return names
+
+    def first_pages(self, categories=None):
+        """Same result as catalog.first_pages, from the cache where possible"""
+        if categories is None:
+            categories = self.category_names()
+        return self._pages([(category, None) for category in categories])
+
+    def category_page(self, category, after=None):
+        """Same result as catalog.category_page, from the cache where possible"""
+        # Normalised so junk cursors cannot fill the cache with distinct keys
+        position = catalog.decode_cursor(after, str, int)
+        after = catalog.encode_cursor(*position) if position else None
+        return self._pages([(category, after)]).get(category, ([], None))
+
+    def _pages(self, wanted):
+        tokens = self._tokens(['all'] + [category for category, _ in wanted])
+        if tokens is None:
+            return self._load_pages(wanted)
+
+        keys = {
+            (category, after): f"{self.prefix}page:{tokens['all']}:{tokens[category]}:{category}:{after or ''}"
+            for category, after in wanted
+        }
+        cached = self._get('page', list(keys.values()))
+        missing = [page for page, key in keys.items() if key not in cached]
+
+        pages, availability = {}, {}
+        for page, key in keys.items():
+            if key in cached:
+                entry = cached[key]
+                pages[page] = ([tuple(row) for row in entry['rows']], entry['next'])
+        if missing:
+            with use_primary():
+                loaded = self._load_pages(missing)
+            fresh = {}
+            for category, after in missing:
+                rows, next_cursor = loaded.get(category, ([], None))
+                pages[(category, after)] = ([row[:-1] for row in rows], next_cursor)
+                fresh[keys[(category, after)]] = {
+                    'rows': [list(row[:-1]) for row in rows], 'next': next_cursor
+                }
+                availability.update((row.book_id, row.available_copies) for row in rows)
+            self._call('set_many', fresh, self.ttl)
+            self._call('set_many', {
+                self._availability_key(tokens['all'], book_id): count
+                for book_id, count in availability.items()
+            }, self.ttl)
+
+        availability.update(self._availability(
+            tokens['all'],
+            {row[0] for rows, _ in pages.values() for row in rows} - availability.keys(),
+        ))
+
+        result = {}
+        for category, after in wanted:
+            rows, next_cursor = pages[(category, after)]
+            if rows:
+                result[category] = (
+                    [CatalogRow(*row, availability.get(row[0], 0)) for row in rows],
+                    next_cursor,
+                )
+        return result
+
+    def _availability(self, token, book_ids):
+        keys = {book_id: self._availability_key(token, book_id) for book_id in book_ids}
+        cached = self._get('availability', list(keys.values()))
+        counts = {book_id: cached[key] for book_id, key in keys.items() if key in cached}
+        missing = [book_id for book_id in keys if book_id not in counts]
+        if missing:
+            with use_primary():
+                loaded = catalog.book_availability(missing)
+            counts.update(loaded)
+            self._call('set_many', {keys[book_id]: count for book_id, count in loaded.items()}, self.ttl)
+        return counts
+
+    @staticmethod
+    def _load_pages(wanted):
+        first = [category for category, after in wanted if after is None]
+        pages = catalog.first_pages(first) if first else {}
+        for category, after in wanted:
+            if after is not None:
+                pages[category] = catalog.category_page(category, after)
+        return pages
+
+    # ----- invalidation; call after the change has been committed -----
+
+    def availability_changed(self, *book_ids):
+        """A borrow or return changed these books' available copies"""
+        tokens = self._tokens(['all'])
+        if tokens is not None:
+            metrics.catalog_cache_invalidations_total.labels(kind='availability').inc(len(book_ids))
+            self._call('delete', [self._availability_key(tokens['all'], book_id) for book_id in book_ids])
+
+    def book_changed(self, book_id, *categories):
+        """A book was added, edited or deleted; `categories` are its old and new ones"""
+        metrics.catalog_cache_invalidations_total.labels(kind='book').inc()
+        names = {category or catalog.UNCATEGORIZED for category in categories}
+        self._call('set_many', {f'{self.prefix}gen:{name}': uuid.uuid4().hex for name in names})
+        tokens = self._tokens(['all'])
+        if tokens is not None:
+            self._call('delete', [
+                f"{self.prefix}categories:{tokens['all']}",
+                self._availability_key(tokens['all'], book_id),
+            ])
+
+    def clear(self):
+        """Orphan every cached entry, e.g. after a bulk import"""
+        metrics.catalog_cache_invalidations_total.labels(kind='all').inc()
+        self._call('set_many', {f'{self.prefix}gen:all': uuid.uuid4().hex})
+
+
+class NoCache(CatalogCache):
+    """CATALOG_CACHE_BACKEND=none: every read goes to the database"""
+
+    max_staleness = 0
+
+    def __init__(self):
+        super().__init__(backend=None)
+
+    def category_names(self):
+        return catalog.category_names()
+
+    def _pages(self, wanted):
+        return self._load_pages(wanted)
+
+    def availability_changed(self, *book_ids):
+        pass
+
+    def book_changed(self, book_id, *categories):
+        pass
+
+    def clear(self):
+        pass
+
+
+def create_catalog_cache(backend=CATALOG_CACHE_BACKEND):
+    if backend == 'none':
+        return NoCache()
+    if backend == 'redis':
+        return CatalogCache(RedisBackend())
+    if backend == 'lru':
+        return CatalogCache(LRUBackend())
+    raise ValueError(f"Unknown CATALOG_CACHE_BACKEND {backend!r} (expected lru, redis or none)")
+
+
+catalog_cache = create_catalog_cache()
@@ -0,0 +1,119 @@
+"""
+Streaming table export for the warehouse
+
+Rows are read through a server-side cursor (`yield_per`, which psycopg2
+turns into a named cursor), or in keyset batches when server-side cursors
+are disabled, and serialised chunk by chunk, optionally gzip-compressed on
+the fly, so memory stays flat regardless of table size.
+"""
+import csv
+import io
+import json
+import os
+import zlib
+from datetime import date, datetime
+
+from flask import current_app
+from sqlalchemy import select
+
+from app import db
+from models import Book, BookCopy, BorrowTransaction
+
+EXPORT_BATCH_SIZE = int(os.getenv('EXPORT_BATCH_SIZE', '5000'))
+
+EXPORT_TABLES = {
+    'book': Book.__table__,
+    'book_copy': BookCopy.__table__,
+    'borrow_transaction': BorrowTransaction.__table__,
+}
+
+# csv and jsonl are row oriented; columns writes one JSON object per chunk
+# holding an array per column (a Parquet-like columnar layout)
+EXPORT_FORMATS = {
+    'csv': ('text/csv', 'csv'),
+    'jsonl': ('application/x-ndjson', 'jsonl'),
+    'columns': ('application/x-ndjson', 'columns.jsonl'),
+}
+
+
+def _json_value(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return value
+
+
+def iter_chunks(table_name, batch_size=EXPORT_BATCH_SIZE):
+    """Yield (column_names, rows) chunks of a table in primary-key order"""
+    table = EXPORT_TABLES[table_name]
+    if not current_app.config.get('DB_SERVER_SIDE_CURSORS', True):
+        yield from _iter_keyset_chunks(table, batch_size)
+        return
+
+    stmt = select(table).order_by(*table.primary_key.columns)
+    result = db.session.execute(stmt, execution_options={'yield_per': batch_size})
+    columns = list(result.keys())
+    for rows in result.partitions():
+        yield columns, rows
+
+
+def _iter_keyset_chunks(table, batch_size):
+    # No server-side cursor (PgBouncer mode): one short query per batch,
+    # seeking past the last primary key seen
+    pk = next(iter(table.primary_key.columns))
+    columns = [column.name for column in table.columns]
+    last = None
+    while True:
+        stmt = select(table).order_by(pk).limit(batch_size)
+        if last is not None:
+            stmt = stmt.where(pk > last)
+        rows = db.session.execute(stmt).all()
+        if not rows:
+            return
+        yield columns, rows
+        last = rows[-1]._mapping[pk.name]
+
+
+def _serialise(chunks, fmt):
+    header_written = False
+    for columns, rows in chunks:
+        if fmt == 'csv':
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            if not header_written:
+                writer.writerow(columns)
+                header_written = True
+            writer.writerows(rows)
+            yield buffer.getvalue()
+        elif fmt == 'jsonl':
+            yield ''.join(
+                json.dumps({c: _json_value(v) for c, v in zip(columns, row)}) + '\n'
+                for row in rows
+            )
+        elif fmt == 'columns':
+            data = {c: [_json_value(row[i]) for row in rows] for i, c in enumerate(columns)}
+            yield json.dumps({'rows': len(rows), 'columns': data}) + '\n'
+
+
+def _gzip(pieces):
+    compressor = zlib.compressobj(wbits=zlib.MAX_WBITS | 16)  # gzip container
+    for piece in pieces:
+        block = compressor.compress(piece)
+        if block:
+            yield block
+    yield compressor.flush()
+
+
+def export_table(table_name, fmt='csv', compress=False, batch_size=EXPORT_BATCH_SIZE):
+    """Yield the encoded export of a table as byte chunks"""
+    if table_name not in EXPORT_TABLES:
+        raise ValueError(f'Unknown table: {table_name}')
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f'Unsupported export format: {fmt}')
+
+    pieces = (text.encode('utf-8') for text in _serialise(iter_chunks(table_name, batch_size), fmt))
+    return _gzip(pieces) if compress else pieces
+
+
+def export_filename(table_name, fmt, compress=False):
+    name = f'{table_name}.{EXPORT_FORMATS[fmt][1]}'
+    return name + '.gz' if compress else name
@@ -0,0 +1,237 @@
+"""
+Streaming catalog import from CSV or JSON Lines
+
+Records are parsed one at a time and written in chunks of IMPORT_CHUNK_SIZE,
+each chunk in its own transaction with bulk inserts for books and copies,
+so memory stays flat however large the partner catalog is. A chunk the
+database rejects is retried one row per transaction, so only its bad rows
+are left out, each reported with its line.
+
+Accepted fields per record: title, author (required), category, isbn and
+copies (defaults to 1, at most IMPORT_MAX_COPIES).
+"""
+import csv
+import json
+import os
+import time
+from collections import namedtuple
+
+from sqlalchemy import insert, select
+
+from app import db
+from models import Book, CATEGORY_CHOICES
+from inventory import insert_copy_rows, isbn_allocator
+
+IMPORT_CHUNK_SIZE = int(os.getenv('IMPORT_CHUNK_SIZE', '1000'))
+
+# Copies per record; a chunk holds at most IMPORT_CHUNK_SIZE times this many
+# copy rows, so one record cannot blow up a chunk's memory or transaction
+IMPORT_MAX_COPIES = int(os.getenv('IMPORT_MAX_COPIES', '1000'))
+
+# Only the first errors are kept so a bad file cannot grow the report unbounded
+MAX_REPORTED_ERRORS = 1000
+
+FORMATS = ('csv', 'jsonl')
+
+RowError = namedtuple('RowError', ['line', 'message'])
+
+
+class ImportReport:
+    """Running totals for one import"""
+
+    def __init__(self):
+        self.rows_read = 0
+        self.books_added = 0
+        self.copies_added = 0
+        self.duplicates = 0
+        self.error_count = 0
+        self.errors = []
+        self.started = time.perf_counter()
+        self.elapsed = 0.0
+
+    def add_error(self, line, message):
+        self.error_count += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append(RowError(line, message))
+
+    @property
+    def rows_per_sec(self):
+        return self.rows_read / self.elapsed if self.elapsed else 0.0
+
+    def as_dict(self):
+        return {
+            'rows_read': self.rows_read,
+            'books_added': self.books_added,
+            'copies_added': self.copies_added,
+            'duplicates': self.duplicates,
+            'error_count': self.error_count,
+            'errors': [error._asdict() for error in self.errors],
+            'elapsed_seconds': round(self.elapsed, 3),
+            'rows_per_sec': round(self.rows_per_sec, 1),
+        }
+
+
+def detect_format(filename):
+    """Guess the import format from a file name, or None"""
+    name = (filename or '').lower()
+    if name.endswith('.csv'):
+        return 'csv'
+    if name.endswith(('.jsonl', '.ndjson')):
+        return 'jsonl'
+    return None
+
+
+def iter_records(stream, fmt):
+    """Yield (line, record, error) for each record of a text stream"""
+    if fmt == 'csv':
+        for line, record in enumerate(csv.DictReader(stream), start=2):
+            yield line, record, None
+    elif fmt == 'jsonl':
+        for line, text in enumerate(stream, start=1):
+            if not text.strip():
+                continue
+            try:
+                record = json.loads(text)
+            except ValueError as e:
+                yield line, None, f'Invalid JSON: {e}'
+                continue
+            if not isinstance(record, dict):
+                yield line, None, 'Expected a JSON object'
+                continue
+            yield line, record, None
+    else:
+        raise ValueError(f'Unsupported import format: {fmt}')
+
+
+def _clean(value):
+    return str(value).strip() if value is not None else ''
+
+
+def validate_record(record):
+    """Return a normalised record, or raise ValueError with the reason"""
+    title = _clean(record.get('title'))
+    author = _clean(record.get('author'))
+    if not title or not author:
+        raise ValueError('Title and Author are required.')
+
+    category = _clean(record.get('category')) or None
+    if category and category not in CATEGORY_CHOICES:
+        raise ValueError(f'Unknown category "{category}".')
+
+    isbn = _clean(record.get('isbn')).replace('-', '') or None
+    if isbn and len(isbn) > 20:
+        raise ValueError(f'ISBN "{isbn}" is too long.')
+
+    copies = record.get('copies', record.get('num_copies'))
+    try:
+        copies = 1 if copies in (None, '') else int(copies)
+    except (TypeError, ValueError):
+        raise ValueError(f'Invalid number of copies "{copies}".')
+    if copies < 0:
+        raise ValueError('Number of copies cannot be negative.')
+    if copies > IMPORT_MAX_COPIES:
+        raise ValueError(f'Number of copies cannot exceed {IMPORT_MAX_COPIES}.')
+
+    return {
+        'title': title[:200],
+        'author': author[:200],
+        'category': category,
+        'isbn': isbn,
+        'copies': copies,
+    }
+
+
+def _write_chunk(chunk, report):
+    """Dedupe one chunk on ISBN and bulk-insert its books and copies"""
+    given = [record['isbn'] for _, record in chunk if record['isbn']]
+    existing = set()
+    if given:
+        existing = set(db.session.execute(
+            select(Book.isbn).where(Book.isbn.in_(given))
+        ).scalars())
+
+    books, copies, duplicates = [], {}, []
+    for line, record in chunk:
+        isbn = record['isbn']
+        if isbn and (isbn in existing or isbn in copies):
+            duplicates.append((line, isbn))
+            continue
+        isbn = isbn or isbn_allocator.allocate()
+        books.append({
+            'title': record['title'],
+            'author': record['author'],
+            'category': record['category'],
+            'isbn': isbn,
+        })
+        copies[isbn] = record['copies']
+
+    copy_rows = []
+    if books:
+        inserted = db.session.execute(
+            insert(Book).returning(Book.book_id, Book.isbn), books
+        ).all()
+
+        # available_copies is filled in by the availability triggers as the copies land
+        copy_rows = [
+            (book_id, 'available')
+            for book_id, isbn in inserted
+            for _ in range(copies[isbn])
+        ]
+        insert_copy_rows(copy_rows)
+        db.session.commit()
+
+    # Counted only once the chunk is in, so a chunk retried row by row counts once
+    for line, isbn in duplicates:
+        report.duplicates += 1
+        report.add_error(line, f'Duplicate ISBN {isbn}; skipped.')
+    report.books_added += len(books)
+    report.copies_added += len(copy_rows)
+
+
+def _error_message(error):
+    # The database's own message (without the SQL), on one line
+    return ' '.join(str(getattr(error, 'orig', None) or error).split())
+
+
+def import_catalog(stream, fmt, chunk_size=IMPORT_CHUNK_SIZE, progress=None):
+    """Import every record of `stream` and return an ImportReport
+
+    `progress`, if given, is called with the report after each chunk.
+    """
+    report = ImportReport()
+
+    def flush(chunk):
+        try:
+            _write_chunk(chunk, report)
+        except Exception:
+            db.session.rollback()
+            # Retry row by row, so the good rows still land and each bad one is reported
+            for line, record in chunk:
+                try:
+                    _write_chunk([(line, record)], report)
+                except Exception as e:
+                    db.session.rollback()
+                    report.add_error(line, f'Not imported: {_error_message(e)}')
+        report.elapsed = time.perf_counter() - report.started
+        if progress:
+            progress(report)
+
+    chunk = []
+    for line, record, error in iter_records(stream, fmt):
+        report.rows_read += 1
+        if error:
+            report.add_error(line, error)
+            continue
+        try:
+            chunk.append((line, validate_record(record)))
+        except ValueError as e:
+            report.add_error(line, str(e))
+            continue
+        if len(chunk) >= chunk_size:
+            flush(chunk)
+            chunk = []
+    if chunk:
+        flush(chunk)
+
+    report.elapsed = time.perf_counter() - report.started
+    return report
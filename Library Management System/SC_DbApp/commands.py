@@ -0,0 +1,106 @@
+"""
+Flask CLI commands for Shelf Check (run with `flask --app app:create_app <command>`)
+"""
+import sys
+import time
+
+import click
+
+
+def register_commands(app, db):
+
+    # ---------- IMPORT CATALOG ----------
+    @app.cli.command('import-catalog')
+    @click.argument('source', type=click.File('r', encoding='utf-8-sig'))
+    @click.option('--format', 'fmt', type=click.Choice(['csv', 'jsonl']),
+                  help='Input format; guessed from the file extension when omitted.')
+    @click.option('--chunk-size', type=int, default=None,
+                  help='Records per transaction (default IMPORT_CHUNK_SIZE).')
+    def import_catalog_command(source, fmt, chunk_size):
+        """Import books from a CSV or JSON Lines file ('-' for stdin)."""
+        from catalog_import import import_catalog, detect_format, IMPORT_CHUNK_SIZE
+
+        fmt = fmt or detect_format(source.name)
+        if fmt is None:
+            raise click.UsageError('Cannot guess the format; pass --format csv|jsonl.')
+
+        def progress(report):
+            click.echo(
+                f'{report.rows_read} rows, {report.books_added} books, '
+                f'{report.copies_added} copies, {report.error_count} errors '
+                f'({report.rows_per_sec:.0f} rows/sec)',
+                err=True
+            )
+
+        report = import_catalog(source, fmt, chunk_size or IMPORT_CHUNK_SIZE, progress)
+
+        for error in report.errors:
+            click.echo(f'line {error.line}: {error.message}', err=True)
+        if report.error_count > len(report.errors):
+            click.echo(f'... {report.error_count - len(report.errors)} more errors', err=True)
+        click.echo(
+            f'Imported {report.books_added} books and {report.copies_added} copies '
+            f'from {report.rows_read} rows in {report.elapsed:.1f}s '
+            f'({report.rows_per_sec:.0f} rows/sec); '
+            f'{report.duplicates} duplicates, {report.error_count} errors.'
+        )
+        if report.error_count:
+            sys.exit(1)
+
+    # ---------- EXPORT TABLE ----------
+    @app.cli.command('export-table')
+    @click.argument('table', type=click.Choice(['book', 'book_copy', 'borrow_transaction']))
+    @click.option('--format', 'fmt', type=click.Choice(['csv', 'jsonl', 'columns']), default='csv')
+    @click.option('--gzip', 'compress', is_flag=True, help='Compress the output with gzip.')
+    @click.option('--output', '-o', type=click.File('wb'), default='-',
+                  help='Output file (default stdout).')
+    @click.option('--batch-size', type=int, default=None,
+                  help='Rows fetched per server-side cursor batch (default EXPORT_BATCH_SIZE).')
+    def export_table_command(table, fmt, compress, output, batch_size):
+        """Stream a table to CSV, JSON Lines or columnar JSON chunks."""
+        from catalog_export import export_table, EXPORT_BATCH_SIZE
+
+        for chunk in export_table(table, fmt, compress, batch_size or EXPORT_BATCH_SIZE):
+            output.write(chunk)
+        output.flush()
+
+    # ---------- RECONCILE AVAILABILITY ----------
+    @app.cli.command('reconcile-availability')
+    @click.option('--batch-size', type=int, default=None,
+                  help='Books checked per transaction (default RECONCILE_BATCH_SIZE).')
+    def reconcile_availability_command(batch_size):
+        """Repair book.available_copies counters that drifted from the copies."""
+        from inventory import reconcile_available_copies, RECONCILE_BATCH_SIZE
+        from catalog_cache import catalog_cache, CATALOG_CACHE_BACKEND
+
+        started = time.perf_counter()
+        repaired = reconcile_available_copies(batch_size or RECONCILE_BATCH_SIZE)
+        if repaired and CATALOG_CACHE_BACKEND == 'redis':
+            # A new global token in Redis orphans every worker's entries. The
+            # lru cache lives in each web worker, not in this process, so
+            # there the repaired counters show within CATALOG_CACHE_TTL seconds.
+            catalog_cache.clear()
+        click.echo(f'Repaired {repaired} book counters in {time.perf_counter() - started:.1f}s.')
+
+    # ---------- PROCESS OVERDUE ----------
+    @app.cli.command('process-overdue')
+    @click.option('--output', '-o', type=click.File('w'), default='-',
+                  help='CSV report of the overdue loans (default stdout).')
+    @click.option('--batch-size', type=int, default=None,
+                  help='Loans flagged per transaction (default OVERDUE_BATCH_SIZE).')
+    def process_overdue_command(output, batch_size):
+        """Flag open loans past their due date and stream a CSV report of them."""
+        from overdue import flag_overdue, write_overdue_report, OVERDUE_BATCH_SIZE
+
+        # No overdue_borrows update here: nothing scrapes this job's pod. The
+        # web workers' reconciler publishes it from library_totals().
+        report = flag_overdue(batch_size=batch_size or OVERDUE_BATCH_SIZE)
+        click.echo(
+            f'Flagged {report.flagged} newly overdue loans; {report.overdue} overdue in total '
+            f'({report.elapsed:.1f}s, {report.loans_per_sec:.0f} loans/sec).',
+            err=True
+        )
+        started = time.perf_counter()
+        write_overdue_report(output, report.now)
+        output.flush()
+        click.echo(f'Wrote the overdue report in {time.perf_counter() - started:.1f}s.', err=True)
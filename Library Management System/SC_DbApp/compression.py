@@ -0,0 +1,79 @@
+"""
+HTTP response compression
+
+Pages, JSON and other text responses of at least
+RESPONSE_COMPRESSION_MIN_SIZE bytes are compressed with brotli or gzip,
+whichever the client's Accept-Encoding prefers (brotli on a tie, when the
+Brotli package is installed). Streamed responses (table exports) and files
+are left alone; static assets are precompressed at build time instead (see
+assets.py).
+"""
+import gzip
+import os
+
+from flask import request
+
+import metrics
+
+try:
+    import brotli
+except ImportError:  # optional: without it responses are gzip-only
+    brotli = None
+
+RESPONSE_COMPRESSION = os.getenv('RESPONSE_COMPRESSION', 'true').strip().lower() in ('1', 'true', 'yes', 'on')
+RESPONSE_COMPRESSION_MIN_SIZE = int(os.getenv('RESPONSE_COMPRESSION_MIN_SIZE', '1024'))
+
+# Per-response levels favour CPU; build-time precompression uses the maximum
+RESPONSE_GZIP_LEVEL = int(os.getenv('RESPONSE_GZIP_LEVEL', '6'))
+RESPONSE_BROTLI_QUALITY = int(os.getenv('RESPONSE_BROTLI_QUALITY', '4'))
+
+COMPRESSIBLE_TYPES = frozenset({
+    'text/html', 'text/css', 'text/plain', 'text/csv', 'text/javascript',
+    'application/javascript', 'application/json', 'image/svg+xml',
+})
+
+# In order of preference
+ENCODINGS = ['br', 'gzip'] if brotli is not None else ['gzip']
+ENCODING_SUFFIXES = {'br': '.br', 'gzip': '.gz'}
+
+
+def choose_encoding(available=ENCODINGS):
+    """Return the encoding from `available` the client accepts best, or None for identity"""
+    offered = [encoding for encoding in ENCODINGS if encoding in available]
+    return request.accept_encodings.best_match(offered) if offered else None
+
+
+def compress(data, encoding, best=False):
+    if encoding == 'br':
+        return brotli.compress(data, quality=11 if best else RESPONSE_BROTLI_QUALITY)
+    return gzip.compress(data, compresslevel=9 if best else RESPONSE_GZIP_LEVEL, mtime=0)
+
+
+def init_response_compression(app):
+    """Compress eligible responses of `app` for clients that accept it"""
+    if not RESPONSE_COMPRESSION:
+        return
+
+    @app.after_request
+    def _compress_response(response):
+        if (response.status_code != 200 or response.direct_passthrough or response.is_streamed
+                or 'Content-Encoding' in response.headers
+                or response.mimetype not in COMPRESSIBLE_TYPES):
+            return response
+
+        response.vary.add('Accept-Encoding')
+        data = response.get_data()
+        encoding = choose_encoding() if len(data) >= RESPONSE_COMPRESSION_MIN_SIZE else None
+        if encoding is None:
+            return response
+
+        compressed = compress(data, encoding)
+        response.set_data(compressed)
+        response.content_encoding = encoding
+        # The compressed bytes are a different representation of the same content
+        etag, weak = response.get_etag()
+        if etag and not weak:
+            response.set_etag(etag, weak=True)
+        metrics.http_response_compression_bytes_total.labels(encoding=encoding, stage='raw').inc(len(data))
+        metrics.http_response_compression_bytes_total.labels(encoding=encoding, stage='sent').inc(len(compressed))
+        return response
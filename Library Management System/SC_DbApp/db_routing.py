@@ -0,0 +1,153 @@
+"""
+Read-replica routing for read-only requests
+
+Views decorated with @read_only send their queries to a healthy replica
+(one SQLALCHEMY_BINDS entry per DB_READ_HOSTS host). Everything else, ORM
+flushes, and any request from a user who committed a write within the last
+DB_READ_YOUR_WRITES_SECONDS goes to the primary, so a borrow or return is
+always visible on the very next page. Replicas lagging more than
+DB_REPLICA_MAX_LAG seconds are skipped until they catch up. A request keeps
+the replica it started on, so all its reads see one point in time.
+"""
+import itertools
+import os
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+from flask import current_app, g, has_request_context, request, session
+from flask_sqlalchemy.session import Session as FlaskSession
+from sqlalchemy import event, text
+
+REPLICA_BIND_PREFIX = 'replica_'
+
+DB_REPLICA_MAX_LAG = float(os.getenv('DB_REPLICA_MAX_LAG', '5'))
+DB_REPLICA_LAG_CHECK_INTERVAL = float(os.getenv('DB_REPLICA_LAG_CHECK_INTERVAL', '10'))
+DB_READ_YOUR_WRITES_SECONDS = float(os.getenv('DB_READ_YOUR_WRITES_SECONDS', '10'))
+
+# Seconds the replica is behind; 0 when it has replayed everything it received
+_LAG_QUERY = text("""
+    SELECT CASE
+        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+    END
+""")
+
+
+def replica_bind_keys(count):
+    return [f'{REPLICA_BIND_PREFIX}{i}' for i in range(count)]
+
+
+class ReplicaRouter:
+    """Round-robin over replicas whose replication lag is within bounds"""
+
+    def __init__(self, bind_keys, max_lag=DB_REPLICA_MAX_LAG,
+                 check_interval=DB_REPLICA_LAG_CHECK_INTERVAL):
+        self.bind_keys = list(bind_keys)
+        self.max_lag = max_lag
+        self.check_interval = check_interval
+        self._healthy = list(self.bind_keys)
+        self._cycle = itertools.cycle(self._healthy)
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+        self._check_lock = threading.Lock()
+
+    def choose(self, engines):
+        """Return the engine of a healthy replica, or None to use the primary"""
+        if not self.bind_keys:
+            return None
+        if time.monotonic() - self._checked_at >= self.check_interval:
+            self._refresh(engines)
+        with self._lock:
+            if not self._healthy:
+                return None
+            return engines[next(self._cycle)]
+
+    def _refresh(self, engines):
+        if not self._check_lock.acquire(blocking=False):
+            return  # another thread is already checking
+        try:
+            healthy = []
+            for key in self.bind_keys:
+                try:
+                    with engines[key].connect() as conn:
+                        lag = conn.execute(_LAG_QUERY).scalar() or 0
+                except Exception as e:
+                    current_app.logger.warning("Replica %s unavailable: %s", key, e)
+                    continue
+                if lag <= self.max_lag:
+                    healthy.append(key)
+                else:
+                    current_app.logger.warning("Replica %s lagging %.1fs; using primary", key, lag)
+            with self._lock:
+                self._healthy = healthy
+                self._cycle = itertools.cycle(healthy)
+            self._checked_at = time.monotonic()
+        finally:
+            self._check_lock.release()
+
+
+def _replica_for_request(db):
+    if not has_request_context() or not g.get('db_read_only'):
+        return None
+    if session.get('db_primary_until', 0) > time.time():
+        return None  # read-your-writes window after this user's last write
+    router = current_app.extensions.get('replica_router')
+    if router is None:
+        return None
+    if 'db_replica' not in g:
+        g.db_replica = router.choose(db.engines)
+    return g.db_replica
+
+
+class RoutingSession(FlaskSession):
+    """Flask-SQLAlchemy session that sends read-only requests to replicas"""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and not self._flushing:
+            engine = _replica_for_request(self._db)
+            if engine is not None:
+                return engine
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+@event.listens_for(RoutingSession, 'after_commit')
+def _remember_commit(db_session):
+    if has_request_context():
+        g.db_committed = True
+
+
+def read_only(view):
+    """Route the view's GET/HEAD queries to a read replica when one is available"""
+    @wraps(view)
+    def decorated_function(*args, **kwargs):
+        if request.method in ('GET', 'HEAD'):
+            g.db_read_only = True
+        return view(*args, **kwargs)
+    return decorated_function
+
+
+@contextmanager
+def use_primary():
+    """Send the queries inside the block to the primary, even in a @read_only view"""
+    if not has_request_context():
+        yield
+        return
+    read_only = g.get('db_read_only')
+    g.db_read_only = False
+    try:
+        yield
+    finally:
+        g.db_read_only = read_only
+
+
+def init_read_replicas(app, bind_keys):
+    """Enable replica routing for `app` over the given SQLALCHEMY_BINDS keys"""
+    app.extensions['replica_router'] = ReplicaRouter(bind_keys)
+
+    @app.after_request
+    def _pin_primary_after_write(response):
+        if g.get('db_committed') and request.method not in ('GET', 'HEAD', 'OPTIONS'):
+            session['db_primary_until'] = time.time() + DB_READ_YOUR_WRITES_SECONDS
+        return response
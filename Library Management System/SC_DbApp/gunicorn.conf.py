@@ -0,0 +1,62 @@
+"""
+Gunicorn configuration for Shelf Check
+"""
+import os
+import shutil
+
+bind = f"0.0.0.0:{os.getenv('PORT', '5000')}"
+workers = int(os.getenv('GUNICORN_WORKERS', '1'))
+
+# sync: one request at a time per worker process (the default).
+# gevent: each worker serves up to worker_connections requests on greenlets,
+# so a request waiting on RDS no longer holds a whole process; database
+# concurrency is still capped by DB_POOL_SIZE + DB_MAX_OVERFLOW per worker.
+worker_class = os.getenv('GUNICORN_WORKER_CLASS', 'sync')
+worker_connections = int(os.getenv('GUNICORN_WORKER_CONNECTIONS', '1000'))
+
+# Seconds a worker may spend on one request before the master kills it. The
+# longest request is a catalog upload, capped by IMPORT_MAX_UPLOAD_BYTES to fit.
+timeout = int(os.getenv('GUNICORN_TIMEOUT', '30'))
+if worker_class == 'gevent':
+    # Patch before the preloaded app creates any lock, socket or thread, and
+    # make psycopg2 wait for the server by yielding to other greenlets
+    from gevent import monkey
+    monkey.patch_all()
+    from psycogreen.gevent import patch_psycopg
+    patch_psycopg()
+
+# Build the app once in the master and fork it into the workers: imports,
+# templates and the Secrets Manager lookup are paid once per pod instead of
+# once per worker, and the workers share that memory copy-on-write
+preload_app = os.getenv('GUNICORN_PRELOAD', 'true').strip().lower() in ('1', 'true', 'yes', 'on')
+if preload_app:
+    # Tells create_app to leave threads and connections to post_fork
+    os.environ['APP_PRELOAD'] = '1'
+
+# prometheus_client multiprocess mode: every worker writes its samples to this
+# directory and /metrics aggregates them. Must be set before workers import
+# prometheus_client, which is why it lives here rather than in the app.
+prometheus_multiproc_dir = os.environ.setdefault(
+    'PROMETHEUS_MULTIPROC_DIR', '/tmp/prometheus-multiproc'
+)
+# A preloaded app imports prometheus_client before on_starting runs
+os.makedirs(prometheus_multiproc_dir, exist_ok=True)
+
+
+def on_starting(server):
+    # Drop samples left over from a previous run of the master
+    shutil.rmtree(prometheus_multiproc_dir, ignore_errors=True)
+    os.makedirs(prometheus_multiproc_dir, exist_ok=True)
+
+
+def post_fork(server, worker):
+    # Only set when the app was preloaded in the master
+    flask_app = server.app.callable
+    if flask_app is not None:
+        from app import after_fork
+        after_fork(flask_app)
+
+
+def child_exit(server, worker):
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)
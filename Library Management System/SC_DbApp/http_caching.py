@@ -0,0 +1,157 @@
+"""
+Conditional GET for the catalog pages
+
+A view decorated with @conditional() answers a repeat visit with
+304 Not Modified, without running the view, while nothing it shows has
+changed. Its validator is a weak ETag of the catalog version (see
+models.CatalogVersion), which moves with every committed change to books,
+copies or borrows, plus what else the page depends on: the URL, the
+signed-in user, the day and the release. Last-Modified carries the time of
+that change for clients that only send If-Modified-Since. The pages are
+sent as Cache-Control: private, no-cache, so browsers keep them but always
+revalidate.
+
+The version is read at most once per CATALOG_VERSION_TTL seconds per
+process and database, and again after any commit in this process, so a page
+served from the catalog cache costs no query at all.
+Validators are only issued for a render that is known to be current:
+never with pending flash messages, and not until the last change is older
+than Last-Modified's one-second resolution and the view's `max_staleness`
+(how far a cache in front of its data may lag the database).
+"""
+import hashlib
+import os
+import time
+from datetime import datetime, timezone
+from functools import wraps
+
+from flask import current_app, make_response, request, session
+from flask.globals import request_ctx
+from sqlalchemy import event, func, select
+from sqlalchemy.orm import Session
+
+from app import db
+from models import CatalogVersion
+import assets
+
+CONDITIONAL_GET = os.getenv('CONDITIONAL_GET', 'true').strip().lower() in ('1', 'true', 'yes', 'on')
+
+# Last-Modified has one-second resolution
+VALIDATOR_MIN_AGE = 1.0
+
+# Seconds a process reuses the catalog version it read, so most conditional
+# GETs cost no query; other processes' changes reach the validators after
+# at most this long (0: read it on every request)
+CATALOG_VERSION_TTL = float(os.getenv('CATALOG_VERSION_TTL', '1'))
+
+_release = None
+_versions = {}  # engine -> (version, changed_at, read at)
+_commits = 0
+
+
+def catalog_version():
+    """Return (version, changed_at) as this request's database sees them
+
+    Each process reuses what it read from a database (primary or replica)
+    for CATALOG_VERSION_TTL seconds. A replica only moves forward, so a
+    reused version is never ahead of the data the view then reads there.
+    """
+    engine = db.session.get_bind()
+    cached = _versions.get(engine)
+    if cached is not None and time.monotonic() - cached[2] < CATALOG_VERSION_TTL:
+        return cached[:2]
+
+    commits, read_at = _commits, time.monotonic()
+    version, changed_at = db.session.execute(
+        select(func.coalesce(func.sum(CatalogVersion.version), 0), func.max(CatalogVersion.changed_at))
+    ).one()
+    if commits == _commits:  # not if this process committed while we read
+        _versions[engine] = (int(version), changed_at, read_at)
+    return int(version), changed_at
+
+
+@event.listens_for(Session, 'after_commit')
+def _forget_versions(db_session):
+    # This process's own writes show up on its very next page
+    global _commits
+    _commits += 1
+    _versions.clear()
+
+
+def release_id():
+    """Digest of the templates and the asset manifest, so a deploy changes every ETag"""
+    global _release
+    if _release is None:
+        digest = hashlib.blake2b(digest_size=8)
+        template_dir = os.path.join(current_app.root_path, current_app.template_folder)
+        paths = sorted(
+            os.path.join(root, filename)
+            for root, _, filenames in os.walk(template_dir) for filename in filenames
+        )
+        paths.append(os.path.join(assets.ASSETS_DIR, assets.MANIFEST_NAME))
+        for path in paths:
+            if os.path.exists(path):
+                with open(path, 'rb') as f:
+                    digest.update(f.read())
+        _release = digest.hexdigest()
+    return _release
+
+
+def _page_etag(version):
+    parts = [
+        request.full_path,
+        str(session.get('user_id')),
+        session.get('role') or '',
+        # my_books marks overdue borrows, and due dates are whole days
+        datetime.utcnow().strftime('%Y-%m-%d'),
+        release_id(),
+    ]
+    return f"{version}-{hashlib.blake2b(chr(0).join(parts).encode(), digest_size=8).hexdigest()}"
+
+
+def _not_modified_since(changed_at):
+    since = request.if_modified_since
+    return (since is not None and changed_at is not None
+            and changed_at.replace(tzinfo=timezone.utc, microsecond=0) <= since)
+
+
+def _set_cache_headers(response, etag=None, changed_at=None):
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    if etag is not None:
+        response.set_etag(etag, weak=True)
+        if changed_at is not None:
+            response.last_modified = changed_at
+    return response
+
+
+def conditional(max_staleness=None):
+    """Serve the view's GETs with catalog-version validators and 304 responses
+
+    `max_staleness`, if given, is a callable returning the seconds the
+    view's data may lag the database.
+    """
+    def decorator(view):
+        @wraps(view)
+        def decorated_function(*args, **kwargs):
+            if not CONDITIONAL_GET or request.method not in ('GET', 'HEAD') or '_flashes' in session:
+                return view(*args, **kwargs)
+
+            # Read before the view's own queries, so the page is never older than its version
+            version, changed_at = catalog_version()
+            etag = _page_etag(version)
+            # If-Modified-Since only counts without If-None-Match (RFC 9110)
+            if (request.if_none_match.contains_weak(etag) if request.if_none_match
+                    else _not_modified_since(changed_at)):
+                return _set_cache_headers(current_app.response_class(status=304), etag, changed_at)
+
+            response = make_response(view(*args, **kwargs))
+            if response.status_code != 200:
+                return response
+            min_age = max(VALIDATOR_MIN_AGE, max_staleness() if max_staleness else 0)
+            age = (datetime.utcnow() - changed_at).total_seconds() if changed_at else min_age
+            if request_ctx.flashes or age < min_age:
+                return _set_cache_headers(response)
+            return _set_cache_headers(response, etag, changed_at)
+        return decorated_function
+    return decorator
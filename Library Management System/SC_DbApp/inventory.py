@@ -0,0 +1,175 @@
+"""
+Stocking helpers: creating books and their copies in bulk, and repairing the
+available_copies counters
+"""
+import io
+import os
+import random
+import threading
+from collections import deque
+
+from sqlalchemy import and_, insert, select, update, func
+
+from app import db
+from models import Book, BookCopy, isbn_sequence
+
+# Above this many rows, copies are streamed with PostgreSQL COPY instead of
+# a batched multi-row INSERT
+BULK_COPY_THRESHOLD = int(os.getenv('BULK_COPY_THRESHOLD', '1000'))
+
+# Books whose counters are checked (and row-locked) per reconcile transaction
+RECONCILE_BATCH_SIZE = int(os.getenv('RECONCILE_BATCH_SIZE', '5000'))
+
+# How many ISBNs each process reserves per round trip to the sequence
+ISBN_BLOCK_SIZE = int(os.getenv('ISBN_BLOCK_SIZE', '100'))
+
+# Allocated ISBNs live under 200, in the GS1 restricted circulation range
+# (200-299) that is never issued to a publisher, so they cannot clash with a
+# real 978/979 ISBN or with the random 978-prefixed ones the old generator
+# produced
+ISBN_PREFIX = '200'
+
+
+def add_copies(book_id, count, status='available'):
+    """Insert `count` copies of a book inside the caller's transaction"""
+    if count > 0:
+        insert_copy_rows([(book_id, status)] * count)
+
+
+def insert_copy_rows(rows):
+    """Insert (book_id, status) rows into book_copy inside the caller's transaction"""
+    if not rows:
+        return
+    if len(rows) >= BULK_COPY_THRESHOLD and db.session.get_bind().dialect.name == 'postgresql':
+        _copy_rows(rows)
+    else:
+        # executemany; SQLAlchemy batches this into multi-row INSERT ... VALUES
+        db.session.execute(
+            insert(BookCopy),
+            [{'book_id': book_id, 'status': status} for book_id, status in rows]
+        )
+
+
+def _copy_rows(rows):
+    """Stream (book_id, status) rows into book_copy with COPY FROM STDIN"""
+    buffer = io.StringIO()
+    for book_id, status in rows:
+        buffer.write(f"{book_id}\t{status}\n")
+    buffer.seek(0)
+
+    # Use the session's own connection so COPY joins its transaction
+    dbapi_connection = db.session.connection().connection.dbapi_connection
+    with dbapi_connection.cursor() as cursor:
+        cursor.copy_expert("COPY book_copy (book_id, status) FROM STDIN", buffer)
+
+
+# ---------- COUNTER RECONCILIATION ----------
+
+def reconcile_available_copies(batch_size=RECONCILE_BATCH_SIZE):
+    """Reset every drifted Book.available_copies to its true count; return how many
+
+    The availability triggers keep the counters exact, so this only finds
+    drift from before they existed or from manual edits. Books are processed
+    in book_id batches, one short transaction each. Locking a batch's book
+    rows before counting means a concurrent borrow or return either commits
+    first (and is counted) or applies its trigger delta after this one.
+    """
+    repaired = 0
+    last_id = 0
+    while True:
+        book_ids = db.session.execute(
+            select(Book.book_id)
+            .where(Book.book_id > last_id)
+            .order_by(Book.book_id)
+            .limit(batch_size)
+            .with_for_update()
+        ).scalars().all()
+        if not book_ids:
+            return repaired
+
+        counts = (
+            select(Book.book_id, func.count(BookCopy.copy_id).label('available'))
+            .outerjoin(BookCopy, and_(BookCopy.book_id == Book.book_id,
+                                      BookCopy.status == 'available'))
+            .where(Book.book_id.between(book_ids[0], book_ids[-1]))
+            .group_by(Book.book_id)
+            .subquery()
+        )
+        repaired += db.session.execute(
+            update(Book)
+            .where(Book.book_id == counts.c.book_id,
+                   Book.available_copies != counts.c.available)
+            .values(available_copies=counts.c.available)
+            .execution_options(synchronize_session=False)
+        ).rowcount
+        db.session.commit()
+        last_id = book_ids[-1]
+
+
+# ---------- ISBN ALLOCATION ----------
+
+def isbn13_check_digit(body):
+    total = 0
+    for idx, ch in enumerate(body):
+        val = int(ch)
+        total += val if idx % 2 == 0 else 3 * val
+    return str((10 - (total % 10)) % 10)
+
+
+class IsbnAllocator:
+    """Hands out unique ISBNs from blocks reserved on the isbn_seq sequence
+
+    A sequence never returns the same value twice, so blocks reserved by
+    different gunicorn workers or pods cannot overlap, and adding a book costs
+    one extra round trip only once every `block_size` books. Each block is
+    checked against book.isbn, so a number some book already has (say, one
+    imported by hand) is skipped rather than handed out.
+    """
+
+    def __init__(self, block_size=ISBN_BLOCK_SIZE, prefix=ISBN_PREFIX):
+        self.block_size = block_size
+        self.prefix = prefix
+        self._numbers = deque()
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+
+    def allocate(self):
+        with self._lock:
+            if self._pid != os.getpid():
+                # Forked worker: the parent's block may be in use elsewhere
+                self._numbers.clear()
+                self._pid = os.getpid()
+            while not self._numbers:
+                self._numbers.extend(self._reserve())
+            return self._format(self._numbers.popleft())
+
+    def _reserve(self):
+        if db.session.get_bind().dialect.name == 'postgresql':
+            numbers = select(isbn_sequence.next_value()).select_from(
+                func.generate_series(1, self.block_size)
+            )
+            return self._unused(db.session.execute(numbers).scalars().all())
+        # No sequences here (e.g. SQLite): random bodies, drawn again until
+        # the block holds none that a book already has. Two processes can
+        # still draw the same body; the unique constraint on book.isbn
+        # catches that.
+        numbers = []
+        while len(numbers) < self.block_size:
+            drawn = {random.randrange(10 ** 9) for _ in range(self.block_size - len(numbers))}
+            numbers.extend(self._unused(drawn.difference(numbers)))
+        return numbers
+
+    def _unused(self, numbers):
+        """`numbers`, minus those whose ISBN is already on a book"""
+        isbns = {self._format(number): number for number in numbers}
+        taken = set(db.session.execute(
+            select(Book.isbn).where(Book.isbn.in_(list(isbns)))
+        ).scalars())
+        return [number for isbn, number in isbns.items() if isbn not in taken]
+
+    def _format(self, number):
+        body = f"{self.prefix}{number:09d}"
+        return body + isbn13_check_digit(body)
+
+
+isbn_allocator = IsbnAllocator()
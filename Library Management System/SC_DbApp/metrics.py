@@ -2,10 +2,28 @@
 Prometheus metrics for Shelf Check application
 """
 from prometheus_client import Counter, Histogram, Gauge, generate_latest, CONTENT_TYPE_LATEST
-from flask import Response
+from prometheus_client import CollectorRegistry, REGISTRY, multiprocess
+from prometheus_client.core import GaugeMetricFamily
+from flask import Response, request, g, has_request_context, current_app
 from functools import wraps
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.pool import Pool
+import os
+import threading
 import time
 
+# Seconds between background reconciliations of the application gauges
+# (0 disables the reconciler; the library totals are then not published)
+METRICS_RECONCILE_INTERVAL = float(os.getenv('METRICS_RECONCILE_INTERVAL', '60'))
+
+# Statements slower than this are logged together with the route that issued them
+SLOW_QUERY_THRESHOLD_MS = float(os.getenv('SLOW_QUERY_THRESHOLD_MS', '200'))
+
+# Set by gunicorn.conf.py so every worker writes its samples to a shared
+# directory and /metrics aggregates them across workers
+MULTIPROCESS_DIR = os.getenv('PROMETHEUS_MULTIPROC_DIR')
+
 # HTTP request metrics
 http_requests_total = Counter(
     'http_requests_total',
@@ -19,35 +37,43 @@ http_request_duration_seconds = Histogram(
     ['method', 'endpoint']
 )
 
-# Application-specific metrics
-books_total = Gauge(
-    'books_total',
-    'Total number of books in the library'
-)
-
-book_copies_available = Gauge(
-    'book_copies_available',
-    'Number of available book copies'
-)
+# Application-specific metrics: the library totals, published as
+# (name, help) for each key of catalog.library_totals()
+LIBRARY_TOTALS = {
+    'books': ('books_total', 'Total number of books in the library'),
+    'available_copies': ('book_copies_available', 'Number of available book copies'),
+    'borrowed_copies': ('book_copies_borrowed', 'Number of borrowed book copies'),
+    'users': ('users_total', 'Total number of users'),
+    'active_borrows': ('active_borrows', 'Number of active borrow transactions'),
+    # Loans fall overdue with time, not with a write, so only the web
+    # reconciler moves this one (not `flask process-overdue`, never scraped)
+    'overdue_borrows': ('overdue_borrows', 'Number of open borrow transactions past their due date'),
+}
 
-book_copies_borrowed = Gauge(
-    'book_copies_borrowed',
-    'Number of borrowed book copies'
+# Each total is published as a baseline plus the changes recorded since (see
+# LibraryTotalsCollector); neither is exported under its own name.
+# The changes are a plain sum across workers, dead ones included, so a worker
+# restart loses nothing; the baseline is the most recently reconciled one.
+library_totals_baseline = Gauge(
+    'library_totals_baseline',
+    'Reconciled library totals less the changes recorded up to the reconciliation',
+    ['total'],
+    multiprocess_mode='mostrecent',
+    registry=None
 )
 
-users_total = Gauge(
-    'users_total',
-    'Total number of users'
-)
-
-active_borrows = Gauge(
-    'active_borrows',
-    'Number of active borrow transactions'
+library_totals_changes = Gauge(
+    'library_totals_changes',
+    'Changes to the library totals recorded by the write paths',
+    ['total'],
+    multiprocess_mode='sum',
+    registry=None
 )
 
 database_connections = Gauge(
     'database_connections',
-    'Number of active database connections'
+    'Number of active database connections',
+    multiprocess_mode='livesum'
 )
 
 database_query_duration_seconds = Histogram(
@@ -56,63 +82,294 @@ database_query_duration_seconds = Histogram(
     ['query_type']
 )
 
+# Password hashing (see passwords.py); queueing for a hashing thread included
+password_hash_duration_seconds = Histogram(
+    'password_hash_duration_seconds',
+    'Time to hash or verify a password in seconds',
+    ['operation'],
+    buckets=(0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+)
+
+password_hash_rejected_total = Counter(
+    'password_hash_rejected_total',
+    'Password hashes refused because the hashing pool was full',
+    ['operation']
+)
+
+# Catalog cache (see catalog_cache.py); kind is page, availability or categories
+catalog_cache_hits_total = Counter(
+    'catalog_cache_hits_total',
+    'Catalog cache lookups answered from the cache',
+    ['kind']
+)
+
+catalog_cache_misses_total = Counter(
+    'catalog_cache_misses_total',
+    'Catalog cache lookups that went to the database',
+    ['kind']
+)
+
+catalog_cache_evictions_total = Counter(
+    'catalog_cache_evictions_total',
+    'Entries dropped by the in-process catalog cache',
+    ['reason']
+)
+
+catalog_cache_invalidations_total = Counter(
+    'catalog_cache_invalidations_total',
+    'Catalog cache invalidations by the write paths',
+    ['kind']
+)
+
+catalog_cache_errors_total = Counter(
+    'catalog_cache_errors_total',
+    'Catalog cache backend calls that failed'
+)
+
+# Response compression (see compression.py); stage is raw or sent
+http_response_compression_bytes_total = Counter(
+    'http_response_compression_bytes_total',
+    'Bytes of compressed response bodies before and after compression',
+    ['encoding', 'stage']
+)
+
+
+def _observe_request(method, endpoint, status, duration):
+    http_requests_total.labels(method=method, endpoint=endpoint, status=status).inc()
+    http_request_duration_seconds.labels(method=method, endpoint=endpoint).observe(duration)
+
 
 def track_request_metrics(f):
-    """Decorator to track HTTP request metrics"""
+    """Decorator to track HTTP request metrics for a single view"""
     @wraps(f)
     def decorated_function(*args, **kwargs):
-        start_time = time.time()
-        method = 'GET'  # Default, can be enhanced to get from request
-        endpoint = f.__name__
-        
+        start_time = time.perf_counter()
+        status = '500'
         try:
             response = f(*args, **kwargs)
-            status = '200' if hasattr(response, 'status_code') else '200'
-            http_requests_total.labels(method=method, endpoint=endpoint, status=status).inc()
+            status = str(getattr(response, 'status_code', 200))
             return response
-        except Exception as e:
-            status = '500'
-            http_requests_total.labels(method=method, endpoint=endpoint, status=status).inc()
-            raise
         finally:
-            duration = time.time() - start_time
-            http_request_duration_seconds.labels(method=method, endpoint=endpoint).observe(duration)
+            _observe_request(request.method, f.__name__, status, time.perf_counter() - start_time)
     
     return decorated_function
 
 
+def init_request_metrics(app):
+    """Instrument every request of `app` and expose /metrics"""
+
+    @app.before_request
+    def _start_request_timer():
+        g._request_start = time.perf_counter()
+
+    @app.after_request
+    def _record_request(response):
+        start = g.pop('_request_start', None)
+        if start is not None:
+            # Label by URL rule (bounded cardinality), not the raw path
+            rule = request.url_rule.rule if request.url_rule else '<unmatched>'
+            _observe_request(request.method, rule, str(response.status_code),
+                             time.perf_counter() - start)
+        return response
+
+    app.add_url_rule('/metrics', 'metrics', get_metrics)
+
+
+# ---------- SQL INSTRUMENTATION ----------
+
+def _statement_type(statement):
+    """Normalise a statement to its leading keyword (select, insert, ...)"""
+    words = statement.lstrip(' (\n\t').split(None, 1)
+    keyword = words[0].lower() if words else ''
+    if keyword in ('select', 'insert', 'update', 'delete', 'with', 'copy'):
+        return keyword
+    return 'other'
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_start_time', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    start_times = conn.info.get('query_start_time')
+    if not start_times:
+        return
+    duration = time.perf_counter() - start_times.pop()
+    database_query_duration_seconds.labels(query_type=_statement_type(statement)).observe(duration)
+
+    if not has_request_context():
+        return
+    g.db_query_count = g.get('db_query_count', 0) + 1
+    g.db_query_time = g.get('db_query_time', 0.0) + duration
+    if duration * 1000 >= SLOW_QUERY_THRESHOLD_MS:
+        rule = request.url_rule.rule if request.url_rule else request.path
+        current_app.logger.warning(
+            "Slow query (%.1f ms) on %s %s: %s",
+            duration * 1000, request.method, rule, ' '.join(statement.split())[:1000]
+        )
+
+
+def _handle_error(exception_context):
+    # A failed statement never reaches after_cursor_execute: drop its start time
+    conn = exception_context.connection
+    if conn is not None and exception_context.execution_context is not None:
+        start_times = conn.info.get('query_start_time')
+        if start_times:
+            start_times.pop()
+
+
+def init_query_metrics(app):
+    """Time every SQL statement and report per-request query counts in headers"""
+    # Listening on the Engine class covers every engine (primary and replicas)
+    if not event.contains(Engine, 'before_cursor_execute', _before_cursor_execute):
+        event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+        event.listen(Engine, 'handle_error', _handle_error)
+
+    @app.before_request
+    def _reset_query_counters():
+        g.db_query_count = 0
+        g.db_query_time = 0.0
+
+    @app.after_request
+    def _add_query_headers(response):
+        count = g.get('db_query_count', 0)
+        elapsed_ms = g.get('db_query_time', 0.0) * 1000
+        response.headers['X-DB-Queries'] = str(count)
+        response.headers.add('Server-Timing', f'db;dur={elapsed_ms:.1f};desc="{count} queries"')
+        return response
+
+
+# ---------- CONNECTION POOL ----------
+
+def _on_checkout(dbapi_connection, connection_record, connection_proxy):
+    database_connections.inc()
+
+
+def _on_checkin(dbapi_connection, connection_record):
+    database_connections.dec()
+
+
+def init_pool_metrics():
+    """Track connections checked out of every SQLAlchemy pool in database_connections"""
+    if not event.contains(Pool, 'checkout', _on_checkout):
+        event.listen(Pool, 'checkout', _on_checkout)
+        event.listen(Pool, 'checkin', _on_checkin)
+
+
+# ---------- LIBRARY TOTALS ----------
+
+def _collect_library_totals():
+    """Return the baselines and changes by total key, and all other metric families
+
+    In multiprocess mode this reads every worker's samples, so the other
+    families are the rest of the scrape.
+    """
+    if MULTIPROCESS_DIR:
+        families = multiprocess.MultiProcessCollector(None).collect()
+    else:
+        families = [*library_totals_baseline.collect(), *library_totals_changes.collect()]
+    baselines, changes, others = {}, {}, []
+    parts = {'library_totals_baseline': baselines, 'library_totals_changes': changes}
+    for family in families:
+        if family.name not in parts:
+            others.append(family)
+            continue
+        for sample in family.samples:
+            parts[family.name][sample.labels['total']] = sample.value
+    return baselines, changes, others
+
+
+class LibraryTotalsCollector:
+    """Publishes each library total as its baseline plus the changes recorded since"""
+
+    def collect(self):
+        baselines, changes, others = _collect_library_totals()
+        yield from others
+        for key, (name, documentation) in LIBRARY_TOTALS.items():
+            # Changes alone are no total: wait for the first reconciliation
+            if key in baselines:
+                value = baselines[key] + changes.get(key, 0)
+                yield GaugeMetricFamily(name, documentation, value=value)
+
+
+if not MULTIPROCESS_DIR:
+    REGISTRY.register(LibraryTotalsCollector())
+
+
 def update_application_metrics(db):
-    """Update application-specific metrics from database"""
+    """Reconcile application-specific metrics with the database"""
     try:
-        from models import Book, BookCopy, User, BorrowTransaction
-        
-        # Count books
-        books_count = Book.query.count()
-        books_total.set(books_count)
-        
-        # Count available copies
-        available_copies = BookCopy.query.filter_by(status='available').count()
-        book_copies_available.set(available_copies)
-        
-        # Count borrowed copies
-        borrowed_copies = BookCopy.query.filter_by(status='borrowed').count()
-        book_copies_borrowed.set(borrowed_copies)
-        
-        # Count users
-        users_count = User.query.count()
-        users_total.set(users_count)
-        
-        # Count active borrows
-        active_borrows_count = BorrowTransaction.query.filter_by(return_date=None).count()
-        active_borrows.set(active_borrows_count)
+        from catalog import library_totals
+
+        # One aggregated round trip instead of five COUNT(*) queries
+        totals = library_totals()
+        # Changes are read after the snapshot, so one committed before it but
+        # recorded after this read counts twice until the next reconciliation.
+        # Any worker's baseline stays consistent with the shared changes.
+        _, changes, _ = _collect_library_totals()
+        for key in LIBRARY_TOTALS:
+            library_totals_baseline.labels(total=key).set(totals[key] - changes.get(key, 0))
         
     except Exception as e:
         # Silently fail metrics update to not break the app
         print(f"Warning: Failed to update metrics: {e}")
 
 
+# ---------- INCREMENTAL UPDATES ----------
+# Called by the routes after a successful commit, so the totals track the
+# database between reconciliations without any extra queries. Every worker
+# adds to the shared changes, which /metrics adds to the baseline.
+
+def _record(**changes):
+    for key, change in changes.items():
+        library_totals_changes.labels(total=key).inc(change)
+
+
+def record_books_added(books, copies):
+    _record(books=books, available_copies=copies)
+
+
+def record_book_removed(available, borrowed, open_borrows):
+    _record(books=-1, available_copies=-available, borrowed_copies=-borrowed,
+            active_borrows=-open_borrows)
+
+
+def record_borrow(count=1):
+    _record(available_copies=-count, borrowed_copies=count, active_borrows=count)
+
+
+def record_return(count=1):
+    _record(available_copies=count, borrowed_copies=-count, active_borrows=-count)
+
+
+def record_user_added():
+    _record(users=1)
+
+
+def start_metrics_reconciler(app, db, interval=METRICS_RECONCILE_INTERVAL):
+    """Reconcile the gauges once now and then every `interval` seconds in a daemon thread"""
+    if interval <= 0:
+        return None
+
+    def reconcile_forever():
+        while True:
+            with app.app_context():
+                update_application_metrics(db)
+                db.session.remove()
+            time.sleep(interval)
+
+    thread = threading.Thread(target=reconcile_forever, name='metrics-reconciler', daemon=True)
+    thread.start()
+    return thread
+
+
 def get_metrics():
-    """Return Prometheus metrics"""
+    """Return Prometheus metrics (aggregated across workers in multiprocess mode)"""
+    if MULTIPROCESS_DIR:
+        registry = CollectorRegistry()
+        registry.register(LibraryTotalsCollector())
+        return Response(generate_latest(registry), mimetype=CONTENT_TYPE_LATEST)
     return Response(generate_latest(), mimetype=CONTENT_TYPE_LATEST)
 
 
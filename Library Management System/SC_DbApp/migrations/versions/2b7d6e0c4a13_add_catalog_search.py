@@ -0,0 +1,49 @@
+"""add full-text and trigram search over book title and author
+
+Revision ID: 2b7d6e0c4a13
+Revises: 8c4e1a7b3f90
+Create Date: 2026-10-18 23:02:47.905316
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '2b7d6e0c4a13'
+down_revision = '8c4e1a7b3f90'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Rewrites book once to fill the generated column
+    op.execute("""
+        ALTER TABLE book ADD COLUMN IF NOT EXISTS search_vector tsvector GENERATED ALWAYS AS (
+            setweight(to_tsvector('simple', title), 'A') ||
+            setweight(to_tsvector('simple', author), 'B')
+        ) STORED
+    """)
+
+    with op.get_context().autocommit_block():
+        op.execute("CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_book_search_vector "
+                   "ON book USING gin (search_vector)")
+
+        # Trigram matching is optional: search.py only uses it when this
+        # index exists, so databases without the contrib extension still
+        # get full-text search
+        trigram_available = op.get_bind().execute(sa.text(
+            "SELECT 1 FROM pg_available_extensions WHERE name = 'pg_trgm'"
+        )).first()
+        if trigram_available:
+            op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+            op.execute("CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_book_search_trgm "
+                       "ON book USING gin ((title || ' ' || author) gin_trgm_ops)")
+
+
+def downgrade():
+    # pg_trgm is left installed; other objects may depend on it
+    with op.get_context().autocommit_block():
+        op.execute("DROP INDEX CONCURRENTLY IF EXISTS ix_book_search_trgm")
+        op.execute("DROP INDEX CONCURRENTLY IF EXISTS ix_book_search_vector")
+    op.execute("ALTER TABLE book DROP COLUMN IF EXISTS search_vector")
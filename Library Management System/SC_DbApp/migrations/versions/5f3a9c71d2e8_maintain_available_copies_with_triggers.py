@@ -0,0 +1,81 @@
+"""maintain book.available_copies with triggers
+
+Revision ID: 5f3a9c71d2e8
+Revises: b61e0f2c8a47
+Create Date: 2026-10-18 20:05:12.481907
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5f3a9c71d2e8'
+down_revision = 'b61e0f2c8a47'
+branch_labels = None
+depends_on = None
+
+
+DELTA = """
+    UPDATE book SET available_copies = book.available_copies + changes.delta
+    FROM (
+        SELECT book_id, sum(delta) AS delta FROM ({rows}) AS copy_changes
+        GROUP BY book_id
+        HAVING sum(delta) <> 0
+    ) AS changes
+    WHERE book.book_id = changes.book_id;
+"""
+ADDED = "SELECT book_id, 1 AS delta FROM new_rows WHERE status = 'available'"
+REMOVED = "SELECT book_id, -1 AS delta FROM old_rows WHERE status = 'available'"
+
+TRIGGER_EVENTS = {
+    'insert': ('INSERT', 'NEW TABLE AS new_rows'),
+    'update': ('UPDATE', 'OLD TABLE AS old_rows NEW TABLE AS new_rows'),
+    'delete': ('DELETE', 'OLD TABLE AS old_rows'),
+}
+
+
+def upgrade():
+    # Statement-level triggers with transition tables: one UPDATE of book per
+    # statement on book_copy, including bulk inserts and COPY
+    op.execute(f"""
+        CREATE OR REPLACE FUNCTION book_copy_available_sync() RETURNS trigger
+        LANGUAGE plpgsql AS $$
+        BEGIN
+            IF TG_OP = 'INSERT' THEN
+                {DELTA.format(rows=ADDED)}
+            ELSIF TG_OP = 'DELETE' THEN
+                {DELTA.format(rows=REMOVED)}
+            ELSE
+                {DELTA.format(rows=ADDED + ' UNION ALL ' + REMOVED)}
+            END IF;
+            RETURN NULL;
+        END
+        $$
+    """)
+    for name, (operation, referencing) in TRIGGER_EVENTS.items():
+        op.execute(f"""
+            CREATE TRIGGER book_copy_available_{name} AFTER {operation} ON book_copy
+            REFERENCING {referencing}
+            FOR EACH STATEMENT EXECUTE FUNCTION book_copy_available_sync()
+        """)
+
+    # Start from the true counts; the old application-maintained values drifted
+    op.execute(sa.text("""
+        UPDATE book SET available_copies = counts.available
+        FROM (
+            SELECT book.book_id, count(book_copy.copy_id) AS available
+            FROM book
+            LEFT JOIN book_copy
+              ON book_copy.book_id = book.book_id AND book_copy.status = 'available'
+            GROUP BY book.book_id
+        ) AS counts
+        WHERE book.book_id = counts.book_id
+          AND book.available_copies <> counts.available
+    """))
+
+
+def downgrade():
+    for name in TRIGGER_EVENTS:
+        op.execute(f"DROP TRIGGER IF EXISTS book_copy_available_{name} ON book_copy")
+    op.execute("DROP FUNCTION IF EXISTS book_copy_available_sync()")
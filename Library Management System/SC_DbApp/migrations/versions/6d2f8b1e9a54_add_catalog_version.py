@@ -0,0 +1,72 @@
+"""add catalog_version counter and its triggers
+
+Revision ID: 6d2f8b1e9a54
+Revises: 2b7d6e0c4a13
+Create Date: 2026-10-18 23:41:37.215804
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '6d2f8b1e9a54'
+down_revision = '2b7d6e0c4a13'
+branch_labels = None
+depends_on = None
+
+
+SLOTS = 16
+TABLES = ['book', 'book_copy', 'borrow_transaction']
+
+
+def upgrade():
+    op.create_table(
+        'catalog_version',
+        sa.Column('slot', sa.Integer(), autoincrement=False, nullable=False),
+        sa.Column('version', sa.BigInteger(), nullable=False),
+        sa.Column('changed_at', sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint('slot')
+    )
+    op.execute(f"""
+        INSERT INTO catalog_version (slot, version, changed_at)
+        SELECT slot, 0, now() AT TIME ZONE 'UTC'
+        FROM generate_series(0, {SLOTS - 1}) AS slot
+    """)
+
+    # Deferred row triggers run as the writer commits: the bump is the last
+    # lock it takes and is visible exactly when the change is
+    op.execute(f"""
+        CREATE OR REPLACE FUNCTION catalog_version_bump() RETURNS trigger
+        LANGUAGE plpgsql AS $$
+        BEGIN
+            IF current_setting('catalog_version.bumped', true) = 'on' THEN
+                RETURN NULL;
+            END IF;
+            PERFORM set_config('catalog_version.bumped', 'on', true);
+            UPDATE catalog_version
+            SET version = version + 1, changed_at = clock_timestamp() AT TIME ZONE 'UTC'
+            WHERE slot = pg_backend_pid() % {SLOTS};
+            RETURN NULL;
+        END
+        $$
+    """)
+    for table in TABLES:
+        op.execute(f"""
+            CREATE CONSTRAINT TRIGGER {table}_catalog_version
+            AFTER INSERT OR UPDATE OR DELETE ON {table}
+            DEFERRABLE INITIALLY DEFERRED
+            FOR EACH ROW EXECUTE FUNCTION catalog_version_bump()
+        """)
+        op.execute(f"""
+            CREATE TRIGGER {table}_catalog_version_truncate AFTER TRUNCATE ON {table}
+            FOR EACH STATEMENT EXECUTE FUNCTION catalog_version_bump()
+        """)
+
+
+def downgrade():
+    for table in TABLES:
+        op.execute(f"DROP TRIGGER IF EXISTS {table}_catalog_version_truncate ON {table}")
+        op.execute(f"DROP TRIGGER IF EXISTS {table}_catalog_version ON {table}")
+    op.execute("DROP FUNCTION IF EXISTS catalog_version_bump()")
+    op.drop_table('catalog_version')
@@ -0,0 +1,69 @@
+"""add composite and partial indexes for the hot lookup paths
+
+Revision ID: 8c4e1a7b3f90
+Revises: 5f3a9c71d2e8
+Create Date: 2026-10-18 21:40:03.217554
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8c4e1a7b3f90'
+down_revision = '5f3a9c71d2e8'
+branch_labels = None
+depends_on = None
+
+
+def _where(condition):
+    clause = sa.text(condition)
+    return {'postgresql_where': clause, 'sqlite_where': clause}
+
+
+# name: (table, columns, dialect options)
+INDEXES = {
+    'ix_book_category_title': ('book', ['category', 'title', 'book_id'], {}),
+    'ix_book_copy_book_id_status': ('book_copy', ['book_id', 'status'], {}),
+    'ix_book_copy_available': ('book_copy', ['book_id', 'copy_id'], _where("status = 'available'")),
+    'ix_book_copy_borrowed': ('book_copy', ['copy_id'], _where("status = 'borrowed'")),
+    'ix_borrow_transaction_user_borrow_date': ('borrow_transaction', ['user_id', 'borrow_date', 'borrow_id'], {}),
+    'ix_borrow_transaction_copy_id': ('borrow_transaction', ['copy_id'], {}),
+    'ix_borrow_transaction_open': ('borrow_transaction', ['copy_id'], _where('return_date IS NULL')),
+}
+
+
+def _drop_if_invalid(name, table):
+    # A failed concurrent build leaves an INVALID index behind that
+    # if_not_exists would otherwise keep
+    bind = op.get_bind()
+    if bind.dialect.name != 'postgresql':
+        return
+    invalid = bind.execute(sa.text("""
+        SELECT 1 FROM pg_index JOIN pg_class ON pg_class.oid = pg_index.indexrelid
+        WHERE pg_class.relname = :name AND NOT pg_index.indisvalid
+    """), {'name': name}).first()
+    if invalid:
+        op.drop_index(name, table_name=table, postgresql_concurrently=True)
+
+
+def upgrade():
+    # CREATE INDEX CONCURRENTLY cannot run inside a transaction; building
+    # outside one keeps borrows and returns flowing while the indexes build
+    with op.get_context().autocommit_block():
+        for name, (table, columns, options) in INDEXES.items():
+            _drop_if_invalid(name, table)
+            op.create_index(name, table, columns, if_not_exists=True,
+                            postgresql_concurrently=True, **options)
+        # Superseded by ix_book_category_title, which leads with category
+        op.drop_index('ix_book_category', table_name='book', if_exists=True,
+                      postgresql_concurrently=True)
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        op.create_index('ix_book_category', 'book', ['category'], if_not_exists=True,
+                        postgresql_concurrently=True)
+        for name, (table, _, _) in INDEXES.items():
+            op.drop_index(name, table_name=table, if_exists=True,
+                          postgresql_concurrently=True)
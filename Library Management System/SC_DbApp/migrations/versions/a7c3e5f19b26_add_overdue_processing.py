@@ -0,0 +1,52 @@
+"""add flagged_overdue_at and the overdue processing index
+
+Revision ID: a7c3e5f19b26
+Revises: 6d2f8b1e9a54
+Create Date: 2026-10-19 00:52:14.608231
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a7c3e5f19b26'
+down_revision = '6d2f8b1e9a54'
+branch_labels = None
+depends_on = None
+
+
+INDEX = 'ix_borrow_transaction_overdue'
+
+
+def _drop_if_invalid(name, table):
+    # A failed concurrent build leaves an INVALID index behind that
+    # if_not_exists would otherwise keep
+    bind = op.get_bind()
+    if bind.dialect.name != 'postgresql':
+        return
+    invalid = bind.execute(sa.text("""
+        SELECT 1 FROM pg_index JOIN pg_class ON pg_class.oid = pg_index.indexrelid
+        WHERE pg_class.relname = :name AND NOT pg_index.indisvalid
+    """), {'name': name}).first()
+    if invalid:
+        op.drop_index(name, table_name=table, postgresql_concurrently=True)
+
+
+def upgrade():
+    # Nullable without a default: a catalog-only change, no table rewrite
+    op.add_column('borrow_transaction', sa.Column('flagged_overdue_at', sa.DateTime(), nullable=True))
+
+    where = sa.text('return_date IS NULL')
+    # Built concurrently (outside a transaction) so borrows keep flowing
+    with op.get_context().autocommit_block():
+        _drop_if_invalid(INDEX, 'borrow_transaction')
+        op.create_index(INDEX, 'borrow_transaction', ['due_date', 'borrow_id'], if_not_exists=True,
+                        postgresql_concurrently=True, postgresql_where=where, sqlite_where=where)
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        op.drop_index(INDEX, table_name='borrow_transaction', if_exists=True,
+                      postgresql_concurrently=True)
+    op.drop_column('borrow_transaction', 'flagged_overdue_at')
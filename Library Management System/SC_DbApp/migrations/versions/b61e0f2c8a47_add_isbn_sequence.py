@@ -0,0 +1,25 @@
+"""add isbn sequence
+
+Revision ID: b61e0f2c8a47
+Revises: 37c393cff904
+Create Date: 2026-10-18 09:12:40.118233
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b61e0f2c8a47'
+down_revision = '37c393cff904'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Backs inventory.IsbnAllocator; blocks of values are reserved per process
+    op.execute(sa.schema.CreateSequence(sa.Sequence('isbn_seq', start=1)))
+
+
+def downgrade():
+    op.execute(sa.schema.DropSequence(sa.Sequence('isbn_seq')))
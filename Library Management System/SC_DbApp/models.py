@@ -1,7 +1,8 @@
 from app import db
 from datetime import datetime
-# (NEW) Import password hashing functions
-from werkzeug.security import generate_password_hash, check_password_hash
+from sqlalchemy import DDL, event
+# Password hashing runs on a bounded thread pool (see passwords.py)
+from passwords import hash_password, verify_password
 
 # --- User Model ---
 class User(db.Model):
@@ -16,15 +17,31 @@ class User(db.Model):
 
     # (NEW) Method to set password
     def set_password(self, password):
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = hash_password(password)
 
     # (NEW) Method to check password
     def check_password(self, password):
-        return check_password_hash(self.password_hash, password)
+        return verify_password(self.password_hash, password)
 
     def __repr__(self):
         return f'<User {self.username}>'
 
+# Categories a book may be filed under (None means Uncategorized)
+CATEGORY_CHOICES = [
+    'Fiction',
+    'Fantasy',
+    'Science Fiction',
+    'Mystery',
+    'Romance',
+    'Nonfiction',
+    'Biography',
+    'Self-Help',
+    'History'
+]
+
+# Numbers behind allocated ISBNs; reserved in blocks by inventory.IsbnAllocator
+isbn_sequence = db.Sequence('isbn_seq', start=1, metadata=db.metadata)
+
 # (No changes to the other models)
 # --- Book Model ---
 class Book(db.Model):
@@ -33,7 +50,7 @@ class Book(db.Model):
     title = db.Column(db.String(200), nullable=False)
     author = db.Column(db.String(200), nullable=False)
     # (NEW) Book category for grouping in admin dashboard
-    category = db.Column(db.String(100), nullable=True, index=True)
+    category = db.Column(db.String(100), nullable=True)
     isbn = db.Column(db.String(20), unique=True, nullable=True)
     available_copies = db.Column(db.Integer, nullable=False, default=0)
     copies = db.relationship(
@@ -42,6 +59,10 @@ class Book(db.Model):
         cascade="all, delete-orphan",
         passive_deletes=True
     )
+    __table_args__ = (
+        # Keyset pagination of the catalog: one category in (title, book_id) order
+        db.Index('ix_book_category_title', 'category', 'title', 'book_id'),
+    )
     def __repr__(self):
         return f'<Book {self.title}>'
 
@@ -53,19 +74,238 @@ class BookCopy(db.Model):
     status = db.Column(db.String(20), default='available', nullable=False)
     book = db.relationship('Book', back_populates='copies')
     transactions = db.relationship('BorrowTransaction', back_populates='book_copy', cascade="all, delete-orphan", passive_deletes=True)
+    __table_args__ = (
+        db.Index('ix_book_copy_book_id_status', 'book_id', 'status'),
+        # The borrow path's "first available copy of this book"
+        db.Index('ix_book_copy_available', 'book_id', 'copy_id',
+                 postgresql_where=status == 'available', sqlite_where=status == 'available'),
+        db.Index('ix_book_copy_borrowed', 'copy_id',
+                 postgresql_where=status == 'borrowed', sqlite_where=status == 'borrowed'),
+    )
     def __repr__(self):
         return f'<Copy {self.copy_id} (Book: {self.book_id})>'
 
+# --- Availability counter ---
+# book.available_copies always equals the number of the book's 'available'
+# copies: triggers on book_copy adjust it in the same statement that changes a
+# copy, so application code never writes it. Migration 5f3a9c71d2e8 installs
+# the PostgreSQL triggers on existing databases; the listeners below add the
+# same triggers to databases built with db.create_all().
+_PG_AVAILABILITY_DELTA = """
+    UPDATE book SET available_copies = book.available_copies + changes.delta
+    FROM (
+        SELECT book_id, sum(delta) AS delta FROM ({rows}) AS copy_changes
+        GROUP BY book_id
+        HAVING sum(delta) <> 0
+    ) AS changes
+    WHERE book.book_id = changes.book_id;
+"""
+_PG_ADDED = "SELECT book_id, 1 AS delta FROM new_rows WHERE status = 'available'"
+_PG_REMOVED = "SELECT book_id, -1 AS delta FROM old_rows WHERE status = 'available'"
+
+AVAILABILITY_DDL_PG = [
+    f"""
+    CREATE OR REPLACE FUNCTION book_copy_available_sync() RETURNS trigger
+    LANGUAGE plpgsql AS $$
+    BEGIN
+        -- One UPDATE per statement, however many copies it touched
+        IF TG_OP = 'INSERT' THEN
+            {_PG_AVAILABILITY_DELTA.format(rows=_PG_ADDED)}
+        ELSIF TG_OP = 'DELETE' THEN
+            {_PG_AVAILABILITY_DELTA.format(rows=_PG_REMOVED)}
+        ELSE
+            {_PG_AVAILABILITY_DELTA.format(rows=_PG_ADDED + ' UNION ALL ' + _PG_REMOVED)}
+        END IF;
+        RETURN NULL;
+    END
+    $$
+    """,
+    """
+    CREATE TRIGGER book_copy_available_insert AFTER INSERT ON book_copy
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION book_copy_available_sync()
+    """,
+    """
+    CREATE TRIGGER book_copy_available_update AFTER UPDATE ON book_copy
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION book_copy_available_sync()
+    """,
+    """
+    CREATE TRIGGER book_copy_available_delete AFTER DELETE ON book_copy
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION book_copy_available_sync()
+    """,
+]
+
+# SQLite has no statement-level triggers; row-level ones give the same counts
+AVAILABILITY_DDL_SQLITE = [
+    """
+    CREATE TRIGGER book_copy_available_insert AFTER INSERT ON book_copy
+    WHEN NEW.status = 'available'
+    BEGIN
+        UPDATE book SET available_copies = available_copies + 1 WHERE book_id = NEW.book_id;
+    END
+    """,
+    """
+    CREATE TRIGGER book_copy_available_update AFTER UPDATE OF status, book_id ON book_copy
+    BEGIN
+        UPDATE book SET available_copies = available_copies - 1
+        WHERE book_id = OLD.book_id AND OLD.status = 'available';
+        UPDATE book SET available_copies = available_copies + 1
+        WHERE book_id = NEW.book_id AND NEW.status = 'available';
+    END
+    """,
+    """
+    CREATE TRIGGER book_copy_available_delete AFTER DELETE ON book_copy
+    WHEN OLD.status = 'available'
+    BEGIN
+        UPDATE book SET available_copies = available_copies - 1 WHERE book_id = OLD.book_id;
+    END
+    """,
+]
+
+for _statement in AVAILABILITY_DDL_PG:
+    event.listen(BookCopy.__table__, 'after_create',
+                 DDL(_statement).execute_if(dialect='postgresql'))
+for _statement in AVAILABILITY_DDL_SQLITE:
+    event.listen(BookCopy.__table__, 'after_create',
+                 DDL(_statement).execute_if(dialect='sqlite'))
+
+# --- Catalog search ---
+# search.py matches queries against book.search_vector, a generated tsvector
+# of the title (weight A) and author (weight B), and, where the pg_trgm
+# extension can be installed, against a trigram index of SEARCH_DOCUMENT for
+# typo-tolerant matching. The column is left unmapped so the ORM never reads
+# or writes it. Migration 2b7d6e0c4a13 adds both to existing databases.
+SEARCH_DOCUMENT = "title || ' ' || author"
+
+SEARCH_DDL_PG = [
+    """
+    ALTER TABLE book ADD COLUMN search_vector tsvector GENERATED ALWAYS AS (
+        setweight(to_tsvector('simple', title), 'A') ||
+        setweight(to_tsvector('simple', author), 'B')
+    ) STORED
+    """,
+    "CREATE INDEX ix_book_search_vector ON book USING gin (search_vector)",
+    f"""
+    DO $$
+    BEGIN
+        IF EXISTS (SELECT 1 FROM pg_available_extensions WHERE name = 'pg_trgm') THEN
+            CREATE EXTENSION IF NOT EXISTS pg_trgm;
+            CREATE INDEX ix_book_search_trgm ON book USING gin (({SEARCH_DOCUMENT}) gin_trgm_ops);
+        END IF;
+    END
+    $$
+    """,
+]
+
+for _statement in SEARCH_DDL_PG:
+    event.listen(Book.__table__, 'after_create',
+                 DDL(_statement).execute_if(dialect='postgresql'))
+
 # --- BorrowTransaction Model ---
 class BorrowTransaction(db.Model):
     __tablename__ = 'borrow_transaction'
     borrow_id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.user_id'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.user_id'), nullable=False)
     copy_id = db.Column(db.Integer, db.ForeignKey('book_copy.copy_id', ondelete="CASCADE"), nullable=False)
     borrow_date = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
     due_date = db.Column(db.DateTime, nullable=False)
     return_date = db.Column(db.DateTime, nullable=True)
+    # Set by `flask process-overdue` when it first finds the loan overdue
+    flagged_overdue_at = db.Column(db.DateTime, nullable=True)
     borrower = db.relationship('User', back_populates='transactions')
     book_copy = db.relationship('BookCopy', back_populates='transactions')
+    __table_args__ = (
+        # my_books history: newest first, keyset on (borrow_date, borrow_id)
+        db.Index('ix_borrow_transaction_user_borrow_date', 'user_id', 'borrow_date', 'borrow_id'),
+        db.Index('ix_borrow_transaction_copy_id', 'copy_id'),
+        # Open borrows are a small slice of the history
+        db.Index('ix_borrow_transaction_open', 'copy_id',
+                 postgresql_where=return_date.is_(None), sqlite_where=return_date.is_(None)),
+        # Overdue processing: open borrows in due date order
+        db.Index('ix_borrow_transaction_overdue', 'due_date', 'borrow_id',
+                 postgresql_where=return_date.is_(None), sqlite_where=return_date.is_(None)),
+    )
     def __repr__(self):
-        return f'<Transaction {self.borrow_id}>'
\ No newline at end of file
+        return f'<Transaction {self.borrow_id}>'
+# --- Catalog version ---
+# A counter that moves with every committed change to books, copies or
+# borrows; http_caching.py builds the ETags of the catalog pages from it.
+# Triggers bump one of CATALOG_VERSION_SLOTS rows (chosen by backend pid, so
+# concurrent writers rarely share a row) as the writing transaction commits:
+# the new version becomes visible together with the change, and the slot lock
+# is the last lock a writer takes, so it cannot deadlock with row locks. The
+# version is the sum of the slots. Migration 6d2f8b1e9a54 adds all of this
+# to existing databases.
+CATALOG_VERSION_SLOTS = 16
+
+class CatalogVersion(db.Model):
+    __tablename__ = 'catalog_version'
+    slot = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    version = db.Column(db.BigInteger, nullable=False, default=0)
+    changed_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+CATALOG_VERSION_TABLES = ['book', 'book_copy', 'borrow_transaction']
+
+CATALOG_VERSION_DDL_PG = [
+    f"""
+    INSERT INTO catalog_version (slot, version, changed_at)
+    SELECT slot, 0, now() AT TIME ZONE 'UTC'
+    FROM generate_series(0, {CATALOG_VERSION_SLOTS - 1}) AS slot
+    """,
+    f"""
+    CREATE OR REPLACE FUNCTION catalog_version_bump() RETURNS trigger
+    LANGUAGE plpgsql AS $$
+    BEGIN
+        -- Deferred row triggers fire once per changed row at commit; bump once
+        IF current_setting('catalog_version.bumped', true) = 'on' THEN
+            RETURN NULL;
+        END IF;
+        PERFORM set_config('catalog_version.bumped', 'on', true);
+        UPDATE catalog_version
+        SET version = version + 1, changed_at = clock_timestamp() AT TIME ZONE 'UTC'
+        WHERE slot = pg_backend_pid() %% {CATALOG_VERSION_SLOTS};
+        RETURN NULL;
+    END
+    $$
+    """,
+]
+for _table in CATALOG_VERSION_TABLES:
+    CATALOG_VERSION_DDL_PG += [
+        f"""
+        CREATE CONSTRAINT TRIGGER {_table}_catalog_version
+        AFTER INSERT OR UPDATE OR DELETE ON {_table}
+        DEFERRABLE INITIALLY DEFERRED
+        FOR EACH ROW EXECUTE FUNCTION catalog_version_bump()
+        """,
+        f"""
+        CREATE TRIGGER {_table}_catalog_version_truncate AFTER TRUNCATE ON {_table}
+        FOR EACH STATEMENT EXECUTE FUNCTION catalog_version_bump()
+        """,
+    ]
+
+# SQLite has a single writer: one slot, bumped by plain row triggers
+# (DDL() formats its text with %, hence the doubled percent signs)
+CATALOG_VERSION_DDL_SQLITE = [
+    "INSERT INTO catalog_version (slot, version, changed_at) VALUES (0, 0, strftime('%%Y-%%m-%%d %%H:%%M:%%f', 'now'))",
+]
+for _table in CATALOG_VERSION_TABLES:
+    for _operation in ('INSERT', 'UPDATE', 'DELETE'):
+        CATALOG_VERSION_DDL_SQLITE.append(f"""
+        CREATE TRIGGER {_table}_catalog_version_{_operation.lower()} AFTER {_operation} ON {_table}
+        BEGIN
+            UPDATE catalog_version
+            SET version = version + 1, changed_at = strftime('%%Y-%%m-%%d %%H:%%M:%%f', 'now');
+        END
+        """)
+
+CATALOG_VERSION_DDL = {'postgresql': CATALOG_VERSION_DDL_PG, 'sqlite': CATALOG_VERSION_DDL_SQLITE}
+
+@event.listens_for(db.metadata, 'after_create')
+def _install_catalog_version(metadata, connection, tables=(), **kw):
+    # Once every table exists (the triggers live on the catalog tables), and
+    # only when create_all has just created catalog_version itself
+    if CatalogVersion.__table__ in tables:
+        for statement in CATALOG_VERSION_DDL.get(connection.dialect.name, []):
+            connection.execute(DDL(statement))
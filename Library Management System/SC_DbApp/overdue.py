@@ -0,0 +1,187 @@
+"""
+Overdue loan processing for `flask process-overdue`
+
+Open loans past their due date are flagged (flagged_overdue_at) in
+(due_date, borrow_id) keyset chunks through the partial index
+ix_borrow_transaction_overdue, which holds only open loans in due date order:
+each chunk is an index range scan that stops at the first loan not yet due,
+and one short transaction. On PostgreSQL a chunk is a single statement that
+selects the chunk, flags its unflagged loans and returns one summary row, so
+no loan passes through Python. The report of every overdue loan, joined to
+its borrower and book, is then streamed to the output with COPY ... TO
+STDOUT (other dialects: keyset chunks through the csv module), so memory
+stays flat however many loans are overdue.
+"""
+import csv
+import os
+import time
+from datetime import datetime
+
+from sqlalchemy import select, text, tuple_, update
+
+from app import db
+from models import User, Book, BookCopy, BorrowTransaction
+
+OVERDUE_BATCH_SIZE = int(os.getenv('OVERDUE_BATCH_SIZE', '5000'))
+
+REPORT_COLUMNS = (
+    'borrow_id', 'user_id', 'username', 'email', 'book_id', 'title',
+    'due_date', 'days_overdue', 'flagged_at',
+)
+
+# The chunk CTE is referenced twice, so PostgreSQL evaluates it once
+_PG_FLAG_CHUNK = """
+    WITH chunk AS (
+        SELECT borrow_id, due_date FROM borrow_transaction
+        WHERE return_date IS NULL AND due_date < :now {after}
+        ORDER BY due_date, borrow_id
+        LIMIT :batch_size
+    ), flagged AS (
+        UPDATE borrow_transaction SET flagged_overdue_at = :now
+        FROM chunk
+        WHERE borrow_transaction.borrow_id = chunk.borrow_id
+          AND borrow_transaction.flagged_overdue_at IS NULL
+          AND borrow_transaction.return_date IS NULL
+        RETURNING 1
+    )
+    SELECT due_date, borrow_id,
+           (SELECT count(*) FROM chunk) AS loans,
+           (SELECT count(*) FROM flagged) AS flagged
+    FROM chunk
+    ORDER BY due_date DESC, borrow_id DESC
+    LIMIT 1
+"""
+_AFTER = "AND (due_date, borrow_id) > (:after_due, :after_id)"
+
+_PG_REPORT = """
+    SELECT t.borrow_id, u.user_id, u.username, u.email, b.book_id, b.title,
+           t.due_date, date_part('day', %(now)s - t.due_date)::int, t.flagged_overdue_at
+    FROM borrow_transaction t
+    JOIN users u ON u.user_id = t.user_id
+    JOIN book_copy c ON c.copy_id = t.copy_id
+    JOIN book b ON b.book_id = c.book_id
+    WHERE t.return_date IS NULL AND t.due_date < %(now)s
+    ORDER BY t.due_date, t.borrow_id
+"""
+
+
+class OverdueReport:
+    """Totals for one run"""
+
+    def __init__(self, now):
+        self.now = now
+        self.overdue = 0
+        self.flagged = 0
+        self.started = time.perf_counter()
+        self.elapsed = 0.0
+
+    @property
+    def loans_per_sec(self):
+        return self.overdue / self.elapsed if self.elapsed else 0.0
+
+
+def _open_loans_due_before(now):
+    return (BorrowTransaction.return_date.is_(None), BorrowTransaction.due_date < now)
+
+
+def flag_overdue(now=None, batch_size=OVERDUE_BATCH_SIZE):
+    """Flag every open loan due before `now` (default: utcnow); return an OverdueReport"""
+    report = OverdueReport(now or datetime.utcnow())
+    flag_chunk = (_flag_chunk_postgresql if db.session.get_bind().dialect.name == 'postgresql'
+                  else _flag_chunk_portable)
+    after = None
+    while True:
+        loans, flagged, after = flag_chunk(report.now, after, batch_size)
+        db.session.commit()
+        report.overdue += loans
+        report.flagged += flagged
+        if loans < batch_size:
+            report.elapsed = time.perf_counter() - report.started
+            return report
+
+
+def _flag_chunk_postgresql(now, after, batch_size):
+    params = {'now': now, 'batch_size': batch_size}
+    if after is not None:
+        params['after_due'], params['after_id'] = after
+    row = db.session.execute(
+        text(_PG_FLAG_CHUNK.format(after=_AFTER if after else '')), params
+    ).first()
+    if row is None:
+        return 0, 0, after
+    return row.loans, row.flagged, (row.due_date, row.borrow_id)
+
+
+def _flag_chunk_portable(now, after, batch_size):
+    # Same steps as _PG_FLAG_CHUNK, with the chunk's keys read into Python
+    stmt = (
+        select(BorrowTransaction.borrow_id, BorrowTransaction.due_date,
+               BorrowTransaction.flagged_overdue_at)
+        .where(*_open_loans_due_before(now))
+    )
+    if after is not None:
+        stmt = stmt.where(tuple_(BorrowTransaction.due_date, BorrowTransaction.borrow_id) > tuple_(*after))
+    rows = db.session.execute(
+        stmt.order_by(BorrowTransaction.due_date, BorrowTransaction.borrow_id).limit(batch_size)
+    ).all()
+    if not rows:
+        return 0, 0, after
+
+    new = [row.borrow_id for row in rows if row.flagged_overdue_at is None]
+    flagged = 0
+    if new:
+        flagged = db.session.execute(
+            update(BorrowTransaction)
+            .where(BorrowTransaction.borrow_id.in_(new),
+                   BorrowTransaction.flagged_overdue_at.is_(None),
+                   BorrowTransaction.return_date.is_(None))
+            .values(flagged_overdue_at=now)
+            .execution_options(synchronize_session=False)
+        ).rowcount
+    return len(rows), flagged, (rows[-1].due_date, rows[-1].borrow_id)
+
+
+def write_overdue_report(output, now=None, batch_size=OVERDUE_BATCH_SIZE):
+    """Write a CSV of the open loans due before `now` to the text stream `output`
+
+    Loans come in due date order, with REPORT_COLUMNS as the header.
+    """
+    now = now or datetime.utcnow()
+    if db.session.get_bind().dialect.name == 'postgresql':
+        # Use the session's own connection so COPY runs in its transaction
+        dbapi_connection = db.session.connection().connection.dbapi_connection
+        with dbapi_connection.cursor() as cursor:
+            query = cursor.mogrify(_PG_REPORT, {'now': now}).decode()
+            output.write(','.join(REPORT_COLUMNS) + '\n')
+            cursor.copy_expert(f"COPY ({query}) TO STDOUT WITH (FORMAT csv)", output)
+        db.session.commit()
+        return
+
+    writer = csv.writer(output, lineterminator='\n')
+    writer.writerow(REPORT_COLUMNS)
+    stmt = (
+        select(
+            BorrowTransaction.borrow_id, User.user_id, User.username, User.email,
+            Book.book_id, Book.title, BorrowTransaction.due_date,
+            BorrowTransaction.flagged_overdue_at,
+        )
+        .join(User, User.user_id == BorrowTransaction.user_id)
+        .join(BookCopy, BookCopy.copy_id == BorrowTransaction.copy_id)
+        .join(Book, Book.book_id == BookCopy.book_id)
+        .where(*_open_loans_due_before(now))
+        .order_by(BorrowTransaction.due_date, BorrowTransaction.borrow_id)
+        .limit(batch_size)
+    )
+    after = None
+    while True:
+        chunk = stmt
+        if after is not None:
+            chunk = stmt.where(tuple_(BorrowTransaction.due_date, BorrowTransaction.borrow_id) > tuple_(*after))
+        rows = db.session.execute(chunk).all()
+        writer.writerows(
+            (*row[:7], (now - row.due_date).days, row.flagged_overdue_at) for row in rows
+        )
+        db.session.commit()
+        if len(rows) < batch_size:
+            return
+        after = (rows[-1].due_date, rows[-1].borrow_id)
@@ -0,0 +1,107 @@
+"""
+Password hashing off the request thread
+
+Hashes are deliberately expensive (scrypt also needs 32 MiB per hash at the
+default cost), so hashing and verification run on a small pool of native
+threads, where hashlib releases the GIL. A cap on running plus waiting hashes
+means a login storm uses at most PASSWORD_HASH_WORKERS cores per process, and
+attempts beyond the cap are turned away at once instead of queueing the
+catalog requests behind them. Under the gevent worker the pool is gevent's
+native thread pool, so a greenlet waiting on a hash yields to the others.
+
+The method and cost come from PASSWORD_HASH_METHOD in werkzeug's notation
+("scrypt:32768:8:1", "pbkdf2:sha256:600000"). A stored hash made with other
+parameters is replaced after the next successful login (see needs_rehash).
+"""
+import os
+import sys
+import threading
+import time
+
+from werkzeug.security import generate_password_hash, check_password_hash
+
+import metrics
+
+PASSWORD_HASH_METHOD = os.getenv('PASSWORD_HASH_METHOD', 'scrypt:32768:8:1')
+
+# Hashes computed at once per process
+PASSWORD_HASH_WORKERS = int(os.getenv('PASSWORD_HASH_WORKERS', '1'))
+
+# Hashes running or waiting for a worker before new ones are refused
+PASSWORD_HASH_MAX_PENDING = int(os.getenv('PASSWORD_HASH_MAX_PENDING', '8'))
+
+
+class PasswordHasherBusy(Exception):
+    """Raised when PASSWORD_HASH_MAX_PENDING hashes are already running or waiting"""
+
+
+class HashingPool:
+    """Bounded pool of native threads for password hashing"""
+
+    def __init__(self, workers=PASSWORD_HASH_WORKERS, max_pending=PASSWORD_HASH_MAX_PENDING):
+        self.workers = workers
+        self.max_pending = max(max_pending, workers)
+        self._pending = 0
+        self._lock = threading.Lock()
+        self._executor = None
+        self._executor_pid = None
+
+    def _get_executor(self):
+        # Created lazily and again after a fork: a preloaded master's threads
+        # do not survive into the workers
+        if self._executor is None or self._executor_pid != os.getpid():
+            if _gevent_patched():
+                from gevent.threadpool import ThreadPoolExecutor
+            else:
+                from concurrent.futures import ThreadPoolExecutor
+            self._executor = ThreadPoolExecutor(max_workers=self.workers)
+            self._executor_pid = os.getpid()
+        return self._executor
+
+    def run(self, operation, fn, *args):
+        """Return fn(*args) computed on the pool; raise PasswordHasherBusy when full"""
+        with self._lock:
+            if self._pending >= self.max_pending:
+                metrics.password_hash_rejected_total.labels(operation=operation).inc()
+                raise PasswordHasherBusy(operation)
+            self._pending += 1
+            executor = self._get_executor()
+        try:
+            started = time.perf_counter()
+            result = executor.submit(fn, *args).result()
+            metrics.password_hash_duration_seconds.labels(operation=operation).observe(
+                time.perf_counter() - started
+            )
+            return result
+        finally:
+            with self._lock:
+                self._pending -= 1
+
+
+def _gevent_patched():
+    if 'gevent.monkey' not in sys.modules:
+        return False
+    return sys.modules['gevent.monkey'].is_module_patched('threading')
+
+
+hashing_pool = HashingPool()
+
+
+def hash_password(password, method=None):
+    return hashing_pool.run('hash', generate_password_hash, password, method or PASSWORD_HASH_METHOD)
+
+
+def verify_password(password_hash, password):
+    return hashing_pool.run('verify', check_password_hash, password_hash, password)
+
+
+_current_parameters = {}
+
+
+def needs_rehash(password_hash, method=None):
+    """Return True if `password_hash` was not made with the configured method and cost"""
+    method = method or PASSWORD_HASH_METHOD
+    if method not in _current_parameters:
+        # werkzeug fills in the default cost, e.g. "scrypt" -> "scrypt:32768:8:1"
+        _current_parameters[method] = generate_password_hash('', method).split('$', 1)[0]
+    return password_hash.split('$', 1)[0] != _current_parameters[method]
@@ -1,38 +1,52 @@
 from flask import render_template, request, flash, redirect, url_for, session
-from models import User, Book, BookCopy, BorrowTransaction
+from flask import Response, stream_with_context
+from models import User, Book, BorrowTransaction, CATEGORY_CHOICES
 from sqlalchemy import func
 from datetime import datetime, timedelta
-import random
+import io
+import os
 from flask import jsonify
 from sqlalchemy import text
+import catalog
+import metrics
+from catalog_cache import catalog_cache
+from search import search_books
+from passwords import PasswordHasherBusy, needs_rehash
+from db_routing import read_only
+from http_caching import conditional
+from borrowing import borrow_book, BookUnavailable
+from inventory import add_copies, isbn_allocator
+from catalog_import import import_catalog, detect_format, FORMATS as IMPORT_FORMATS, IMPORT_MAX_COPIES
+from catalog_export import export_table, export_filename, EXPORT_TABLES, EXPORT_FORMATS
+
+IMPORT_CONTENT_TYPES = {
+    'text/csv': 'csv',
+    'application/x-ndjson': 'jsonl',
+    'application/jsonl': 'jsonl',
+}
+
+# The upload is imported inside the request, so it must finish well within
+# gunicorn's worker timeout (about 40,000 rows); larger catalogs go through
+# `flask import-catalog`, which has no time limit
+IMPORT_MAX_UPLOAD_BYTES = int(os.getenv('IMPORT_MAX_UPLOAD_BYTES', str(2 * 1024 * 1024)))
+IMPORT_MAX_UPLOAD_MB = IMPORT_MAX_UPLOAD_BYTES / (1024 * 1024)
 
 def register_routes(app, db):
-    CATEGORY_CHOICES = [
-        'Fiction',
-        'Fantasy',
-        'Science Fiction',
-        'Mystery',
-        'Romance',
-        'Nonfiction',
-        'Biography',
-        'Self-Help',
-        'History'
-    ]
-
-    def generate_unique_isbn():
-        def check_digit(prefix):
-            total = 0
-            for idx, ch in enumerate(prefix):
-                val = int(ch)
-                total += val if idx % 2 == 0 else 3 * val
-            return str((10 - (total % 10)) % 10)
-
-        while True:
-            body = '978' + ''.join(str(random.randint(0, 9)) for _ in range(9))
-            isbn_candidate = body + check_digit(body)
-            if not Book.query.filter_by(isbn=isbn_candidate).first():
-                return isbn_candidate
-    
+    def _catalog_pages(selected_category, after, categories=None, source=catalog):
+        """Return ({category: books}, {category: next_cursor}) for a dashboard page
+
+        `source` is catalog, or catalog_cache for pages that may be served
+        from the cache.
+        """
+        if selected_category:
+            books, next_cursor = source.category_page(selected_category, after)
+            pages = {selected_category: (books, next_cursor)} if books else {}
+        else:
+            pages = source.first_pages(categories)
+        category_to_books = {category: books for category, (books, _) in pages.items()}
+        next_cursors = {category: cursor for category, (_, cursor) in pages.items() if cursor}
+        return category_to_books, next_cursors
+
     # ---------- HOME ----------
     @app.route("/health")
     def health():
@@ -67,8 +81,24 @@ def register_routes(app, db):
             password = request.form['password']
             
             user = User.query.filter_by(username=username).first()
-            
-            if user and user.check_password(password):
+
+            try:
+                authenticated = user is not None and user.check_password(password)
+            except PasswordHasherBusy:
+                flash('Too many sign-ins right now. Please try again in a moment.', 'error')
+                return render_template('login.html'), 503
+
+            if authenticated and needs_rehash(user.password_hash):
+                # Stored with an outdated method or cost; the plain password
+                # is only available now, so upgrade the hash while we have it
+                try:
+                    user.set_password(password)
+                    db.session.commit()
+                except Exception as e:
+                    db.session.rollback()
+                    app.logger.warning("Password rehash for user %s skipped: %s", user.user_id, e)
+
+            if authenticated:
                 session['user_id'] = user.user_id
                 session['username'] = user.username
                 session['role'] = user.role
@@ -107,6 +137,7 @@ def register_routes(app, db):
                 new_user.set_password(password)
                 db.session.add(new_user)
                 db.session.commit()
+                metrics.record_user_added()
                 flash('User created successfully! You can now log in.', 'success')
                 return redirect(url_for('login'))
             except Exception as e:
@@ -118,6 +149,8 @@ def register_routes(app, db):
 
     # ---------- USER DASHBOARD ----------
     @app.route('/user/dashboard', methods=['GET', 'POST'])
+    @read_only
+    @conditional(lambda: catalog_cache.max_staleness)
     def user_dashboard():
         if 'role' not in session or session['role'] != 'user':
             flash('Please log in as a user to access this page.', 'error')
@@ -136,108 +169,105 @@ def register_routes(app, db):
                 flash('Invalid date format.', 'error')
                 return redirect(url_for('user_dashboard'))
 
+            try:
+                book_id = int(book_id)
+            except (TypeError, ValueError):
+                flash('This book is currently unavailable.', 'error')
+                return redirect(url_for('user_dashboard'))
+
             max_due_date = datetime.utcnow() + timedelta(days=14)
             if due_date > max_due_date:
                 flash('Due date cannot exceed 2 weeks from today.', 'error')
                 return redirect(url_for('user_dashboard'))
 
-            available_copy = BookCopy.query.filter_by(book_id=book_id, status='available').first()
-            if not available_copy:
-                flash('This book is currently unavailable.', 'error')
-                return redirect(url_for('user_dashboard'))
-
             try:
-                available_copy.status = 'borrowed'
-
-                # Decrement book count
-                book = Book.query.get(available_copy.book_id)
-                if book.available_copies > 0:
-                    book.available_copies -= 1
-
-                # Create transaction
-                transaction = BorrowTransaction(
-                    copy_id=available_copy.copy_id,
+                # Claim a copy and record the borrow atomically
+                borrow = borrow_book(
                     user_id=user_id,
-                    borrow_date=datetime.now(),
-                    due_date=due_date
+                    book_id=book_id,
+                    due_date=due_date,
+                    borrow_date=datetime.now()
                 )
-                db.session.add(transaction)
                 db.session.commit()
-                flash(f'You borrowed "{book.title}". Due on {due_date:%Y-%m-%d}.', 'success')
+                metrics.record_borrow()
+                catalog_cache.availability_changed(book_id)
+                flash(f'You borrowed "{borrow.title}". Due on {due_date:%Y-%m-%d}.', 'success')
+            except BookUnavailable:
+                db.session.rollback()
+                flash('This book is currently unavailable.', 'error')
             except Exception as e:
                 db.session.rollback()
                 flash(f'Error processing borrow request: {e}', 'error')
 
             return redirect(url_for('user_dashboard'))
 
-        # GET request — list all books
-        all_books = Book.query.all()
-        category_to_books = {}
-        for b in all_books:
-            key = b.category or 'Uncategorized'
-            category_to_books.setdefault(key, []).append(b)
+        # GET request — one page per category (or the next page of one category)
+        selected_category = request.args.get('category', '')
+        category_to_books, next_cursors = _catalog_pages(
+            selected_category, request.args.get('after'), source=catalog_cache
+        )
+
+        return render_template(
+            'user_dashboard.html',
+            username=session.get('username'),
+            category_to_books=category_to_books,
+            next_cursors=next_cursors,
+            selected_category=selected_category
+        )
+
+    # ---------- SEARCH ----------
+    @app.route('/search')
+    @read_only
+    @conditional()
+    def search():
+        if 'role' not in session or session['role'] != 'user':
+            flash('Please log in as a user to access this page.', 'error')
+            return redirect(url_for('login'))
+
+        query = (request.args.get('q') or '').strip()
+        if not query:
+            return redirect(url_for('user_dashboard'))
 
+        books, next_cursor = search_books(query, request.args.get('after'))
         return render_template(
             'user_dashboard.html',
             username=session.get('username'),
-            category_to_books=category_to_books
+            category_to_books={f'Results for "{query}"': books} if books else {},
+            next_cursors={},
+            selected_category='',
+            search_query=query,
+            search_cursor=next_cursor
         )
 
     # ---------- ADMIN DASHBOARD ----------
     @app.route('/admin/dashboard')
+    @read_only
+    @conditional()
     def admin_dashboard():
         if 'role' not in session or session['role'] != 'admin':
             flash('You do not have permission to view this page.', 'error')
             return redirect(url_for('login'))
 
         try:
-            all_users = User.query.all()
-            all_books = Book.query.all()
-            all_copies = BookCopy.query.all()
-            active_borrows = BorrowTransaction.query.filter_by(return_date=None).all()
+            category_options = catalog.category_names()
+            selected_category = request.args.get('category', '')
+            if selected_category not in category_options:
+                selected_category = ''
 
-            category_to_books_full = {}
-            book_availability = {}
+            category_to_books, next_cursors = _catalog_pages(
+                selected_category, request.args.get('after'), category_options
+            )
+            page_book_ids = [b.book_id for books in category_to_books.values() for b in books]
 
-            if not all_books:
+            if not page_book_ids:
                 flash("No books found in the database.", "info")
 
-            # ✅ iterate safely
-            for book in all_books:
-                if not book:
-                    continue  # skip any malformed record
-
-                key = book.category or 'Uncategorized'
-                category_to_books_full.setdefault(key, []).append(book)
-
-                try:
-                    available_count = (
-                        BookCopy.query.filter_by(book_id=book.book_id, status='available').count()
-                    )
-                except Exception:
-                    available_count = 0  # fail-safe fallback if book_id is missing
-
-                book_availability[book.book_id] = available_count
-
-            category_options = sorted(category_to_books_full.keys())
-            selected_category = request.args.get('category', '')
-
-            if selected_category and selected_category in category_to_books_full:
-                category_to_books = {selected_category: category_to_books_full[selected_category]}
-            else:
-                category_to_books = category_to_books_full
-                selected_category = ''
-
             return render_template(
                 'admin_page.html',
-                users=all_users,
-                books=all_books,
-                copies=all_copies,
-                borrows=active_borrows,
                 category_to_books=category_to_books,
+                next_cursors=next_cursors,
                 category_options=category_options,
-                selected_category=selected_category,
-                book_availability=book_availability
+                selected_category=selected_category
             )
 
         except Exception as e:
@@ -245,6 +275,29 @@ def register_routes(app, db):
             flash(f"Error accessing database: {e}", 'error')
             return f"An error occurred: {e}", 500
 
+    @app.route('/admin/search')
+    @read_only
+    @conditional()
+    def admin_search():
+        if 'role' not in session or session['role'] != 'admin':
+            flash('You do not have permission to view this page.', 'error')
+            return redirect(url_for('login'))
+
+        query = (request.args.get('q') or '').strip()
+        if not query:
+            return redirect(url_for('admin_dashboard'))
+
+        books, next_cursor = search_books(query, request.args.get('after'))
+        return render_template(
+            'admin_page.html',
+            category_to_books={f'Results for "{query}"': books} if books else {},
+            next_cursors={},
+            category_options=catalog.category_names(),
+            selected_category='',
+            search_query=query,
+            search_cursor=next_cursor
+        )
+
 
     # ---------- ADD BOOK ----------
     @app.route('/admin/books/new', methods=['GET', 'POST'])
@@ -288,17 +341,18 @@ def register_routes(app, db):
                 )
 
             try:
-                isbn = generate_unique_isbn()
-                # Create book
+                isbn = isbn_allocator.allocate()
+                # Create book (flush only, to get its id inside this transaction)
                 new_book = Book(title=title, author=author, category=category, isbn=isbn)
                 db.session.add(new_book)
-                db.session.commit()
+                db.session.flush()
 
-                # Create requested number of available copies
-                for _ in range(num_copies):
-                    db.session.add(BookCopy(book_id=new_book.book_id, status='available'))
-                new_book.available_copies = num_copies
+                # Create requested number of available copies in bulk, one commit
+                # (the availability triggers count them into available_copies)
+                add_copies(new_book.book_id, num_copies)
                 db.session.commit()
+                metrics.record_books_added(1, num_copies)
+                catalog_cache.book_changed(new_book.book_id, category)
 
                 flash(f'Book added successfully with {num_copies} available copy(ies).', 'success')
                 return redirect(url_for('admin_dashboard'))
@@ -316,6 +370,79 @@ def register_routes(app, db):
 
         return render_template('add_book.html', categories=CATEGORY_CHOICES)
 
+    # ---------- IMPORT CATALOG ----------
+    @app.route('/admin/books/import', methods=['GET', 'POST'])
+    def import_books():
+        if 'role' not in session or session['role'] != 'admin':
+            flash('You do not have permission to view this page.', 'error')
+            return redirect(url_for('login'))
+
+        if request.method == 'POST':
+            # Checked before the body is read; one without a Content-Length could be any size
+            if request.content_length is None or request.content_length > IMPORT_MAX_UPLOAD_BYTES:
+                message = (f'Uploads are limited to {IMPORT_MAX_UPLOAD_MB:g} MB; '
+                           'import larger catalogs with flask import-catalog.')
+                if request.mimetype != 'multipart/form-data':
+                    return jsonify({'error': message}), 413
+                flash(message, 'error')
+                return render_template('import_books.html', max_upload_mb=IMPORT_MAX_UPLOAD_MB,
+                                       max_copies=IMPORT_MAX_COPIES), 413
+
+            upload = request.files.get('file')
+            if upload is not None and upload.filename:
+                # Multipart form upload (spooled to disk by werkzeug, parsed as a stream)
+                fmt = request.form.get('format') or detect_format(upload.filename)
+                stream = upload.stream
+            else:
+                # Raw body upload from scripts: text/csv or application/x-ndjson
+                fmt = request.args.get('format') or IMPORT_CONTENT_TYPES.get(request.mimetype)
+                stream = request.stream
+
+            if fmt not in IMPORT_FORMATS:
+                message = 'Upload a .csv or .jsonl file.'
+                if upload is None:
+                    return jsonify({'error': message}), 400
+                flash(message, 'error')
+                return render_template('import_books.html', max_upload_mb=IMPORT_MAX_UPLOAD_MB,
+                                       max_copies=IMPORT_MAX_COPIES)
+
+            text_stream = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+            report = import_catalog(text_stream, fmt)
+            metrics.record_books_added(report.books_added, report.copies_added)
+            if report.books_added:
+                catalog_cache.clear()
+
+            if upload is None:
+                return jsonify(report.as_dict()), 200
+            return render_template('import_books.html', report=report,
+                                   max_upload_mb=IMPORT_MAX_UPLOAD_MB,
+                                   max_copies=IMPORT_MAX_COPIES)
+
+        return render_template('import_books.html', max_upload_mb=IMPORT_MAX_UPLOAD_MB,
+                               max_copies=IMPORT_MAX_COPIES)
+
+    # ---------- EXPORT TABLE ----------
+    @app.route('/admin/export/<table>')
+    def export_data(table):
+        if 'role' not in session or session['role'] != 'admin':
+            flash('You do not have permission to view this page.', 'error')
+            return redirect(url_for('login'))
+
+        fmt = request.args.get('format', 'csv')
+        compress = request.args.get('gzip', '').lower() in ('1', 'true', 'yes')
+        if table not in EXPORT_TABLES or fmt not in EXPORT_FORMATS:
+            return jsonify({'error': 'Unknown table or format.'}), 404
+
+        # stream_with_context keeps the session (and its server-side cursor)
+        # alive while the response body is generated
+        body = stream_with_context(export_table(table, fmt, compress))
+        response = Response(body, mimetype=EXPORT_FORMATS[fmt][0])
+        if compress:
+            response.mimetype = 'application/gzip'
+        filename = export_filename(table, fmt, compress)
+        response.headers['Content-Disposition'] = f'attachment; filename="{filename}"'
+        return response
+
     # ---------- EDIT BOOK ----------
     @app.route('/admin/books/<int:book_id>/edit', methods=['GET', 'POST'])
     def edit_book(book_id):
@@ -347,10 +474,12 @@ def register_routes(app, db):
                 )
 
             try:
+                previous_category = book.category
                 book.title = title
                 book.author = author
                 book.category = category
                 db.session.commit()
+                catalog_cache.book_changed(book_id, previous_category, category)
                 flash('Book updated successfully.', 'success')
                 return redirect(url_for('admin_dashboard'))
             except Exception as e:
@@ -376,8 +505,16 @@ def register_routes(app, db):
 
         book = Book.query.get_or_404(book_id)
         try:
+            copy_counts = catalog.copy_status_counts(book_id)
+            category = book.category
             db.session.delete(book)
             db.session.commit()
+            catalog_cache.book_changed(book_id, category)
+            metrics.record_book_removed(
+                available=copy_counts.get('available', (0, 0))[0],
+                borrowed=copy_counts.get('borrowed', (0, 0))[0],
+                open_borrows=sum(borrows for _, borrows in copy_counts.values())
+            )
             flash('Book removed.', 'success')
         except Exception as e:
             db.session.rollback()
@@ -402,22 +539,29 @@ def register_routes(app, db):
         admin_user.set_password('password123')
         db.session.add(admin_user)
         db.session.commit()
+        metrics.record_user_added()
         return 'Admin user "admin" with password "password123" created!'
     # ---------- MY BOOKS ----------
     @app.route('/user/my_books')
+    @read_only
+    @conditional()
     def my_books():
         if 'role' not in session or session['role'] != 'user':
             flash('Please log in as a user to access this page.', 'error')
             return redirect(url_for('login'))
 
         user_id = session['user_id']
-        borrows = BorrowTransaction.query.filter_by(user_id=user_id).order_by(BorrowTransaction.borrow_date.desc()).all()
+        after = request.args.get('after')
+        # Borrows joined with their copy and book in one statement, one page at a time
+        borrows, next_cursor = catalog.borrow_history(user_id, after)
         current_time = datetime.utcnow()
 
         return render_template(
             'my_books.html',
             username=session.get('username'),
             borrows=borrows,
+            next_cursor=next_cursor,
+            is_first_page=not after,
             now=current_time  # ✅ Pass actual datetime, not a function
         )
     
@@ -435,11 +579,13 @@ def register_routes(app, db):
             return redirect(url_for('my_books'))
 
         try:
+            # The availability trigger puts the copy back into available_copies
             transaction.book_copy.status = 'available'
             book = transaction.book_copy.book
-            book.available_copies += 1
             db.session.delete(transaction)
             db.session.commit()
+            metrics.record_return()
+            catalog_cache.availability_changed(book.book_id)
             flash(f'Book "{book.title}" returned successfully.', 'success')
         except Exception as e:
             db.session.rollback()
@@ -0,0 +1,118 @@
+"""
+Catalog search: ranked full-text and prefix matching over titles and authors
+
+On PostgreSQL every word of the query is matched against book.search_vector
+(see the search section of models.py), as a prefix when it is long enough.
+When the trigram index exists, the whole query is also compared by trigram
+word similarity, so a misspelt word still finds its book. Matches are
+ordered by rank and
+paginated with the same opaque keyset cursors as the catalog pages. Other
+databases fall back to unranked substring matching in book_id order.
+"""
+import os
+import re
+
+from sqlalchemy import and_, func, literal, or_, select, text
+
+from app import db
+from models import Book, SEARCH_DOCUMENT
+from catalog import LISTING_COLUMNS, encode_cursor, decode_cursor
+
+SEARCH_PAGE_SIZE = int(os.getenv('SEARCH_PAGE_SIZE', '25'))
+
+# Words beyond this only narrow the match further
+MAX_SEARCH_TERMS = 8
+
+# Shorter words are matched whole; as prefixes they would match (and have to
+# rank) a large share of the catalog
+MIN_PREFIX_LENGTH = 3
+
+# The ranked matches are materialized so the cursor filter reuses each rank
+# instead of computing it again
+_PG_SEARCH = """
+    WITH ranked AS MATERIALIZED (
+        SELECT book_id, title, author, isbn, category, available_copies,
+               round(({rank})::numeric, 4) AS rank
+        FROM book, to_tsquery('simple', :prefixes) AS query
+        WHERE {match}
+    )
+    SELECT * FROM ranked
+    {after}
+    ORDER BY rank DESC, book_id
+    LIMIT :limit
+"""
+_FULLTEXT_RANK = "ts_rank(search_vector, query)"
+_FULLTEXT_MATCH = "search_vector @@ query"
+_TRIGRAM_RANK = f" + word_similarity(:query, {SEARCH_DOCUMENT})"
+_TRIGRAM_MATCH = f" OR :query <% ({SEARCH_DOCUMENT})"
+_AFTER = "WHERE rank < :rank OR (rank = :rank AND book_id > :book_id)"
+
+# Whether ix_book_search_trgm exists; looked up once per process
+_trigram_index = None
+
+
+def search_terms(query):
+    """Return the lowercased words of `query` used for matching"""
+    return re.findall(r'\w+', query.lower())[:MAX_SEARCH_TERMS]
+
+
+def search_books(query, after=None, limit=SEARCH_PAGE_SIZE):
+    """Return (rows, next_cursor) of books matching `query`, best matches first
+
+    Rows carry the catalog listing columns plus `rank`.
+    """
+    terms = search_terms(query)
+    if not terms:
+        return [], None
+    position = decode_cursor(after, float, int)
+
+    if db.session.get_bind().dialect.name == 'postgresql':
+        rows = _search_postgresql(query, terms, position, limit)
+    else:
+        rows = _search_portable(terms, position, limit)
+
+    if len(rows) > limit:
+        last = rows[limit - 1]
+        return rows[:limit], encode_cursor(float(last.rank), last.book_id)
+    return rows, None
+
+
+def _has_trigram_index():
+    global _trigram_index
+    if _trigram_index is None:
+        _trigram_index = db.session.execute(
+            text("SELECT to_regclass('ix_book_search_trgm') IS NOT NULL")
+        ).scalar()
+    return _trigram_index
+
+
+def _search_postgresql(query, terms, position, limit):
+    rank, match = _FULLTEXT_RANK, _FULLTEXT_MATCH
+    if _has_trigram_index():
+        rank, match = rank + _TRIGRAM_RANK, match + _TRIGRAM_MATCH
+    statement = _PG_SEARCH.format(rank=rank, match=match, after=_AFTER if position else '')
+
+    params = {
+        'prefixes': ' & '.join(
+            f'{term}:*' if len(term) >= MIN_PREFIX_LENGTH else term for term in terms
+        ),
+        'query': ' '.join(terms),
+        'limit': limit + 1,  # one extra row tells whether another page exists
+    }
+    if position:
+        params['rank'], params['book_id'] = position
+    return db.session.execute(text(statement), params).all()
+
+
+def _search_portable(terms, position, limit):
+    # Same row shape as the PostgreSQL path, with every rank 0
+    stmt = select(*LISTING_COLUMNS, literal(0).label('rank')).where(and_(*(
+        or_(
+            func.lower(Book.title).contains(term, autoescape=True),
+            func.lower(Book.author).contains(term, autoescape=True),
+        )
+        for term in terms
+    )))
+    if position:
+        stmt = stmt.where(Book.book_id > position[1])
+    return db.session.execute(stmt.order_by(Book.book_id).limit(limit + 1)).all()
@@ -1,36 +1,206 @@
+"""
+Database credentials from AWS Secrets Manager
+
+Credentials are cached in memory (and optionally on disk) for DB_SECRET_TTL
+seconds and refreshed by a background thread shortly before they expire, so
+workers do not block on Secrets Manager at boot and a rotated password is
+picked up without a restart: the `do_connect` hook installed by
+install_connect_hook hands every new pool connection the current password.
+
+Works with:
+- Local development (aws configure)
+- EKS with IRSA
+- A local Secrets Manager stub (DB_SECRET_ENDPOINT_URL, see
+  Scripts/secrets-manager-stub.py)
+"""
 import json
-import boto3
+import logging
 import os
+import tempfile
+import threading
+import time
+
+from sqlalchemy import event
+
+logger = logging.getLogger(__name__)
+
+# Seconds a fetched secret is trusted before it must be fetched again
+DB_SECRET_TTL = float(os.getenv("DB_SECRET_TTL", "900"))
+
+# The background thread refreshes this many seconds before the TTL runs out
+DB_SECRET_REFRESH_MARGIN = float(os.getenv("DB_SECRET_REFRESH_MARGIN", "120"))
+
+# Wait before retrying after a failed background refresh
+DB_SECRET_RETRY_INTERVAL = float(os.getenv("DB_SECRET_RETRY_INTERVAL", "30"))
+
+# Optional file shared by the workers of a pod so only the first one to boot
+# calls Secrets Manager (mount an emptyDir; the file is created 0600)
+DB_SECRET_CACHE_FILE = os.getenv("DB_SECRET_CACHE_FILE")
+
+
+class CredentialProvider:
+    """TTL-cached DB credentials with background refresh"""
+
+    def __init__(self, secret_name=None, region_name=None, endpoint_url=None,
+                 ttl=DB_SECRET_TTL, refresh_margin=DB_SECRET_REFRESH_MARGIN,
+                 cache_file=DB_SECRET_CACHE_FILE):
+        self.secret_name = secret_name or os.getenv("DB_SECRET_NAME", "rds/app-db-credentials")
+        self.region_name = region_name or os.getenv("AWS_REGION", "eu-north-1")
+        self.endpoint_url = endpoint_url or os.getenv("DB_SECRET_ENDPOINT_URL")
+        self.ttl = ttl
+        self.refresh_margin = min(refresh_margin, ttl / 2)
+        self.cache_file = cache_file
+        self.fetch_count = 0
+        self._credentials = None
+        self._fetched_at = 0.0
+        self._client = None
+        self._lock = threading.Lock()
+        self._thread = None
+        self._thread_pid = None
+
+    # ---------- reading ----------
+
+    def get(self, force_refresh=False):
+        """Return {"username", "password"}, fetching only when the cache is stale"""
+        credentials = self._credentials
+        if not force_refresh and credentials is not None and self._fresh():
+            return dict(credentials)  # fast path: no lock while another thread refreshes
+        with self._lock:
+            if force_refresh or not self._fresh():
+                if not force_refresh:
+                    self._load_cache_file()
+                if force_refresh or not self._fresh():
+                    self._store(self._fetch())
+            return dict(self._credentials)
+
+    def _fresh(self):
+        return self._credentials is not None and time.time() - self._fetched_at < self.ttl
+
+    def _store(self, credentials):
+        changed = self._credentials is not None and credentials != self._credentials
+        self._credentials = credentials
+        self._fetched_at = time.time()
+        if changed:
+            logger.info("Database credentials rotated")
+        self._write_cache_file()
+
+    # ---------- Secrets Manager ----------
+
+    def _fetch(self):
+        if self._client is None:
+            # Deferred so importing the app does not pay for boto3
+            import boto3
+            self._client = boto3.client(
+                "secretsmanager",
+                region_name=self.region_name,
+                endpoint_url=self.endpoint_url,
+            )
+        try:
+            response = self._client.get_secret_value(SecretId=self.secret_name)
+        except Exception as e:
+            raise RuntimeError(f"Failed to load DB secret: {e}")
+        self.fetch_count += 1
+
+        secret = json.loads(response["SecretString"])
+        return {
+            "username": secret["username"],
+            "password": secret["password"]
+        }
+
+    # ---------- on-disk cache ----------
+
+    def _load_cache_file(self):
+        if not self.cache_file:
+            return
+        try:
+            with open(self.cache_file) as f:
+                cached = json.load(f)
+        except (OSError, ValueError):
+            return
+        if cached.get("secret_name") == self.secret_name and \
+                time.time() - cached.get("fetched_at", 0) < self.ttl:
+            self._credentials = cached["credentials"]
+            self._fetched_at = cached["fetched_at"]
+
+    def _write_cache_file(self):
+        if not self.cache_file:
+            return
+        payload = {
+            "secret_name": self.secret_name,
+            "fetched_at": self._fetched_at,
+            "credentials": self._credentials,
+        }
+        directory = os.path.dirname(os.path.abspath(self.cache_file))
+        try:
+            fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".db-secret-")
+            with os.fdopen(fd, "w") as f:  # mkstemp creates the file 0600
+                json.dump(payload, f)
+            os.replace(tmp_path, self.cache_file)
+        except OSError as e:
+            logger.warning("Could not write DB secret cache %s: %s", self.cache_file, e)
+
+    # ---------- background refresh ----------
+
+    def start_background_refresh(self):
+        """Start (once per process) the daemon thread that refreshes before expiry"""
+        with self._lock:
+            if self._thread is not None and self._thread_pid == os.getpid():
+                return self._thread
+            self._thread = threading.Thread(
+                target=self._refresh_forever, name="db-secret-refresh", daemon=True
+            )
+            self._thread_pid = os.getpid()
+            self._thread.start()
+            return self._thread
+
+    def _next_refresh_in(self):
+        return max(self._fetched_at + self.ttl - self.refresh_margin - time.time(), 0)
+
+    def _refresh_forever(self):
+        while True:
+            time.sleep(self._next_refresh_in())
+            try:
+                self.get(force_refresh=True)
+            except Exception as e:
+                # Keep serving the cached credentials and try again shortly
+                logger.warning("Background DB secret refresh failed: %s", e)
+                time.sleep(DB_SECRET_RETRY_INTERVAL)
+
+
+credential_provider = CredentialProvider()
 
 
 def get_db_credentials():
     """
-    Load DB credentials securely from AWS Secrets Manager
-    Works with:
-    - Local development (aws configure)
-    - EKS with IRSA
+    Load DB credentials from the cached provider
+    (hits Secrets Manager only when the cache is empty or stale)
     """
+    return credential_provider.get()
 
-    secret_name = os.getenv(
-        "DB_SECRET_NAME",
-        "rds/app-db-credentials"
-    )
 
-    region_name = os.getenv(
-        "AWS_REGION",
-        "eu-north-1"
-    )
+def _is_auth_failure(dialect, error):
+    return isinstance(error, dialect.dbapi.OperationalError) and \
+        "password authentication failed" in str(error)
 
-    client = boto3.client("secretsmanager", region_name=region_name)
 
-    try:
-        response = client.get_secret_value(SecretId=secret_name)
-    except Exception as e:
-        raise RuntimeError(f"Failed to load DB secret: {e}")
+def install_connect_hook(engine, provider=credential_provider):
+    """Give every new connection of `engine` the provider's current credentials
 
-    secret = json.loads(response["SecretString"])
+    If the server rejects them (rotated since the last refresh), the secret is
+    re-fetched once and the connection retried.
+    """
+    if engine.dialect.name != "postgresql":
+        return
 
-    return {
-        "username": secret["username"],
-        "password": secret["password"]
-    }
+    @event.listens_for(engine, "do_connect")
+    def _connect_with_current_credentials(dialect, conn_rec, cargs, cparams):
+        creds = provider.get()
+        cparams.update(user=creds["username"], password=creds["password"])
+        try:
+            return dialect.connect(*cargs, **cparams)
+        except Exception as e:
+            if not _is_auth_failure(dialect, e):
+                raise
+            creds = provider.get(force_refresh=True)
+            cparams.update(user=creds["username"], password=creds["password"])
+            return dialect.connect(*cargs, **cparams)
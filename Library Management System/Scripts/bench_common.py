@@ -0,0 +1,245 @@
+"""
+Shared helpers for the Shelf Check benchmark scripts
+
+Builds a bare Flask app around the real models without going through
+create_app (no Secrets Manager lookup), so benchmarks can point at a local
+Postgres or an in-memory SQLite database via BENCH_DATABASE_URL.
+
+Benchmarks of the deployed stack instead run the real app under gunicorn,
+with credentials served by the local Secrets Manager stub.
+"""
+import asyncio
+import importlib.util
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+from contextlib import contextmanager
+from urllib.parse import urlparse
+
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+APP_DIR = os.path.join(SCRIPTS_DIR, '..', 'SC_DbApp')
+sys.path.insert(0, APP_DIR)
+
+from flask import Flask
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from app import db
+
+DATABASE_URL = os.getenv('BENCH_DATABASE_URL', 'sqlite://')
+
+
+def make_app(database_url=DATABASE_URL, create_schema=True, with_routes=False):
+    """Return an app (with a pushed app context) bound to the benchmark database"""
+    app = Flask(__name__, template_folder=os.path.join(APP_DIR, 'templates'))
+    app.config['SQLALCHEMY_DATABASE_URI'] = database_url
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    app.config['SECRET_KEY'] = 'bench'
+    db.init_app(app)
+
+    ctx = app.app_context()
+    ctx.push()
+
+    import models  # noqa: F401  (register tables on db.metadata)
+    if create_schema:
+        db.create_all()
+    if with_routes:
+        from routes import register_routes
+        from api import register_api
+        from assets import init_assets
+        from compression import init_response_compression
+        register_routes(app, db)
+        register_api(app, db)
+        init_assets(app)
+        init_response_compression(app)
+    return app
+
+
+def logged_in_client(app, user):
+    """Return a test client whose session is logged in as `user`"""
+    client = app.test_client()
+    with client.session_transaction() as sess:
+        sess['user_id'] = user.user_id
+        sess['username'] = user.username
+        sess['role'] = user.role
+    return client
+
+
+class HydrationCounter:
+    """Count ORM instances loaded from the database while active"""
+
+    def __init__(self):
+        self.count = 0
+
+    def _loaded(self, session, instance):
+        self.count += 1
+
+    def __enter__(self):
+        self.count = 0
+        event.listen(Session, 'loaded_as_persistent', self._loaded)
+        return self
+
+    def __exit__(self, *exc):
+        event.remove(Session, 'loaded_as_persistent', self._loaded)
+
+
+class QueryCounter:
+    """Count statements sent to the database while active"""
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.count = 0
+
+    def _before(self, *args):
+        self.count += 1
+
+    def __enter__(self):
+        self.count = 0
+        event.listen(self.engine, 'before_cursor_execute', self._before)
+        return self
+
+    def __exit__(self, *exc):
+        event.remove(self.engine, 'before_cursor_execute', self._before)
+
+
+@contextmanager
+def timed(label):
+    """Print the wall-clock time spent in the block"""
+    start = time.perf_counter()
+    yield
+    print(f"{label}: {(time.perf_counter() - start) * 1000:.1f} ms")
+
+
+# ---------- FULL APP UNDER GUNICORN ----------
+
+SECRET_ID = 'rds/app-db-credentials'
+BOOT_TIMEOUT = 60
+
+
+def load_secrets_stub():
+    """Import Scripts/secrets-manager-stub.py (not importable by name)"""
+    spec = importlib.util.spec_from_file_location(
+        'secrets_manager_stub', os.path.join(SCRIPTS_DIR, 'secrets-manager-stub.py')
+    )
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def app_environment(database_url=DATABASE_URL, db_address=None):
+    """Return (env, stub server, stub store) for running create_app against the stub
+
+    The DB_* settings and the stubbed secret come from `database_url` when it
+    is a Postgres URL; otherwise no page touching the database will work.
+    `db_address` overrides the (host, port) the app connects to, e.g. a
+    latency_proxy in front of the database.
+    """
+    url = urlparse(database_url) if database_url.startswith('postgresql') else None
+    secret = {'username': (url.username if url else None) or 'app',
+              'password': (url.password if url else None) or 'app'}
+    server, store = load_secrets_stub().serve(secrets={SECRET_ID: secret}, quiet=True)
+
+    env = dict(os.environ)
+    env.update({
+        'DB_SECRET_ENDPOINT_URL': f'http://127.0.0.1:{server.server_port}',
+        'AWS_ACCESS_KEY_ID': env.get('AWS_ACCESS_KEY_ID', 'stub'),
+        'AWS_SECRET_ACCESS_KEY': env.get('AWS_SECRET_ACCESS_KEY', 'stub'),
+        'DB_HOST': url.hostname if url else '127.0.0.1',
+        'DB_PORT': str(url.port or 5432) if url else '5432',
+        'DB_NAME': url.path.lstrip('/') if url else 'appdb',
+        'PROMETHEUS_MULTIPROC_DIR': tempfile.mkdtemp(prefix='bench-prom-'),
+    })
+    if db_address:
+        env['DB_HOST'], env['DB_PORT'] = db_address[0], str(db_address[1])
+    env.pop('DB_SECRET_CACHE_FILE', None)
+    if not url:
+        env['METRICS_RECONCILE_INTERVAL'] = '0'  # no database to reconcile against
+    return env, server, store
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+@contextmanager
+def latency_proxy(host, port, delay_ms):
+    """Forward a local TCP port to host:port, adding `delay_ms` of round-trip time
+
+    Stands in for the network between a pod and RDS when benchmarking
+    against a local database. Yields the proxy's (host, port).
+    """
+    loop = asyncio.new_event_loop()
+    one_way = delay_ms / 2000
+
+    async def pump(reader, writer):
+        try:
+            while True:
+                data = await reader.read(65536)
+                if not data:
+                    break
+                await asyncio.sleep(one_way)
+                writer.write(data)
+                await writer.drain()
+        except OSError:
+            pass
+        finally:
+            writer.close()
+
+    async def handle(client_reader, client_writer):
+        try:
+            server_reader, server_writer = await asyncio.open_connection(host, port)
+        except OSError:
+            client_writer.close()
+            return
+        await asyncio.gather(pump(client_reader, server_writer), pump(server_reader, client_writer))
+
+    server = loop.run_until_complete(asyncio.start_server(handle, '127.0.0.1', 0, backlog=1024))
+    thread = threading.Thread(target=loop.run_forever, name='latency-proxy', daemon=True)
+    thread.start()
+    try:
+        yield server.sockets[0].getsockname()[:2]
+    finally:
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join()
+
+
+@contextmanager
+def running_gunicorn(env, ready_path='/login', **settings):
+    """Run `gunicorn -c gunicorn.conf.py` and yield (base_url, seconds until ready)
+
+    `settings` become environment variables, e.g. GUNICORN_WORKERS=4.
+    """
+    port = free_port()
+    env = dict(env, PORT=str(port), **{k: str(v) for k, v in settings.items()})
+    base_url = f'http://127.0.0.1:{port}'
+    log = tempfile.TemporaryFile(mode='w+')
+    started = time.perf_counter()
+    proc = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', 'app:create_app()'],
+        cwd=APP_DIR, env=env, stdout=subprocess.DEVNULL, stderr=log
+    )
+    try:
+        while True:
+            if proc.poll() is not None:
+                log.seek(0)
+                sys.exit(f'gunicorn exited early:\n{log.read()}')
+            if time.perf_counter() - started > BOOT_TIMEOUT:
+                sys.exit(f'gunicorn did not answer within {BOOT_TIMEOUT}s')
+            try:
+                with urllib.request.urlopen(base_url + ready_path, timeout=5) as response:
+                    response.read()
+                break
+            except OSError:
+                time.sleep(0.02)
+        yield base_url, time.perf_counter() - started
+    finally:
+        proc.terminate()
+        proc.wait()
+        log.close()
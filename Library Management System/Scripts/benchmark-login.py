@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+"""
+Benchmark login throughput and what a login storm does to other requests
+
+  * cost: CPU time of one verification per hash method, as logins/sec per core
+  * storm: `login_threads` clients POST /login while `other_threads` clients
+    GET /login (a cheap page) on the same process, first with an unbounded
+    hashing pool (one hashing thread per login client, the old behaviour of
+    hashing on every request thread), then with the configured
+    PASSWORD_HASH_WORKERS / PASSWORD_HASH_MAX_PENDING. Reports logins/sec,
+    logins per CPU-second, refused logins (503) and the cheap page's p50/p99.
+  * rehash: a user stored with an outdated method is upgraded by one login
+
+The process is pinned to --cores CPUs to stand in for a pod's CPU limit.
+
+Usage:
+    python3 benchmark-login.py [--cores 1] [--duration 10] [--login-threads 16]
+"""
+import argparse
+import os
+import statistics
+import tempfile
+import threading
+import time
+
+from bench_common import DATABASE_URL, make_app
+
+from werkzeug.security import generate_password_hash, check_password_hash
+
+from app import db
+from models import User
+import passwords
+
+METHODS = ['scrypt:32768:8:1', 'scrypt:16384:8:1', 'pbkdf2:sha256:600000', 'pbkdf2:sha256:1000000']
+PASSWORD = 'correct horse battery staple'
+
+
+def measure_cost(method, rounds=5):
+    stored = generate_password_hash(PASSWORD, method)
+    cpu = []
+    for _ in range(rounds):
+        started = time.process_time()
+        check_password_hash(stored, PASSWORD)
+        cpu.append(time.process_time() - started)
+    per_login = statistics.median(cpu)
+    print(f"  {method:<24} {per_login * 1000:8.1f} ms CPU   {1 / per_login:8.1f} logins/sec per core")
+
+
+def storm(app, duration, login_threads, other_threads):
+    logins, refused, page_latencies = [], [], []
+    deadline = time.perf_counter() + duration
+
+    def log_in():
+        client = app.test_client()
+        while time.perf_counter() < deadline:
+            response = client.post('/login', data={'username': 'reader', 'password': PASSWORD})
+            (logins if response.status_code == 302 else refused).append(response.status_code)
+
+    def browse():
+        client = app.test_client()
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+            client.get('/login')
+            page_latencies.append(time.perf_counter() - started)
+
+    threads = [threading.Thread(target=log_in) for _ in range(login_threads)]
+    threads += [threading.Thread(target=browse) for _ in range(other_threads)]
+    started, cpu_started = time.perf_counter(), time.process_time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed, cpu = time.perf_counter() - started, time.process_time() - cpu_started
+
+    ordered = sorted(page_latencies)
+    p50 = statistics.median(ordered) * 1000
+    p99 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))] * 1000
+    print(f"    {len(logins) / elapsed:7.1f} logins/sec   {len(logins) / cpu:7.1f} logins per CPU-second   "
+          f"refused {len(refused)}")
+    print(f"    GET /login alongside: {len(ordered) / elapsed:7.1f} req/sec   p50 {p50:7.1f} ms   p99 {p99:7.1f} ms")
+
+
+def check_rehash():
+    reader = User.query.filter_by(username='reader').one()
+    reader.password_hash = generate_password_hash(PASSWORD, 'pbkdf2:sha256:1000')
+    db.session.commit()
+    return reader.user_id
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--cores', type=int, default=1)
+    parser.add_argument('--duration', type=float, default=10)
+    parser.add_argument('--login-threads', type=int, default=16)
+    parser.add_argument('--other-threads', type=int, default=4)
+    args = parser.parse_args()
+
+    cores = sorted(os.sched_getaffinity(0))[:args.cores]
+    os.sched_setaffinity(0, cores)
+    print(f"pinned to {len(cores)} core(s); PASSWORD_HASH_METHOD={passwords.PASSWORD_HASH_METHOD}")
+
+    print("verification cost:")
+    for method in METHODS:
+        measure_cost(method)
+
+    # Request threads need a database they all share
+    database_url = DATABASE_URL
+    if database_url == 'sqlite://':
+        database_url = f"sqlite:///{tempfile.mkdtemp()}/login.db"
+    app = make_app(database_url, with_routes=True)
+    User.query.filter_by(username='reader').delete()
+    reader = User(username='reader', email='reader@example.com', role='user')
+    reader.set_password(PASSWORD)
+    db.session.add(reader)
+    db.session.commit()
+    db.session.remove()
+
+    print(f"login storm, {args.login_threads} login clients + {args.other_threads} page clients "
+          f"for {args.duration:.0f}s:")
+    pools = [
+        ('unbounded (hash on every request thread)',
+         passwords.HashingPool(workers=args.login_threads, max_pending=args.login_threads)),
+        (f'bounded (workers={passwords.PASSWORD_HASH_WORKERS}, '
+         f'max_pending={passwords.PASSWORD_HASH_MAX_PENDING})', passwords.HashingPool()),
+    ]
+    for label, pool in pools:
+        passwords.hashing_pool = pool
+        print(f"  {label}:")
+        storm(app, args.duration, args.login_threads, args.other_threads)
+
+    user_id = check_rehash()
+    app.test_client().post('/login', data={'username': 'reader', 'password': PASSWORD})
+    db.session.remove()
+    upgraded = db.session.get(User, user_id).password_hash
+    ok = not passwords.needs_rehash(upgraded)
+    print(f"{'ok  ' if ok else 'FAIL'} rehash on login: pbkdf2:sha256:1000 -> {upgraded.split('$', 1)[0]}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""
+Benchmark cold start: import time, create_app, first request, gunicorn boot
+
+Runs every measurement in a fresh interpreter against the local Secrets
+Manager stub, so nothing is warm:
+
+  * in-process: `import app`, `create_app()`, the first and second GET /login
+  * gunicorn: time from launch until /login answers, without and with
+    preload_app, for the given number of workers
+
+Point BENCH_DATABASE_URL at a Postgres database to have the app connect to a
+real server (otherwise no page that touches the database is requested).
+
+Usage:
+    python3 benchmark-startup.py [workers] [--importtime]
+"""
+import json
+import subprocess
+import sys
+
+from bench_common import APP_DIR, app_environment, running_gunicorn
+
+IN_PROCESS = r'''
+import json, sys, time
+t0 = time.perf_counter()
+import app
+t1 = time.perf_counter()
+flask_app = app.create_app()
+t2 = time.perf_counter()
+client = flask_app.test_client()
+status = client.get('/login').status_code
+t3 = time.perf_counter()
+client.get('/login')
+t4 = time.perf_counter()
+print(json.dumps({
+    'import app': t1 - t0, 'create_app()': t2 - t1,
+    'first GET /login': t3 - t2, 'second GET /login': t4 - t3,
+    'status': status, 'modules': len(sys.modules),
+}))
+'''
+
+
+def measure_in_process(env, importtime):
+    args = [sys.executable] + (['-X', 'importtime'] if importtime else []) + ['-c', IN_PROCESS]
+    proc = subprocess.run(args, cwd=APP_DIR, env=env, capture_output=True, text=True)
+    if proc.returncode != 0:
+        sys.exit(f'create_app failed:\n{proc.stderr}')
+    result = json.loads(proc.stdout.strip().splitlines()[-1])
+    print(f"in-process ({result['modules']} modules loaded, /login -> {result['status']}):")
+    for label in ('import app', 'create_app()', 'first GET /login', 'second GET /login'):
+        print(f"  {label:<20} {result[label] * 1000:8.1f} ms")
+    if importtime:
+        print_slowest_imports(proc.stderr)
+
+
+def print_slowest_imports(report, top=12):
+    rows = []
+    for line in report.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        if not name.startswith(' ' * 2):  # top-level imports only
+            rows.append((int(cumulative), name.strip()))
+    print('  slowest top-level imports:')
+    for cumulative, name in sorted(rows, reverse=True)[:top]:
+        print(f"    {name:<32} {cumulative / 1000:8.1f} ms")
+
+
+def measure_gunicorn(env, workers, preload):
+    with running_gunicorn(env, GUNICORN_WORKERS=workers,
+                          GUNICORN_PRELOAD='true' if preload else 'false') as (_, ready):
+        pass
+    mode = 'preload' if preload else 'no preload'
+    print(f"  {mode:<11} workers={workers:<3} ready after {ready * 1000:8.1f} ms")
+
+
+def main():
+    args = [arg for arg in sys.argv[1:] if not arg.startswith('--')]
+    workers = int(args[0]) if args else 4
+    importtime = '--importtime' in sys.argv
+
+    env, server, store = app_environment()
+
+    measure_in_process(env, importtime)
+    print('gunicorn cold start (launch until /login answers):')
+    for preload in (False, True):
+        calls_before = store.get_calls
+        measure_gunicorn(env, workers, preload)
+        print(f"  {'':<11} Secrets Manager calls: {store.get_calls - calls_before}")
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+"""
+Regression check: the admin dashboard must not hydrate whole tables
+
+Seeds users, books, copies and open borrows, renders /admin/dashboard and
+fails if the request loads more ORM instances or issues more queries than
+the page needs, however large the seeded tables are.
+
+Usage:
+    python3 check-admin-hydration.py [num_books]
+"""
+import sys
+from datetime import datetime, timedelta
+
+from bench_common import make_app, logged_in_client, HydrationCounter, QueryCounter
+
+from sqlalchemy import insert
+
+from app import db
+from models import User, Book, BookCopy, BorrowTransaction
+
+MAX_INSTANCES = 0   # listings are column projections
+MAX_QUERIES = 4     # categories, first pages, availability (+ slack)
+
+
+def seed(num_books):
+    admin = User(username='admin', email='admin@library.com', role='admin')
+    admin.set_password('password123')
+    db.session.add(admin)
+    db.session.execute(insert(User), [
+        {'username': f'reader{i}', 'email': f'reader{i}@example.com',
+         'password_hash': 'x', 'role': 'user'}
+        for i in range(num_books)
+    ])
+    db.session.execute(insert(Book), [
+        {'title': f'Title {i}', 'author': f'Author {i}', 'category': 'Fiction',
+         'isbn': f'check-{i}'}
+        for i in range(num_books)
+    ])
+    book_ids = [row[0] for row in db.session.query(Book.book_id)]
+    db.session.execute(insert(BookCopy), [
+        {'book_id': book_id, 'status': status}
+        for book_id in book_ids
+        for status in ('available', 'borrowed')
+    ])
+    reader_id = db.session.query(User.user_id).filter(User.role == 'user').first()[0]
+    borrowed = [row[0] for row in db.session.query(BookCopy.copy_id).filter_by(status='borrowed')]
+    db.session.execute(insert(BorrowTransaction), [
+        {'user_id': reader_id, 'copy_id': copy_id,
+         'borrow_date': datetime.utcnow(), 'due_date': datetime.utcnow() + timedelta(days=7)}
+        for copy_id in borrowed
+    ])
+    db.session.commit()
+    return admin
+
+
+def main():
+    num_books = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    app = make_app(with_routes=True)
+    admin = seed(num_books)
+    client = logged_in_client(app, admin)
+    db.session.remove()
+
+    with HydrationCounter() as hydrated, QueryCounter(db.engine) as queries:
+        response = client.get('/admin/dashboard')
+
+    print(f"status={response.status_code} instances={hydrated.count} queries={queries.count}")
+    if response.status_code != 200:
+        sys.exit(f"FAIL: unexpected status {response.status_code}")
+    if hydrated.count > MAX_INSTANCES:
+        sys.exit(f"FAIL: hydrated {hydrated.count} ORM instances (max {MAX_INSTANCES})")
+    if queries.count > MAX_QUERIES:
+        sys.exit(f"FAIL: issued {queries.count} queries (max {MAX_QUERIES})")
+    print("OK")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""
+Check the cached Secrets Manager credential provider against the local stub
+
+Verifies that repeated lookups hit Secrets Manager once per TTL, that a
+second process reuses the on-disk cache, and that a rotated password is
+picked up by the background refresh before the TTL runs out, without any
+request having to wait for it.
+
+Usage:
+    python3 check-credential-rotation.py
+"""
+import os
+import sys
+import tempfile
+import time
+
+from bench_common import SECRET_ID, load_secrets_stub
+
+# boto3 signs requests even for the stub, so it needs some credentials
+os.environ.setdefault('AWS_ACCESS_KEY_ID', 'stub')
+os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'stub')
+
+import boto3
+
+from secrets_loader import CredentialProvider
+
+TTL = 3.0
+REFRESH_MARGIN = 1.5
+
+
+def check(condition, message):
+    print(f"{'ok  ' if condition else 'FAIL'} {message}")
+    return condition
+
+
+def main():
+    stub = load_secrets_stub()
+    server, store = stub.serve(secrets={SECRET_ID: {'username': 'app', 'password': 'first'}}, quiet=True)
+    endpoint = f'http://127.0.0.1:{server.server_port}'
+    cache_file = os.path.join(tempfile.mkdtemp(), 'db-secret.json')
+
+    def provider():
+        return CredentialProvider(secret_name=SECRET_ID, region_name='eu-north-1',
+                                  endpoint_url=endpoint, ttl=TTL,
+                                  refresh_margin=REFRESH_MARGIN, cache_file=cache_file)
+
+    ok = True
+    first = provider()
+    started = time.perf_counter()
+    for _ in range(1000):
+        creds = first.get()
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    ok &= check(creds['password'] == 'first', 'initial credentials loaded')
+    ok &= check(store.get_calls == 1, f'1000 lookups -> {store.get_calls} GetSecretValue call(s) ({elapsed_ms:.1f} ms)')
+    ok &= check(oct(os.stat(cache_file).st_mode & 0o777) == '0o600', 'on-disk cache is private (0600)')
+
+    second = provider()
+    second.get()
+    ok &= check(second.fetch_count == 0, 'second process reuses the on-disk cache')
+
+    first.start_background_refresh()
+    boto3.client('secretsmanager', region_name='eu-north-1', endpoint_url=endpoint).put_secret_value(
+        SecretId=SECRET_ID, SecretString='{"username": "app", "password": "rotated"}'
+    )
+    deadline = time.time() + TTL
+    while time.time() < deadline and first.fetch_count < 2:
+        time.sleep(0.05)
+    ok &= check(first.fetch_count == 2, 'background refresh ran before the TTL expired')
+
+    started = time.perf_counter()
+    creds = first.get()
+    lookup_ms = (time.perf_counter() - started) * 1000
+    ok &= check(creds['password'] == 'rotated', f'rotated password served from cache ({lookup_ms:.3f} ms)')
+
+    server.shutdown()
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""
+Regression check: /user/my_books must not lazy-load per borrow row
+
+Seeds one heavy reader with many borrows, renders every page of their
+history and fails if any page issues more than a fixed number of queries.
+The catalog version behind the conditional GET validators is counted apart:
+each process may read it once per CATALOG_VERSION_TTL seconds.
+
+Usage:
+    python3 check-my-books-queries.py [num_borrows]
+"""
+import math
+import re
+import sys
+import time
+from datetime import datetime, timedelta
+
+from bench_common import make_app, logged_in_client, QueryCounter
+
+from sqlalchemy import insert
+
+from app import db
+from models import User, Book, BookCopy, BorrowTransaction
+from http_caching import CATALOG_VERSION_TTL
+
+MAX_QUERIES_PER_PAGE = 1
+NEXT_LINK = re.compile(r'href="(/user/my_books\?after=[^"]+)"')
+
+
+class VersionReads(QueryCounter):
+    """Count only the reads of the catalog version"""
+
+    def _before(self, conn, cursor, statement, *args):
+        if 'catalog_version' in statement:
+            self.count += 1
+
+
+def seed(num_borrows):
+    reader = User(username='reader', email='reader@example.com', role='user')
+    reader.set_password('password123')
+    db.session.add(reader)
+    db.session.flush()
+
+    db.session.execute(insert(Book), [
+        {'title': f'Title {i}', 'author': f'Author {i}', 'isbn': f'check-{i}'}
+        for i in range(num_borrows)
+    ])
+    book_ids = [row[0] for row in db.session.query(Book.book_id)]
+    db.session.execute(insert(BookCopy), [
+        {'book_id': book_id, 'status': 'borrowed'} for book_id in book_ids
+    ])
+    copy_ids = [row[0] for row in db.session.query(BookCopy.copy_id)]
+    start = datetime.utcnow() - timedelta(days=365)
+    db.session.execute(insert(BorrowTransaction), [
+        {'user_id': reader.user_id, 'copy_id': copy_id,
+         'borrow_date': start + timedelta(hours=i), 'due_date': start + timedelta(hours=i, days=14)}
+        for i, copy_id in enumerate(copy_ids)
+    ])
+    db.session.commit()
+    return reader
+
+
+def main():
+    num_borrows = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    app = make_app(with_routes=True)
+    client = logged_in_client(app, seed(num_borrows))
+    db.session.remove()
+
+    url, pages, rows, worst, version_reads = '/user/my_books', 0, 0, 0, 0
+    started = time.perf_counter()
+    while url:
+        with QueryCounter(db.engine) as queries, VersionReads(db.engine) as versions:
+            response = client.get(url)
+        if response.status_code != 200:
+            sys.exit(f"FAIL: {url} returned {response.status_code}")
+        html = response.get_data(as_text=True)
+        pages += 1
+        rows += html.count('class="return-btn"')
+        worst = max(worst, queries.count - versions.count)
+        version_reads += versions.count
+        match = NEXT_LINK.search(html)
+        url = match.group(1).replace('&amp;', '&') if match else None
+
+    elapsed = time.perf_counter() - started
+    max_version_reads = math.ceil(elapsed / CATALOG_VERSION_TTL) if CATALOG_VERSION_TTL > 0 else pages
+    print(f"pages={pages} rows={rows} max_queries_per_page={worst} "
+          f"version_reads={version_reads} in {elapsed:.2f}s")
+    if rows != num_borrows:
+        sys.exit(f"FAIL: rendered {rows} borrows, expected {num_borrows}")
+    if worst > MAX_QUERIES_PER_PAGE:
+        sys.exit(f"FAIL: a page issued {worst} queries (max {MAX_QUERIES_PER_PAGE})")
+    if version_reads > max_version_reads:
+        sys.exit(f"FAIL: read the catalog version {version_reads} times (max {max_version_reads})")
+    print("OK")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+"""
+Load test: sync vs gevent gunicorn workers under many concurrent users
+
+Starts the real app under gunicorn once per worker class (same number of
+workers each time), runs `users` concurrent clients against it for a fixed
+duration and reports requests/sec, p50/p99 latency and errors.
+
+Without BENCH_DATABASE_URL only /login can be served, which is CPU-bound
+template rendering; point it at a Postgres database to measure the
+database-bound pages the gevent mode is meant for. A local database is
+reached through a proxy adding --db-latency-ms of round-trip time, roughly
+what a pod sees talking to RDS (use 0 for a remote database). LOADTEST_USERNAME / LOADTEST_PASSWORD log the clients in
+first so dashboard pages can be requested.
+
+Usage:
+    BENCH_DATABASE_URL=postgresql+psycopg2://user:pass@db/app \
+        python3 load-test.py --users 500 --duration 30 --path /health/db
+    python3 load-test.py --url http://localhost:5000 --path /login   # existing server
+"""
+import argparse
+import asyncio
+import os
+import resource
+import statistics
+import time
+import urllib.parse
+import urllib.request
+from http.cookiejar import CookieJar
+
+from contextlib import nullcontext
+
+from bench_common import DATABASE_URL, app_environment, latency_proxy, running_gunicorn
+
+REQUEST_TIMEOUT = 30
+
+
+async def fetch(host, port, path, cookie):
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        headers = f'GET {path} HTTP/1.1\r\nHost: {host}:{port}\r\nConnection: close\r\n'
+        if cookie:
+            headers += f'Cookie: {cookie}\r\n'
+        writer.write((headers + '\r\n').encode())
+        await writer.drain()
+        status_line = await reader.readline()
+        await reader.read()  # drain the body until the server closes
+        return int(status_line.split()[1])
+    finally:
+        writer.close()
+
+
+async def user_loop(host, port, path, cookie, deadline, latencies, errors):
+    while time.perf_counter() < deadline:
+        started = time.perf_counter()
+        try:
+            status = await asyncio.wait_for(fetch(host, port, path, cookie), REQUEST_TIMEOUT)
+        except (OSError, asyncio.TimeoutError, ValueError, IndexError):
+            status = None
+        if status is not None and status < 400:
+            latencies.append(time.perf_counter() - started)
+        else:
+            errors.append(status)
+
+
+async def run_load(base_url, path, users, duration, cookie):
+    url = urllib.parse.urlparse(base_url)
+    latencies, errors = [], []
+    deadline = time.perf_counter() + duration
+    started = time.perf_counter()
+    await asyncio.gather(*(
+        user_loop(url.hostname, url.port or 80, path, cookie, deadline, latencies, errors)
+        for _ in range(users)
+    ))
+    return latencies, errors, time.perf_counter() - started
+
+
+def login_cookie(base_url):
+    username = os.getenv('LOADTEST_USERNAME')
+    if not username:
+        return None
+    jar = CookieJar()
+    opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(jar))
+    form = urllib.parse.urlencode({'username': username,
+                                   'password': os.getenv('LOADTEST_PASSWORD', '')}).encode()
+    opener.open(base_url + '/login', form).read()
+    return '; '.join(f'{c.name}={c.value}' for c in jar)
+
+
+def report(label, latencies, errors, elapsed):
+    if latencies:
+        ordered = sorted(latencies)
+        p50 = statistics.median(ordered) * 1000
+        p99 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))] * 1000
+    else:
+        p50 = p99 = float('nan')
+    print(f"  {label:<8} {len(latencies) / elapsed:8.1f} req/s   p50 {p50:8.1f} ms   "
+          f"p99 {p99:8.1f} ms   errors {len(errors)}")
+
+
+def raise_open_file_limit(users):
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    wanted = min(hard, max(soft, users * 2 + 256))
+    if wanted > soft:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (wanted, hard))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--users', type=int, default=500)
+    parser.add_argument('--duration', type=float, default=20)
+    parser.add_argument('--path', default='/health/db' if DATABASE_URL.startswith('postgresql') else '/login')
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--modes', default='sync,gevent',
+                        help='Comma-separated GUNICORN_WORKER_CLASS values to compare.')
+    parser.add_argument('--db-latency-ms', type=float, default=2.0)
+    parser.add_argument('--url', help='Load an already running server instead of starting gunicorn.')
+    args = parser.parse_args()
+    raise_open_file_limit(args.users)
+
+    print(f'{args.users} concurrent users on {args.path} for {args.duration:.0f}s')
+    if args.url:
+        result = asyncio.run(run_load(args.url, args.path, args.users, args.duration,
+                                      login_cookie(args.url)))
+        report('server', *result)
+        return
+
+    db = urllib.parse.urlparse(DATABASE_URL)
+    proxy = nullcontext()
+    if db.scheme.startswith('postgresql') and args.db_latency_ms > 0:
+        proxy = latency_proxy(db.hostname, db.port or 5432, args.db_latency_ms)
+        print(f'database behind a proxy adding {args.db_latency_ms:g} ms round trip')
+
+    with proxy as db_address:
+        env, server, _ = app_environment(db_address=db_address)
+        for mode in args.modes.split(','):
+            with running_gunicorn(env, GUNICORN_WORKER_CLASS=mode,
+                                  GUNICORN_WORKERS=args.workers) as (base_url, _):
+                result = asyncio.run(run_load(base_url, args.path, args.users, args.duration,
+                                              login_cookie(base_url)))
+            report(mode, *result)
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+"""
+Minimal local stand-in for a Redis server
+
+Speaks enough of the Redis protocol (RESP2) for the catalog cache's redis
+backend: PING, GET, MGET, SET with EX/PX/NX/XX, DEL/UNLINK, EXISTS, DBSIZE,
+FLUSHDB/FLUSHALL, SELECT and CLIENT. Keys live in memory and expire lazily,
+so the shared cache can be exercised without a real server:
+
+    python3 redis-stub.py --port 6379
+    CATALOG_CACHE_BACKEND=redis CATALOG_CACHE_REDIS_URL=redis://127.0.0.1:6379/0 \
+        gunicorn -c gunicorn.conf.py 'app:create_app()'
+"""
+import argparse
+import socketserver
+import sys
+import threading
+import time
+
+
+class KeyStore:
+    def __init__(self):
+        self.values = {}  # key -> (value, expires_at or None)
+        self.commands = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        entry = self.values.get(key)
+        if entry is None:
+            return None
+        value, expires_at = entry
+        if expires_at is not None and expires_at <= time.monotonic():
+            del self.values[key]
+            return None
+        return value
+
+
+class ProtocolError(Exception):
+    pass
+
+
+def read_command(stream):
+    """Return the next command as a list of bytes, or None at end of stream"""
+    line = stream.readline()
+    if not line:
+        return None
+    if not line.startswith(b'*'):
+        return line.split()  # inline command, e.g. from telnet
+    args = []
+    for _ in range(int(line[1:])):
+        header = stream.readline()
+        if not header.startswith(b'$'):
+            raise ProtocolError('expected bulk string')
+        length = int(header[1:])
+        args.append(stream.read(length + 2)[:-2])
+    return args
+
+
+def encode(reply):
+    if reply is None:
+        return b'$-1\r\n'
+    if isinstance(reply, ProtocolError):
+        return b'-ERR ' + str(reply).encode() + b'\r\n'
+    if isinstance(reply, str):
+        return b'+' + reply.encode() + b'\r\n'
+    if isinstance(reply, int):
+        return b':' + str(reply).encode() + b'\r\n'
+    if isinstance(reply, bytes):
+        return b'$' + str(len(reply)).encode() + b'\r\n' + reply + b'\r\n'
+    return b'*' + str(len(reply)).encode() + b'\r\n' + b''.join(encode(item) for item in reply)
+
+
+def execute(store, name, args):
+    if name == 'PING':
+        return args[0] if args else 'PONG'
+    if name in ('CLIENT', 'SELECT'):
+        return 'OK'
+    if name == 'GET':
+        return store.get(args[0])
+    if name == 'MGET':
+        return [store.get(key) for key in args]
+    if name == 'SET':
+        key, value, options = args[0], args[1], [arg.upper() for arg in args[2:]]
+        expires_at = None
+        for unit, scale in ((b'EX', 1.0), (b'PX', 0.001)):
+            if unit in options:
+                expires_at = time.monotonic() + int(args[2 + options.index(unit) + 1]) * scale
+        exists = store.get(key) is not None
+        if (b'NX' in options and exists) or (b'XX' in options and not exists):
+            return None
+        store.values[key] = (value, expires_at)
+        return 'OK'
+    if name in ('DEL', 'UNLINK'):
+        return sum(store.values.pop(key, None) is not None for key in args)
+    if name == 'EXISTS':
+        return sum(store.get(key) is not None for key in args)
+    if name == 'DBSIZE':
+        return len(store.values)
+    if name in ('FLUSHDB', 'FLUSHALL'):
+        store.values.clear()
+        return 'OK'
+    return ProtocolError(f"unknown command '{name}'")
+
+
+def make_handler(store):
+    class Handler(socketserver.StreamRequestHandler):
+        def handle(self):
+            while True:
+                try:
+                    command = read_command(self.rfile)
+                except (ProtocolError, ValueError) as e:
+                    self.wfile.write(encode(ProtocolError(str(e))))
+                    return
+                if command is None:
+                    return
+                if not command:
+                    continue
+                with store.lock:
+                    store.commands += 1
+                    reply = execute(store, command[0].decode().upper(), command[1:])
+                self.wfile.write(encode(reply))
+
+    return Handler
+
+
+class Server(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+def serve(port=0):
+    """Start the stub in a daemon thread; return (server, store)"""
+    store = KeyStore()
+    server = Server(('127.0.0.1', port), make_handler(store))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, store
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--port', type=int, default=6379)
+    args = parser.parse_args()
+
+    server, _ = serve(args.port)
+    print(f'Redis stub on redis://127.0.0.1:{server.server_address[1]}/0', file=sys.stderr)
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
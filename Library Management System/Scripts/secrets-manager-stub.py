@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+"""
+Minimal local stand-in for the AWS Secrets Manager API
+
+Implements GetSecretValue and PutSecretValue (the JSON 1.1 protocol boto3
+speaks) over plain HTTP, with secrets kept in memory, so the credential
+cache and rotation can be exercised without AWS:
+
+    python3 secrets-manager-stub.py --port 4566 --username app --password secret
+    DB_SECRET_ENDPOINT_URL=http://127.0.0.1:4566 AWS_ACCESS_KEY_ID=x \
+        AWS_SECRET_ACCESS_KEY=x gunicorn -c gunicorn.conf.py 'app:create_app()'
+
+Rotate with:
+    aws --endpoint-url http://127.0.0.1:4566 secretsmanager put-secret-value \
+        --secret-id rds/app-db-credentials \
+        --secret-string '{"username": "app", "password": "rotated"}'
+"""
+import argparse
+import json
+import sys
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class SecretStore:
+    def __init__(self):
+        self.secrets = {}
+        self.get_calls = 0
+        self.lock = threading.Lock()
+
+    def put(self, name, secret_string):
+        with self.lock:
+            version = str(uuid.uuid4())
+            self.secrets[name] = (secret_string, version, time.time())
+            return version
+
+
+def make_handler(store):
+    class Handler(BaseHTTPRequestHandler):
+        def _reply(self, status, body):
+            data = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/x-amz-json-1.1')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def _not_found(self, name):
+            self._reply(400, {
+                '__type': 'ResourceNotFoundException',
+                'Message': f"Secrets Manager can't find the specified secret: {name}",
+            })
+
+        def do_POST(self):
+            action = self.headers.get('X-Amz-Target', '').rpartition('.')[2]
+            length = int(self.headers.get('Content-Length') or 0)
+            params = json.loads(self.rfile.read(length) or b'{}')
+            name = params.get('SecretId')
+
+            if action == 'GetSecretValue':
+                with store.lock:
+                    store.get_calls += 1
+                    entry = store.secrets.get(name)
+                if entry is None:
+                    return self._not_found(name)
+                secret_string, version, created = entry
+                return self._reply(200, {
+                    'ARN': f'arn:aws:secretsmanager:local:000000000000:secret:{name}',
+                    'Name': name,
+                    'SecretString': secret_string,
+                    'VersionId': version,
+                    'VersionStages': ['AWSCURRENT'],
+                    'CreatedDate': created,
+                })
+            if action == 'PutSecretValue':
+                if name not in store.secrets:
+                    return self._not_found(name)
+                version = store.put(name, params['SecretString'])
+                return self._reply(200, {'Name': name, 'VersionId': version,
+                                         'VersionStages': ['AWSCURRENT']})
+            self._reply(400, {'__type': 'InvalidRequestException',
+                              'Message': f'Unsupported action: {action}'})
+
+        def log_message(self, fmt, *args):
+            print(f'[stub] {self.headers.get("X-Amz-Target", "")} {fmt % args}', file=sys.stderr)
+
+    return Handler
+
+
+def serve(port=0, secrets=None, quiet=False):
+    """Start the stub in a daemon thread; return (server, store)"""
+    store = SecretStore()
+    for name, secret in (secrets or {}).items():
+        store.put(name, json.dumps(secret))
+    handler = make_handler(store)
+    if quiet:
+        handler.log_message = lambda *args: None
+    server = ThreadingHTTPServer(('127.0.0.1', port), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, store
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--port', type=int, default=4566)
+    parser.add_argument('--secret-id', default='rds/app-db-credentials')
+    parser.add_argument('--username', default='app')
+    parser.add_argument('--password', default='app')
+    args = parser.parse_args()
+
+    server, _ = serve(args.port, {args.secret_id: {'username': args.username,
+                                                   'password': args.password}})
+    print(f'Secrets Manager stub on http://127.0.0.1:{server.server_port} '
+          f'serving {args.secret_id}', file=sys.stderr)
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()